@@ -0,0 +1,165 @@
+"""Admission control for the analysis endpoints - rate limits, concurrency and load shedding
+
+Three gates run before an upload is decoded:
+
+    RateLimiter          token bucket per client: `burst` analyses at once,
+                         refilled at `rate` per second (429 + Retry-After);
+                         charged only for uploads the result cache misses
+    AdmissionController  at most max_concurrent analyses run; up to
+                         max_waiting more wait up to wait_seconds for a slot,
+                         everything beyond that is shed (503 + Retry-After)
+    size / duration      caps checked on the request and the file header
+
+An admitted request learns how loaded the service was when it got its slot
+(Admission.degradation), so the pipeline can do less work instead of making
+everyone wait: skip SHAP (still available later via /explain) once requests
+queue for a slot, and also shorten the analysed clip when the wait queue is
+half full.
+
+Limits are per process - under a prefork server each worker enforces its own.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+SKIP_SHAP = 'skip_shap'
+SHORT_CLIP = 'short_clip'
+
+
+class RateLimited(Exception):
+    """Raised when a client has used up its token bucket"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Rate limit exceeded - retry in {retry_after:.1f} s')
+        self.retry_after = retry_after
+
+
+class Overloaded(Exception):
+    """Raised when no analysis slot frees up in time"""
+
+    def __init__(self, message, retry_after=5.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst):
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+
+class RateLimiter:
+    """Per-client token buckets, the least recently seen clients evicted beyond max_clients"""
+
+    def __init__(self, rate=1.0, burst=5, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._limited = 0
+
+    def check(self, client, cost=1.0):
+        """Take cost tokens for client, or raise RateLimited (rate <= 0 disables limiting)"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.pop(client, None) or TokenBucket(self.burst)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            self._buckets[client] = bucket
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+
+            # A cost above the burst (a big batch) can only run from a full bucket
+            cost = min(cost, self.burst)
+            if bucket.tokens < cost:
+                self._limited += 1
+                raise RateLimited((cost - bucket.tokens) / self.rate)
+            bucket.tokens -= cost
+
+    def stats(self):
+        with self._lock:
+            return {'clients': len(self._buckets), 'limited': self._limited}
+
+
+class Admission:
+    """What an admitted request should do, given the load when it got its slot"""
+    __slots__ = ('waited', 'degradation')
+
+    def __init__(self, waited, degradation):
+        self.waited = waited
+        self.degradation = degradation
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded, time-limited wait queue"""
+
+    def __init__(self, max_concurrent=2, max_waiting=8, wait_seconds=10.0, shed=True):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self.shed = shed
+        self._slots = threading.Semaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._counters = {'admitted': 0, 'rejected': 0, 'timed_out': 0, 'degraded': 0}
+
+    def _degradation(self, waiting):
+        if not self.shed:
+            return ()
+        degradation = []
+        if waiting:
+            degradation.append(SKIP_SHAP)
+        if self.max_waiting and waiting >= max(1, self.max_waiting // 2):
+            degradation.append(SHORT_CLIP)
+        return tuple(degradation)
+
+    @contextmanager
+    def admit(self):
+        """Hold an analysis slot for the block; yields an Admission or raises Overloaded"""
+        with self._lock:
+            if not self._slots.acquire(blocking=False):
+                if self._waiting >= self.max_waiting:
+                    self._counters['rejected'] += 1
+                    raise Overloaded(f'Server busy - {self.max_concurrent} analyses running, '
+                                     f'{self._waiting} waiting')
+                self._waiting += 1
+                waited = True
+            else:
+                waited = False
+
+        if waited:
+            acquired = self._slots.acquire(timeout=self.wait_seconds)
+            with self._lock:
+                self._waiting -= 1
+                if not acquired:
+                    self._counters['timed_out'] += 1
+                    raise Overloaded(f'Server busy - no analysis slot within {self.wait_seconds:g} s')
+
+        with self._lock:
+            self._active += 1
+            self._counters['admitted'] += 1
+            # Waiting requests still queued behind this one decide how much to shed
+            admission = Admission(waited, self._degradation(self._waiting + waited))
+            if admission.degradation:
+                self._counters['degraded'] += 1
+        try:
+            yield admission
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {'active': self._active, 'waiting': self._waiting, 'max_concurrent': self.max_concurrent,
+                    'max_waiting': self.max_waiting, **self._counters}
@@ -0,0 +1,630 @@
+"""Audio feature extraction - the 34 features the genre model was trained on
+
+Everything here is model-free, so process-pool workers can import it without
+loading the pickled models.
+"""
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+import librosa
+import numpy as np
+
+from audio_decoding import decode_audio, resample_type
+
+logger = logging.getLogger(__name__)
+
+
+# Feature layout the scaler and model were trained on - ORDER MATTERS
+FEATURE_NAMES = (['tempo']
+                 + [f'mfcc_{i}' for i in range(13)]
+                 + [f'chroma_{i}' for i in range(12)]
+                 + [f'spectral_contrast_{i}' for i in range(7)]
+                 + ['tonnetz_0'])
+
+# librosa defaults used when the training features were extracted
+SAMPLE_RATE = 22050
+CLIP_DURATION = 30.0
+N_FFT = 2048
+HOP_LENGTH = 512
+
+# Chroma and tempo estimators a fidelity profile can choose
+CQT = 'cqt'
+STFT = 'stft'
+TEMPOGRAM = 'tempogram'
+AUTOCORRELATION = 'autocorrelation'
+MAX_TEMPO = 320.0
+
+
+class FidelityProfile:
+    """Extraction settings for one latency / accuracy trade-off - exact is what the model was trained on"""
+
+    def __init__(self, name, description, hop_length=HOP_LENGTH, chroma=CQT, tempo=TEMPOGRAM,
+                 clip_seconds=CLIP_DURATION):
+        self.name = name
+        self.description = description
+        self.hop_length = hop_length
+        self.chroma = chroma
+        self.tempo = tempo
+        self.clip_seconds = clip_seconds
+
+    def frontend_options(self):
+        """Keyword arguments for SpectralFrontend"""
+        return {'hop_length': self.hop_length, 'chroma': self.chroma, 'tempo_method': self.tempo}
+
+    def settings(self):
+        return {'hop_length': self.hop_length, 'chroma': self.chroma, 'tempo': self.tempo,
+                'clip_seconds': self.clip_seconds, 'description': self.description}
+
+    def __repr__(self):
+        return f'FidelityProfile({self.name!r})'
+
+
+EXACT_PROFILE = FidelityProfile('exact', 'Training settings - 512-sample hop, CQT chroma, tempogram tempo, 30 s')
+# Pooled means barely move with a coarser hop; one autocorrelation replaces the per-frame tempogram
+BALANCED_PROFILE = FidelityProfile('balanced', '1024-sample hop and a single-autocorrelation tempo',
+                                   hop_length=1024, tempo=AUTOCORRELATION)
+# STFT chroma skips the CQT (the most expensive transform) but shifts the chroma features
+FAST_PROFILE = FidelityProfile('fast', '1024-sample hop, STFT chroma, autocorrelation tempo, first 15 s',
+                               hop_length=1024, chroma=STFT, tempo=AUTOCORRELATION, clip_seconds=15.0)
+PROFILES = {profile.name: profile for profile in (EXACT_PROFILE, BALANCED_PROFILE, FAST_PROFILE)}
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the wall time of the block to timings[stage] (no-op when timings is None)"""
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+class SpectralFrontend:
+    """Shared spectral representations of one clip - every transform runs ONCE
+
+    beat_track, mfcc, chroma_cqt, spectral_contrast and tonnetz each rebuild their
+    own STFT/mel/CQT when called with y=. Feeding them these precomputed inputs
+    gives the same numbers the model was trained on at a fraction of the cost.
+
+    y may also be a (windows, samples) stack of equal-length windows: every
+    transform then runs once over the whole stack (librosa's multichannel
+    support) and window_features() pools each window separately.
+
+    chroma (CQT or STFT) and tempo_method (TEMPOGRAM or AUTOCORRELATION) come
+    from a FidelityProfile; the defaults are the training settings.
+
+    Pass a dict as timings to collect seconds spent per stage.
+    """
+
+    def __init__(self, y, sr, n_fft=N_FFT, hop_length=HOP_LENGTH, timings=None, chroma=CQT,
+                 tempo_method=TEMPOGRAM):
+        self.y = y
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.timings = timings
+        self.tempo_method = tempo_method
+        self._spectral_contrast = None
+
+        with timed(timings, 'spectrogram'):
+            # Magnitude STFT feeds spectral contrast, its square feeds the mel bank
+            self.magnitude = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
+            self.power = self.magnitude ** 2
+
+            # Log-mel is what both mfcc() and onset_strength() build internally
+            self.mel = librosa.feature.melspectrogram(S=self.power, sr=sr)
+            if y.ndim == 1:
+                self.log_mel = librosa.power_to_db(self.mel)
+            else:
+                # power_to_db's top_db floor is relative to the maximum, so it stays per window
+                self.log_mel = np.stack([librosa.power_to_db(mel) for mel in self.mel])
+
+        with timed(timings, 'onset'):
+            # Same median-aggregated onset envelope beat_track() computes for itself
+            self.onset_envelope = librosa.onset.onset_strength(
+                S=self.log_mel, sr=sr, n_fft=n_fft, hop_length=hop_length, aggregate=np.median)
+
+        with timed(timings, 'chroma'):
+            # One chroma shared by the chroma features AND tonnetz
+            if y.ndim == 1:
+                self.chroma = self._chroma(y, self.power, chroma)
+            else:
+                # Both chroma kinds estimate tuning over their whole input - keep windows independent
+                self.chroma = np.stack([self._chroma(window, power, chroma) for window, power in zip(y, self.power)])
+
+    def _chroma(self, y, power, method):
+        if method == STFT:
+            # Folded from the power spectrogram already computed - no CQT at all
+            return librosa.feature.chroma_stft(S=power, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length)
+        return librosa.feature.chroma_cqt(y=y, sr=self.sr, hop_length=self.hop_length)
+
+    @classmethod
+    def from_frames(cls, frames, sr, n_fft=N_FFT, hop_length=HOP_LENGTH, timings=None, chroma=CQT,
+                    tempo_method=TEMPOGRAM):
+        """Rebuild a single-clip frontend from stored frames() - no audio, no STFT, no CQT
+
+        chroma is accepted so profile.frontend_options() can be passed; the stored chroma is used as is.
+        """
+        frontend = cls.__new__(cls)
+        frontend.y = None
+        frontend.sr = sr
+        frontend.n_fft = n_fft
+        frontend.hop_length = hop_length
+        frontend.timings = timings
+        frontend.tempo_method = tempo_method
+        frontend.magnitude = frontend.power = None
+        frontend.mel = np.asarray(frames['mel'])
+        with timed(timings, 'spectrogram'):
+            frontend.log_mel = librosa.power_to_db(frontend.mel)
+        frontend.onset_envelope = np.asarray(frames['onset_envelope'])
+        frontend.chroma = np.asarray(frames['chroma'])
+        frontend._spectral_contrast = np.asarray(frames['spectral_contrast'])
+        return frontend
+
+    def spectral_contrast(self):
+        """Spectral contrast frames, computed from the magnitude STFT once"""
+        if self._spectral_contrast is None:
+            with timed(self.timings, 'contrast'):
+                self._spectral_contrast = librosa.feature.spectral_contrast(
+                    S=self.magnitude, sr=self.sr, n_fft=self.n_fft, hop_length=self.hop_length)
+        return self._spectral_contrast
+
+    def frames(self):
+        """The representations every feature is pooled from - what a FrameStore keeps"""
+        return {
+            'mel': self.mel,
+            'chroma': self.chroma,
+            'onset_envelope': self.onset_envelope,
+            'spectral_contrast': self.spectral_contrast()
+        }
+
+    def tempo(self):
+        """Tempo as beat_track() reports it, without running the beat tracker itself"""
+        # beat_track() reports 0 BPM when there are no onsets at all
+        if not self.onset_envelope.any():
+            return 0.0
+        with timed(self.timings, 'tempo'):
+            if self.tempo_method == AUTOCORRELATION:
+                return autocorrelation_tempo(self.onset_envelope, self.sr, self.hop_length)
+            tempo = librosa.feature.tempo(onset_envelope=self.onset_envelope, sr=self.sr,
+                                          hop_length=self.hop_length)
+        # FIX: Proper tempo handling to avoid numpy deprecation warning
+        if isinstance(tempo, np.ndarray):
+            return float(tempo[0]) if len(tempo) > 0 else 120.0
+        return float(tempo)
+
+    def frame_features(self):
+        """Frame-level feature matrices (features x frames) before averaging"""
+        with timed(self.timings, 'mfcc'):
+            mfcc = librosa.feature.mfcc(S=self.log_mel, n_mfcc=13)
+        spectral_contrast = self.spectral_contrast()
+        with timed(self.timings, 'tonnetz'):
+            tonnetz = librosa.feature.tonnetz(sr=self.sr, chroma=self.chroma)
+        return {
+            'mfcc': mfcc,
+            'chroma': self.chroma,
+            'spectral_contrast': spectral_contrast,
+            'tonnetz': tonnetz
+        }
+
+    def window_features(self):
+        """34 features per window of a stacked (windows, samples) frontend"""
+        frames = self.frame_features()
+        with timed(self.timings, 'tempo'):
+            if self.tempo_method == AUTOCORRELATION:
+                tempos = np.array([[autocorrelation_tempo(envelope, self.sr, self.hop_length)]
+                                   for envelope in self.onset_envelope])
+            else:
+                tempos = librosa.feature.tempo(onset_envelope=self.onset_envelope, sr=self.sr,
+                                               hop_length=self.hop_length)
+        return [pool_features(float(tempos[i, 0]) if self.onset_envelope[i].any() else 0.0,
+                              {name: matrix[i] for name, matrix in frames.items()})
+                for i in range(len(self.y))]
+
+
+def autocorrelation_tempo(onset_envelope, sr, hop_length, start_bpm=120.0, std_bpm=1.0, ac_seconds=8.0):
+    """Tempo from ONE autocorrelation of the whole onset envelope
+
+    feature.tempo() autocorrelates every frame's window (the tempogram) and
+    averages them; this skips straight to a single global autocorrelation with
+    the same log-normal prior around start_bpm. 0.0 when there are no onsets.
+    """
+    if not onset_envelope.any():
+        return 0.0
+    max_lag = min(len(onset_envelope), int(ac_seconds * sr / hop_length))
+    autocorrelation = librosa.autocorrelate(onset_envelope - onset_envelope.mean(), max_size=max_lag)
+    bpms = librosa.tempo_frequencies(max_lag, sr=sr, hop_length=hop_length)
+    with np.errstate(divide='ignore'):
+        prior = np.exp(-0.5 * ((np.log2(bpms) - np.log2(start_bpm)) / std_bpm) ** 2)
+    prior[bpms > MAX_TEMPO] = 0.0
+    return float(bpms[np.argmax(np.maximum(autocorrelation, 0.0) * prior)])
+
+
+def pool_features(tempo, frames):
+    """Collapse frame-level matrices into the 34 training features (in exact order)"""
+    features = {'tempo': float(tempo)}
+
+    mfcc_means = np.mean(frames['mfcc'], axis=1)
+    for i in range(13):
+        features[f'mfcc_{i}'] = float(mfcc_means[i])
+
+    chroma_means = np.mean(frames['chroma'], axis=1)
+    for i in range(12):
+        features[f'chroma_{i}'] = float(chroma_means[i])
+
+    contrast_means = np.mean(frames['spectral_contrast'], axis=1)
+    for i in range(7):
+        features[f'spectral_contrast_{i}'] = float(contrast_means[i])
+
+    features['tonnetz_0'] = float(np.mean(frames['tonnetz'][0]))
+    return features
+
+
+def features_from_signal(y, sr, timings=None, profile=EXACT_PROFILE):
+    """Compute the 34 features for an already decoded signal"""
+    logger.debug("🌊 Computing shared spectral frontend...")
+    frontend = SpectralFrontend(y, sr, timings=timings, **profile.frontend_options())
+
+    logger.debug("🎼 Pooling tempo, MFCC, chroma, spectral contrast and tonnetz...")
+    features = features_from_frontend(frontend)
+
+    # Verify feature count
+    if len(features) != len(FEATURE_NAMES):
+        logger.warning("⚠️ Expected %d features, got %d", len(FEATURE_NAMES), len(features))
+
+    return features
+
+
+def features_from_windows(windows, sr, timings=None, profile=EXACT_PROFILE):
+    """34 features for each window - equal-length windows share ONE batched frontend pass"""
+    features = [None] * len(windows)
+    by_length = {}
+    for i, window in enumerate(windows):
+        by_length.setdefault(len(window), []).append(i)
+    for indices in by_length.values():
+        if len(indices) == 1:
+            features[indices[0]] = features_from_signal(windows[indices[0]], sr, timings, profile)
+            continue
+        frontend = SpectralFrontend(np.stack([windows[i] for i in indices]), sr, timings=timings,
+                                    **profile.frontend_options())
+        for i, window_features in zip(indices, frontend.window_features()):
+            features[i] = window_features
+    return features
+
+
+def iter_window_batches(source, filename='', window_seconds=10.0, max_windows=6, batch_size=2, timings=None,
+                        profile=EXACT_PROFILE):
+    """Yield lists of (start, end, features) for consecutive windows, batch_size at a time
+
+    Each batch decodes only its own span, so a caller that stops iterating
+    early never decodes the rest of the file. A short trailing window is
+    dropped unless it is the only one. The windows set the analysed span, so
+    only the profile's frontend settings apply (not its clip length).
+    """
+    produced = 0
+    while produced < max_windows:
+        count = min(batch_size, max_windows - produced)
+        offset = produced * window_seconds
+        y, _ = decode_audio(source, filename, SAMPLE_RATE, offset=offset, duration=count * window_seconds,
+                            timings=timings)
+        size = int(window_seconds * SAMPLE_RATE)
+        windows = [y[i:i + size] for i in range(0, len(y), size)]
+        windows = [window for window in windows
+                   if len(window) >= MIN_SEGMENT_SECONDS * SAMPLE_RATE or (produced == 0 and window is windows[0])]
+        if not windows:
+            return
+
+        batch = []
+        for i, features in enumerate(features_from_windows(windows, SAMPLE_RATE, timings, profile)):
+            start = offset + i * window_seconds
+            batch.append((start, start + len(windows[i]) / SAMPLE_RATE, features))
+        yield batch
+
+        produced += len(windows)
+        if len(y) < count * size:
+            return
+
+
+def load_audio_bytes(audio_bytes, filename='', duration=CLIP_DURATION, timings=None):
+    """Decode an upload straight from memory - only the first duration seconds"""
+    return decode_audio(audio_bytes, filename, SAMPLE_RATE, duration=duration, timings=timings)
+
+
+def frontend_signature(profile=EXACT_PROFILE):
+    """Everything that shapes the stored frames - entries made with other settings are recomputed"""
+    chroma = '' if profile.chroma == CQT else f'chroma={profile.chroma};'
+    return (f'sr={SAMPLE_RATE};clip={profile.clip_seconds};n_fft={N_FFT};hop={profile.hop_length};{chroma}'
+            f'resample={resample_type()};librosa={librosa.__version__}')
+
+
+def frame_store_key(audio_source, profile=EXACT_PROFILE):
+    """Content hash, suffixed for non-exact profiles so their frames sit next to the exact ones"""
+    key = content_hash(audio_source)
+    return key if profile is EXACT_PROFILE else f'{key}-{profile.name}'
+
+
+def content_hash(audio_source):
+    """SHA-256 of the audio bytes (the same key the result cache uses for uploads)"""
+    if isinstance(audio_source, (bytes, bytearray)):
+        return hashlib.sha256(audio_source).hexdigest()
+    digest = hashlib.sha256()
+    with open(audio_source, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def features_from_frontend(frontend):
+    """34 features from a single-clip frontend"""
+    return pool_features(frontend.tempo(), frontend.frame_features())
+
+
+def load_frontend(audio_source, filename='', timings=None, frame_store=None, duration=None, profile=EXACT_PROFILE):
+    """Single-clip SpectralFrontend - rebuilt from stored frames when possible, else decoded (and stored)"""
+    source_name = filename or (audio_source if isinstance(audio_source, str) else 'uploaded audio')
+    key = None
+    duration = duration or profile.clip_seconds
+    if frame_store is not None and duration == profile.clip_seconds:
+        with timed(timings, 'hash'):
+            key = frame_store_key(audio_source, profile)
+        with timed(timings, 'frames_load'):
+            frames = frame_store.get(key, frontend_signature(profile))
+        if frames is not None:
+            logger.debug("🗃️ Recomputing features from stored frames for %s", source_name)
+            return SpectralFrontend.from_frames(frames, SAMPLE_RATE, timings=timings, **profile.frontend_options())
+
+    # Load audio (30 second clips like your training data)
+    y, sr = decode_audio(audio_source, filename, SAMPLE_RATE, duration=duration, timings=timings)
+    logger.debug("✅ Audio loaded: %d samples at %d Hz", len(y), sr)
+    frontend = SpectralFrontend(y, sr, timings=timings, **profile.frontend_options())
+
+    if key is not None:
+        try:
+            with timed(timings, 'frames_store'):
+                frame_store.put(key, frontend.frames(), frontend_signature(profile))
+        except OSError as e:
+            logger.warning("⚠️ Could not store frames for %s: %s", source_name, e)
+    return frontend
+
+
+def extract_music_features(audio_source, filename='', timings=None, frame_store=None, duration=None,
+                           profile=EXACT_PROFILE):
+    """Extract 34 music features matching training data exactly - SHARED SPECTRAL FRONTEND
+
+    audio_source is either a file path or the raw bytes of an upload. Pass a dict
+    as timings to collect seconds per stage (decode, spectrogram, onset, ...).
+    With a FrameStore, stored frames are used instead of decoding the audio, and
+    freshly computed frames are stored for next time. profile picks a fidelity
+    (see PROFILES) - anything but EXACT_PROFILE trades agreement with the
+    training features for speed. A duration shorter than the profile's clip
+    (load shedding) analyses less audio and bypasses the store.
+    """
+    try:
+        logger.debug("🎵 Starting feature extraction for: %s",
+                     filename or (audio_source if isinstance(audio_source, str) else 'uploaded audio'))
+        frontend = load_frontend(audio_source, filename, timings, frame_store, duration, profile)
+        features = features_from_frontend(frontend)
+        logger.debug("🎉 Feature extraction complete! Total features: %d", len(features))
+        return features
+        
+    except Exception as e:
+        logger.exception("❌ Error extracting features: %s", e)
+        return None
+
+
+def extract_with_timings(audio_source, filename='', frame_store=None, duration=None, profile=EXACT_PROFILE):
+    """(features, timings) - for process pools, where a timings dict can't be shared"""
+    timings = {}
+    return extract_music_features(audio_source, filename, timings, frame_store, duration, profile), timings
+
+
+# TIMELINE - per-segment trajectories pooled from the SAME frame matrices as the clip features
+
+TIMELINE_SECONDS = 3.0
+TEMPOGRAM_SECONDS = 8.0  # feature.tempo()'s default ac_size
+
+
+def segment_means(matrix, starts):
+    """Mean of each run of frames (last axis) beginning at starts - one reduceat, no Python loop"""
+    counts = np.diff(np.append(starts, matrix.shape[-1]))
+    return np.add.reduceat(matrix, starts, axis=-1) / counts
+
+
+def features_and_timeline(frontend, segment_seconds=TIMELINE_SECONDS):
+    """(34 clip features, timeline) from ONE pass over a single-clip frontend's frame matrices
+
+    timeline['features'] is a (segments, 34) matrix in FEATURE_NAMES order: each
+    row is pooled like the clip features, over that segment's frames only. Tempo
+    per segment comes from the tempogram averaged over the segment, which is
+    how feature.tempo() gets the clip tempo from the whole tempogram.
+    """
+    frames = frontend.frame_features()
+    features = pool_features(frontend.tempo(), frames)
+
+    with timed(frontend.timings, 'timeline'):
+        n_frames = min(matrix.shape[-1] for matrix in frames.values())
+        step = max(1, int(round(segment_seconds * frontend.sr / frontend.hop_length)))
+        starts = np.arange(0, n_frames, step)
+        # A trailing scrap under half a segment joins the previous one
+        if len(starts) > 1 and n_frames - starts[-1] < step / 2:
+            starts = starts[:-1]
+        pooled = {name: segment_means(matrix[..., :n_frames], starts) for name, matrix in frames.items()}
+
+        envelope = frontend.onset_envelope[:n_frames]
+        win_length = int(librosa.time_to_frames(TEMPOGRAM_SECONDS, sr=frontend.sr, hop_length=frontend.hop_length))
+        tempogram = librosa.feature.tempogram(onset_envelope=envelope, sr=frontend.sr,
+                                              hop_length=frontend.hop_length, win_length=win_length)
+        tempos = librosa.feature.tempo(tg=segment_means(tempogram, starts), sr=frontend.sr,
+                                       hop_length=frontend.hop_length, aggregate=None)
+        # Same convention as the clip tempo: no onsets at all means 0 BPM
+        tempos = np.where(np.add.reduceat(envelope, starts) > 0, tempos, 0.0)
+
+        matrix = np.column_stack([tempos, pooled['mfcc'].T, pooled['chroma'].T,
+                                  pooled['spectral_contrast'].T, pooled['tonnetz'][0]])
+        ends = np.append(starts[1:], n_frames)
+    timeline = {
+        'segment_seconds': step * frontend.hop_length / frontend.sr,
+        'starts': starts * frontend.hop_length / frontend.sr,
+        'ends': ends * frontend.hop_length / frontend.sr,
+        'features': matrix
+    }
+    return features, timeline
+
+
+def extract_with_timeline(audio_source, filename='', timings=None, frame_store=None, duration=None,
+                          profile=EXACT_PROFILE, segment_seconds=TIMELINE_SECONDS):
+    """(features, timeline) like extract_music_features, or (None, None) when extraction fails"""
+    try:
+        frontend = load_frontend(audio_source, filename, timings, frame_store, duration, profile)
+        return features_and_timeline(frontend, segment_seconds)
+    except Exception as e:
+        logger.exception("❌ Error extracting timeline: %s", e)
+        return None, None
+
+
+# STREAMING EXTRACTION - whole recordings, one window in memory at a time
+
+SEGMENT_SECONDS = CLIP_DURATION
+MIN_SEGMENT_SECONDS = 3.0
+MAX_SEGMENTS = 240  # two hours of 30 s windows
+
+
+class RunningFeatureMeans:
+    """Frame-weighted running means of the frame-level matrices
+
+    Memory stays constant no matter how long the recording is: only one sum
+    vector per feature group is kept, never the frames themselves.
+    """
+
+    def __init__(self):
+        self.sums = None
+        self.frames = 0
+        self.tempo_sum = 0.0
+
+    def add(self, frames, tempo):
+        """Fold one window's frame matrices (and its tempo) into the running means"""
+        n_frames = frames['mfcc'].shape[1]
+        if self.sums is None:
+            self.sums = {name: np.zeros(matrix.shape[0]) for name, matrix in frames.items()}
+        for name, matrix in frames.items():
+            self.sums[name] += matrix.sum(axis=1)
+        # Tempo is a per-window estimate, weighted by how many frames it covers
+        self.tempo_sum += tempo * n_frames
+        self.frames += n_frames
+
+    def features(self):
+        """The 34 features averaged over everything added so far"""
+        if not self.frames:
+            return None
+        means = {name: (total / self.frames)[:, np.newaxis] for name, total in self.sums.items()}
+        return pool_features(self.tempo_sum / self.frames, means)
+
+
+@contextmanager
+def _as_path(source, filename=''):
+    """Give audioread a real path - spools buffers to a unique temp file when needed"""
+    if isinstance(source, str):
+        yield source
+        return
+
+    suffix = os.path.splitext(filename)[1].lower() or '.audio'
+    fd, temp_path = tempfile.mkstemp(prefix='music_stream_', suffix=suffix)
+    try:
+        source.seek(0)
+        with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(source, f)
+        yield temp_path
+    finally:
+        os.remove(temp_path)
+
+
+def _soundfile_blocks(source, segment_seconds):
+    """Non-overlapping blocks via soundfile, resampled to SAMPLE_RATE one block at a time"""
+    native_sr = librosa.get_samplerate(source)
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    block = max(1, int(round(segment_seconds * native_sr)))
+    for y in librosa.stream(source, block_length=1, frame_length=block, hop_length=block):
+        if native_sr != SAMPLE_RATE:
+            y = librosa.resample(y, orig_sr=native_sr, target_sr=SAMPLE_RATE, res_type=resample_type())
+        yield y
+
+
+def _windowed_loads(path, segment_seconds):
+    """Fallback for formats soundfile can't stream: decode window by window with offsets"""
+    offset = 0.0
+    while True:
+        y, _ = decode_audio(path, sr=SAMPLE_RATE, offset=offset, duration=segment_seconds)
+        if len(y) == 0:
+            return
+        yield y
+        if len(y) < 0.99 * segment_seconds * SAMPLE_RATE:
+            return
+        offset += segment_seconds
+
+
+def iter_audio_segments(source, filename='', segment_seconds=SEGMENT_SECONDS, max_segments=MAX_SEGMENTS):
+    """Yield (start_seconds, y) windows of a full recording at SAMPLE_RATE
+
+    source may be a path, raw bytes or a seekable file object. Only one window
+    is decoded at a time; a short trailing window is dropped unless it is the
+    only one.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    def windows():
+        try:
+            yield from _soundfile_blocks(source, segment_seconds)
+            return
+        except Exception as e:
+            if produced:
+                raise
+            logger.info("↪️ Block streaming unavailable (%s), decoding window by window", e)
+        with _as_path(source, filename) as path:
+            yield from _windowed_loads(path, segment_seconds)
+
+    produced = 0
+    for y in windows():
+        if produced and len(y) < MIN_SEGMENT_SECONDS * SAMPLE_RATE:
+            return
+        yield produced * segment_seconds, y
+        produced += 1
+        if produced >= max_segments:
+            logger.warning("⚠️ Stopping after %d segments", max_segments)
+            return
+
+
+def extract_segment_features(source, filename='', segment_seconds=SEGMENT_SECONDS, max_segments=MAX_SEGMENTS,
+                             timings=None):
+    """Per-segment features plus frame-weighted track-level means, with bounded memory
+
+    Returns (segments, track_features) where each segment is
+    {'start': s, 'end': s, 'features': {...34 features...}}. Stage timings are
+    summed over all segments.
+    """
+    running = RunningFeatureMeans()
+    segments = []
+
+    for start, y in iter_audio_segments(source, filename, segment_seconds, max_segments):
+        frontend = SpectralFrontend(y, SAMPLE_RATE, timings=timings)
+        tempo = frontend.tempo()
+        frames = frontend.frame_features()
+        running.add(frames, tempo)
+        segments.append({
+            'start': start,
+            'end': start + len(y) / SAMPLE_RATE,
+            'features': pool_features(tempo, frames)
+        })
+        logger.debug("🧩 Segment %d done (%.0fs - %.0fs)", len(segments), start, segments[-1]['end'])
+
+    return segments, running.features()
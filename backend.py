@@ -1,87 +1,171 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, g, has_request_context, request, jsonify, render_template_string
 from flask_cors import CORS
-import librosa
 import numpy as np
-import joblib
-import shap
+import json
+import logging
 import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, wraps
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from admission import SHORT_CLIP, SKIP_SHAP, AdmissionController, Overloaded, RateLimited, RateLimiter
+from audio_decoding import probe_duration
+from audio_features import (CLIP_DURATION, EXACT_PROFILE, FEATURE_NAMES, PROFILES, SAMPLE_RATE, TIMELINE_SECONDS, SEGMENT_SECONDS, extract_music_features,
+                            extract_segment_features, extract_with_timeline, extract_with_timings,
+                            features_from_signal,
+                            iter_window_batches, timed)
+from demo_store import DEMO_DIR, STORE_NAME, DemoStore
+from explanations import EXACT, FAST, MODES, OFF, ExplanationService
+from frame_store import FrameStore
+from inference import AUTO as AUTO_BACKEND, TREES_NAME, build_backend
+from instrumentation import SIZE_BUCKETS, MetricsRegistry, configure_logging
+from job_queue import DONE, FAILED, JobQueue, QueueFull
+from live_analysis import FLOAT32, SAMPLE_FORMATS, LiveSessions, SessionLimit
+from model_registry import ArtifactRegistry
+from response_formats import (COMPACT, JSON, MIMETYPES, MSGPACK, accepted_encodings, compact_analysis, compress,
+                              encode, parse_fields, select_fields, wants_msgpack)
+from result_cache import ResultCache, hash_bytes
+from similarity_index import AUTO, SEARCH_MODES, TrackIndex
+
+# WebSocket live mode is optional - chunked HTTP works without it
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
+# Leveled logging instead of prints - MUSIC_LOG_LEVEL / MUSIC_LOG_FORMAT (text|json)
+if not logging.getLogger().handlers:
+    configure_logging()
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
+# Uploads above this are refused with 413 before they are read - MUSIC_MAX_UPLOAD_MB
+app.config['MAX_CONTENT_LENGTH'] = int(float(os.environ.get('MUSIC_MAX_UPLOAD_MB', 200)) * 1024 * 1024)
 
-# Load your saved models
-print("Loading models...")
-try:
-    model = joblib.load('music_classifier.pkl')
-    scaler = joblib.load('feature_scaler.pkl')
-    explainer = joblib.load('shap_explainer.pkl')
-    label_encoder = joblib.load('label_encoder.pkl')
-    le = label_encoder  # Create alias for shorter name
-    print("✅ All models loaded successfully!")
-except Exception as e:
-    print(f"❌ Error loading models: {e}")
-
-# FIXES FOR AUDIO PROCESSING AND SHAP
-
-def extract_music_features(audio_path):
-    """Extract 34 music features matching training data exactly - FIXED TEMPO WARNING"""
+
+# Load your saved models - lazily, on first use or by the background warm-up
+artifacts = ArtifactRegistry(directory=os.environ.get('MUSIC_MODEL_DIR', '.'),
+                             expected_version=os.environ.get('MUSIC_MODEL_VERSION') or None)
+
+# Result cache - keyed by upload hash + model version so retrained models never serve stale results
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('MUSIC_CACHE_ENTRIES', 256)),
+    max_bytes=int(os.environ.get('MUSIC_CACHE_BYTES', 64 * 1024 * 1024)),
+    ttl_seconds=float(os.environ.get('MUSIC_CACHE_TTL', 24 * 3600)),
+    db_path=os.environ.get('MUSIC_CACHE_DB') or None
+)
+
+# SHAP explanations - exact (TreeExplainer), fast (native tree contributions) or off (deferred)
+SHAP_MODE = os.environ.get('MUSIC_SHAP_MODE', EXACT)
+explanation_service = ExplanationService(artifacts)
+
+# Extraction fidelity - exact (training settings) | balanced | fast, per request via ?fidelity=
+FIDELITY = os.environ.get('MUSIC_FIDELITY', EXACT_PROFILE.name)
+if FIDELITY not in PROFILES:
+    raise ValueError(f'MUSIC_FIDELITY must be one of {", ".join(PROFILES)}')
+
+# Inference backend - MUSIC_INFERENCE auto (compiled tree arrays for small batches) | trees | sklearn
+INFERENCE_BACKEND = os.environ.get('MUSIC_INFERENCE', AUTO_BACKEND)
+_inference_backend = None
+_inference_lock = threading.Lock()
+
+
+def get_inference_backend():
+    """The backend for the loaded model, compiled (or read from TREES_NAME) on first use"""
+    global _inference_backend
+    with _inference_lock:
+        if _inference_backend is None:
+            _inference_backend = build_backend(artifacts, INFERENCE_BACKEND,
+                                               trees_path=os.path.join(artifacts.directory, TREES_NAME))
+        return _inference_backend
+
+# Intermediate frames - MUSIC_FRAME_STORE=<dir> keeps each track's spectral frames by content hash,
+# so re-analysing it after a feature or model change skips decoding entirely
+FRAME_STORE_DIR = os.environ.get('MUSIC_FRAME_STORE')
+frame_store = (FrameStore(FRAME_STORE_DIR, compress=os.environ.get('MUSIC_FRAME_STORE_COMPRESS', '0') != '0')
+               if FRAME_STORE_DIR else None)
+
+# Similar-track index - scaled vectors of every analysed upload, one directory per model version
+INDEX_ENABLED = os.environ.get('MUSIC_INDEX', '1') != '0'
+_track_index = None
+
+
+def get_track_index():
+    """The index for the current model version, opened on first use"""
+    global _track_index
+    if _track_index is None:
+        _track_index = TrackIndex(
+            os.path.join(os.environ.get('MUSIC_INDEX_DIR', 'track_index'), artifacts.version),
+            dim=len(FEATURE_NAMES),
+            approx_min_tracks=int(os.environ.get('MUSIC_INDEX_APPROX_MIN', 20000))
+        )
+    return _track_index
+
+
+def index_track(track_id, filename, feature_values_scaled, prediction_proba, prediction):
+    """Remember an analysed track for /similar - never fails the analysis itself"""
+    if not INDEX_ENABLED:
+        return
     try:
-        print(f"🎵 Starting feature extraction for: {audio_path}")
-        
-        # Load audio (30 second clips like your training data)
-        y, sr = librosa.load(audio_path, duration=30.0)
-        print(f"✅ Audio loaded: {len(y)} samples at {sr} Hz")
-        
-        # Initialize feature dictionary in exact order
-        features = {}
-        
-        # 1. TEMPO (1 feature) - FIXED THE NUMPY WARNING
-        print("⏱️ Extracting tempo...")
-        tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-        # FIX: Proper tempo handling to avoid numpy deprecation warning
-        if isinstance(tempo, np.ndarray):
-            features['tempo'] = float(tempo[0]) if len(tempo) > 0 else 120.0
-        else:
-            features['tempo'] = float(tempo)
-        
-        # 2. MFCC FEATURES (13 features: mfcc_0 to mfcc_12)
-        print("🎤 Extracting MFCCs...")
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        for i in range(13):
-            features[f'mfcc_{i}'] = float(np.mean(mfccs[i]))
-        
-        # 3. CHROMA FEATURES (12 features: chroma_0 to chroma_11)
-        print("🎹 Extracting chroma...")
-        chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
-        for i in range(12):
-            features[f'chroma_{i}'] = float(np.mean(chroma[i]))
-        
-        # 4. SPECTRAL CONTRAST (7 features: spectral_contrast_0 to spectral_contrast_6)
-        print("🌈 Extracting spectral contrast...")
-        spectral_contrast = librosa.feature.spectral_contrast(y=y, sr=sr)
-        for i in range(7):
-            features[f'spectral_contrast_{i}'] = float(np.mean(spectral_contrast[i]))
-        
-        # 5. TONNETZ (1 feature: tonnetz_0 only)
-        print("🎼 Extracting tonnetz...")
-        tonnetz = librosa.feature.tonnetz(y=y, sr=sr)
-        features['tonnetz_0'] = float(np.mean(tonnetz[0]))
-        
-        print(f"🎉 Feature extraction complete! Total features: {len(features)}")
-        
-        # Verify feature count
-        if len(features) != 34:
-            print(f"⚠️ Warning: Expected 34 features, got {len(features)}")
-        
-        return features
-        
+        get_track_index().add(track_id, feature_values_scaled, filename=filename,
+                              genre=str(artifacts.label_encoder.classes_[prediction]),
+                              confidence=float(np.max(prediction_proba)))
     except Exception as e:
-        print(f"❌ Error extracting features: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return None
+        logger.warning("⚠️ Could not index %s: %s", filename, e)
+
+# METRICS - per-stage latency, sizes, cache and errors, scraped from /metrics
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram('music_stage_seconds', 'Seconds spent in each pipeline stage', ['stage'])
+upload_bytes = metrics.histogram('music_upload_bytes', 'Size of uploaded audio files', buckets=SIZE_BUCKETS)
+cache_lookups = metrics.counter('music_cache_lookups_total', 'Result cache lookups', ['result'])
+errors_total = metrics.counter('music_errors_total', 'Failed requests and jobs', ['endpoint', 'type'])
+requests_total = metrics.counter('music_requests_total', 'HTTP requests', ['endpoint', 'method', 'status'])
+request_seconds = metrics.histogram('music_request_seconds', 'End-to-end HTTP request latency', ['endpoint'])
+
+
+def record_stages(timings):
+    """Feed a {stage: seconds} dict into the stage histogram"""
+    for stage, seconds in timings.items():
+        stage_seconds.observe(seconds, stage=stage)
+
+
+def record_error(endpoint, error):
+    errors_total.inc(endpoint=endpoint, type=type(error).__name__)
+
+
+def timed_json(payload):
+    """Serialise payload as the request asked (see response_formats) with the serialize stage recorded"""
+    timings = {}
+    with timed(timings, 'serialize'):
+        response = format_response(payload)
+    record_stages(timings)
+    return response
+
+
+def format_response(payload):
+    """?view=compact, ?fields=..., ?format=msgpack / Accept, then br / gzip per Accept-Encoding"""
+    if request.values.get('view') == COMPACT:
+        payload = compact_view(payload)
+    fields = parse_fields(request.values.get('fields'))
+    if fields:
+        payload = select_fields(payload, fields)
+
+    fmt = MSGPACK if wants_msgpack(request.values.get('format'), request.headers.get('Accept')) else JSON
+    body, coding = compress(encode(payload, fmt, app.json.dumps), request.headers.get('Accept-Encoding'))
+    response = Response(body, mimetype=MIMETYPES[fmt])
+    if coding:
+        response.headers['Content-Encoding'] = coding
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
+
+# FIXES FOR AUDIO PROCESSING AND SHAP - extraction lives in audio_features.py
 
 class FeatureTranslator:
     def __init__(self):
@@ -168,37 +252,54 @@ class FeatureTranslator:
         
         return display_names.get(feature_name, feature_name.replace('_', ' ').title())
     
-    def get_interpretation(self, feature_name, value):
-        """COMPLETE INTERPRETATIONS FOR ALL FEATURES"""
+    # Interpretation buckets: (compare abs(value)?, upper bounds, labels).
+    # A value gets the label of the first bound it is below, else the last label.
+    interpretation_buckets = {
+        'tempo': (False, (70, 90, 110, 140), ("Very Slow - Ballad pace",
+                                               "Slow - Relaxed walking pace",
+                                               "Moderate - Comfortable groove",
+                                               "Fast - Energetic and driving",
+                                               "Very Fast - High energy dance pace")),
+        'mfcc': (True, (5, 15), ("Subtle - Gentle characteristic",
+                                 "Moderate - Noticeable quality",
+                                 "Strong - Prominent feature")),
+        'chroma': (False, (0.3, 0.6), ("Weak - Note barely present",
+                                       "Moderate - Note somewhat present",
+                                       "Strong - Note clearly present")),
+        'spectral_contrast': (False, (10, 20), ("Low Contrast - Smooth sound",
+                                                "Moderate Contrast - Balanced",
+                                                "High Contrast - Dynamic sound")),
+        'tonnetz': (True, (0.3, 0.6), ("Stable - Consonant harmony",
+                                       "Moderate - Some tension",
+                                       "Unstable - Dissonant harmony"))
+    }
+
+    def get_interpretation_kind(self, feature_name):
+        """Which interpretation_buckets entry applies to a feature (None = raw value)"""
         if feature_name == 'tempo':
-            if value < 70: return "Very Slow - Ballad pace"
-            elif value < 90: return "Slow - Relaxed walking pace" 
-            elif value < 110: return "Moderate - Comfortable groove"
-            elif value < 140: return "Fast - Energetic and driving"
-            else: return "Very Fast - High energy dance pace"
-        
+            return 'tempo'
         elif 'mfcc' in feature_name:
-            if abs(value) < 5: return "Subtle - Gentle characteristic"
-            elif abs(value) < 15: return "Moderate - Noticeable quality"
-            else: return "Strong - Prominent feature"
-        
+            return 'mfcc'
         elif 'chroma' in feature_name:
-            if value < 0.3: return "Weak - Note barely present"
-            elif value < 0.6: return "Moderate - Note somewhat present"
-            else: return "Strong - Note clearly present"
-        
+            return 'chroma'
         elif 'spectral_contrast' in feature_name:
-            if value < 10: return "Low Contrast - Smooth sound"
-            elif value < 20: return "Moderate Contrast - Balanced"
-            else: return "High Contrast - Dynamic sound"
-        
+            return 'spectral_contrast'
         elif feature_name == 'tonnetz_0':
-            if abs(value) < 0.3: return "Stable - Consonant harmony"
-            elif abs(value) < 0.6: return "Moderate - Some tension"
-            else: return "Unstable - Dissonant harmony"
-        
-        else:
+            return 'tonnetz'
+        return None
+
+    def get_interpretation(self, feature_name, value):
+        """COMPLETE INTERPRETATIONS FOR ALL FEATURES"""
+        kind = self.get_interpretation_kind(feature_name)
+        if kind is None:
             return f"Value: {value:.3f}"
+
+        use_abs, bounds, labels = self.interpretation_buckets[kind]
+        measured = abs(value) if use_abs else value
+        for bound, label in zip(bounds, labels):
+            if measured < bound:
+                return label
+        return labels[-1]
     
     def get_explanation(self, feature_name, value):
         """COMPLETE EXPLANATIONS - FIXED THE MISSING ONES"""
@@ -396,8 +497,139 @@ class FeatureTranslator:
         }
         return units.get(feature_name, 'coefficient')
 
+class FeatureMeta:
+    """Static (value-independent) translation data for one feature"""
+    __slots__ = ('name', 'display_name', 'explanation', 'analogy', 'listen_tip', 'confidence',
+                 'category', 'unit')
+
+    def __init__(self, translator, feature_name):
+        self.name = feature_name
+        self.display_name = translator.get_display_name(feature_name)
+        # None marks explanations that embed the value (e.g. tempo) and are built per request
+        explanation = translator.get_explanation(feature_name, 0.0)
+        self.explanation = explanation if explanation == translator.get_explanation(feature_name, 1.0) else None
+        self.analogy = translator.get_analogy(feature_name)
+        self.listen_tip = translator.get_listen_tip(feature_name)
+        self.confidence = translator.get_confidence(feature_name)
+        self.category = translator.get_category(feature_name)
+        self.unit = translator.get_unit(feature_name)
+
+
+class CompiledTranslator:
+    """FeatureTranslator precompiled for a fixed feature order - built ONCE at startup
+
+    Static strings live in one FeatureMeta per feature index, visual levels and
+    interpretation buckets are computed for the whole vector with NumPy, and
+    the category grouping is fixed up front. Output is identical to calling
+    translate_feature() on every feature and grouping the results.
+    """
+
+    def __init__(self, translator, feature_names):
+        self.translator = translator
+        self.feature_names = list(feature_names)
+        self.meta = [FeatureMeta(translator, name) for name in self.feature_names]
+        n = len(self.feature_names)
+
+        # Visual level: linear range where one is configured, else abs(value) / 20
+        self.ranged = np.array([name in translator.feature_ranges for name in self.feature_names])
+        self.range_min = np.array([translator.feature_ranges.get(name, (0, 1))[0] for name in self.feature_names],
+                                  dtype=float)
+        self.range_span = np.array([translator.feature_ranges.get(name, (0, 1))[1] - self.range_min[i]
+                                    for i, name in enumerate(self.feature_names)], dtype=float)
+
+        # Interpretation: per-feature bounds padded with +inf, labels padded to match
+        kinds = [translator.get_interpretation_kind(name) for name in self.feature_names]
+        width = max(len(bounds) for _, bounds, _ in translator.interpretation_buckets.values())
+        self.interpreted = np.array([kind is not None for kind in kinds])
+        self.use_abs = np.zeros(n, dtype=bool)
+        self.bounds = np.full((n, width), np.inf)
+        self.n_bounds = np.zeros(n, dtype=int)
+        self.labels = []
+        for i, kind in enumerate(kinds):
+            if kind is None:
+                self.labels.append(())
+                continue
+            use_abs, bounds, labels = translator.interpretation_buckets[kind]
+            self.use_abs[i] = use_abs
+            self.bounds[i, :len(bounds)] = bounds
+            self.n_bounds[i] = len(bounds)
+            self.labels.append(labels)
+
+        # Category grouping in first-appearance order, as the per-request loop produced it
+        self.category_members = {}
+        for i, meta in enumerate(self.meta):
+            self.category_members.setdefault(meta.category, []).append(i)
+
+    def visual_levels(self, values):
+        """0-100 visual level for every feature"""
+        raw = np.where(self.ranged, ((values - self.range_min) / self.range_span) * 100,
+                       (np.abs(values) / 20) * 100)
+        # Same clamping expressions as translate_feature(), so edge values serialise identically
+        return [max(0, min(100, level)) if ranged else min(100, max(0, level))
+                for level, ranged in zip(raw.tolist(), self.ranged.tolist())]
+
+    def buckets(self, values):
+        """Index into each feature's interpretation labels"""
+        measured = np.where(self.use_abs, np.abs(values), values)
+        below = measured[:, np.newaxis] < self.bounds
+        # First bound the value is below; NaN is below nothing and lands in the last bucket
+        return np.where(below.any(axis=1), below.argmax(axis=1), self.n_bounds).tolist()
+
+    def translate_vector(self, values):
+        """Translate a full feature vector (in feature_names order) into a list of dicts"""
+        values = [float(value) for value in values]
+        array = np.array(values, dtype=float)
+        levels = self.visual_levels(array)
+        buckets = self.buckets(array)
+
+        translated = []
+        for i, meta in enumerate(self.meta):
+            value = values[i]
+            translated.append({
+                'name': meta.name,
+                'display_name': meta.display_name,
+                'value': value,
+                'visual_level': levels[i],
+                'interpretation': (self.labels[i][buckets[i]] if self.interpreted[i]
+                                   else self.translator.get_interpretation(meta.name, value)),
+                'explanation': (meta.explanation if meta.explanation is not None
+                                else self.translator.get_explanation(meta.name, value)),
+                'analogy': meta.analogy,
+                'listen_tip': meta.listen_tip,
+                'confidence': dict(meta.confidence),
+                'category': meta.category,
+                'unit': meta.unit
+            })
+        return translated
+
+    def group_by_category(self, translated):
+        """Group translated features using the precomputed category layout"""
+        return {category: [translated[i] for i in members]
+                for category, members in self.category_members.items()}
+
+    def metadata(self):
+        """Every static string per feature index - what the compact view leaves out"""
+        return {
+            'features': [{
+                'index': i,
+                'name': meta.name,
+                'display_name': meta.display_name,
+                # None: the explanation embeds the value and comes with each response
+                'explanation': meta.explanation,
+                'analogy': meta.analogy,
+                'listen_tip': meta.listen_tip,
+                'confidence': dict(meta.confidence),
+                'category': meta.category,
+                'unit': meta.unit,
+                'interpretations': list(self.labels[i])
+            } for i, meta in enumerate(self.meta)],
+            'categories': {category: list(members) for category, members in self.category_members.items()}
+        }
+
+
 # Initialize translator
 translator = FeatureTranslator()
+compiled_translator = CompiledTranslator(translator, FEATURE_NAMES)
 
 @app.route('/')
 def index():
@@ -409,132 +641,515 @@ def index():
             return f"Error loading index.html: {str(e)}<br>Current directory: {os.getcwd()}<br>Files: {os.listdir('.')}"
 
 
-            # Save uploaded file temporarily
-            filename = secure_filename(file.filename)
-            print(f"💾 Saving as: {filename}")
-            filepath = os.path.join('temp_audio.wav')
-            file.save(filepath)
-            print(f"✅ File saved to: {filepath}")
+# FEATURE METADATA - the static half of every analysis, served once and cached by clients
 
-            # Extract features
-            print("🔧 Extracting features...")
-            features = extract_music_features(filepath)
-            print(f"✅ Features extracted: {type(features)}")
-            
-            if features is None:
-                print("❌ Feature extraction failed")
-                return jsonify({'error': 'Could not extract features from audio file'}), 500
+_feature_metadata = None
 
-            print(f"🎯 Feature count: {len(features) if hasattr(features, '__len__') else 'Unknown'}")
-            
-            # Continue with rest of your code...
-            # (Add more print statements as needed)
-                    
-        except Exception as e:
-            print(f"❌ Analysis error: {e}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': str(e)}), 500
-            
-            # Save uploaded file temporarily
-            filename = secure_filename(file.filename)
-            filepath = os.path.join('temp_audio.wav')
-            file.save(filepath)
-            
-            # Extract features
-            print("Extracting features...")
-            features = extract_music_features(filepath)
-            
-            if features is None:
-                return jsonify({'error': 'Could not extract features from audio file'}), 500
-            
-            # Prepare features for model (same order as training)
-            feature_names = list(features.keys())
-            feature_values = np.array([features[name] for name in feature_names]).reshape(1, -1)
-            
-            # Scale features
-            print("Scaling features...")
-            feature_values_scaled = scaler.transform(feature_values)
-            
-            # Get predictions
-            print("Making predictions...")
-            prediction_proba = model.predict_proba(feature_values_scaled)[0]
-            prediction = model.predict(feature_values_scaled)[0]
-            
-            # Get genre names
-            genre_names = label_encoder.classes_
-            
-            # Get SHAP values
-            print("Computing SHAP values...")
-            shap_values = explainer.shap_values(feature_values_scaled)
-            
-            # COMPLETE TRANSLATION FUNCTION - FIXED!
-            # Translate features to educational format
-            print("🔄 Translating features...")
-            translated_features = {}
-            failed_translations = []
-
-            for feature_name, value in features.items():
-                try:
-                        print(f"🔧 Translating: {feature_name}")
-                        translated_features[feature_name] = translator.translate_feature(feature_name, value)
-                        print(f"✅ Success: {feature_name}")
-                except Exception as e:
-                        print(f"❌ Failed to translate {feature_name}: {e}")
-                        failed_translations.append(feature_name)
-                        continue
-
-            print(f"🔍 Successfully translated {len(translated_features)} out of {len(features)} features")
-
-            # Optional: Show which ones failed (for debugging)
-            if failed_translations:
-                    print(f"❌ Failed translations: {failed_translations}")
-            else:
-                    print("🎉 All features translated successfully!")
-
-            # Group by category (only with successfully translated features)
-            categories = {}
-            for feature_name, feature_data in translated_features.items():
-                category = feature_data['category']
-                if category not in categories:
-                    categories[category] = []
-                categories[category].append(feature_data)
-
-            print("🔍 DEBUG - Final categories:")
-            for category, features_list in categories.items():
-                print(f"  {category}: {len(features_list)} features")
-            
-            
-                # Clean up temp file
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                
-                # Return results
-            results = {
-                        'success': True,
-                        'genre_prediction': {
-                            'primary_genre': genre_names[prediction],
-                            'probabilities': {genre_names[i]: float(prob) for i, prob in enumerate(prediction_proba)}
-                        },
-                        'features_by_category': categories,
-                        'shap_analysis': {
-                            'feature_importance': {feature_names[i]: float(shap_values[0][i]) for i in range(len(feature_names))}
-                        }
-                    }
-                        
-            print("✅ Analysis complete!")
-            return jsonify(results)
-                
+
+def get_feature_metadata():
+    """(metadata dict, JSON body, gzip body, etag) for the loaded model, built on first use"""
+    global _feature_metadata
+    if _feature_metadata is None:
+        metadata = {
+            'model_version': artifacts.version,
+            'genres': [str(genre) for genre in artifacts.label_encoder.classes_],
+            **compiled_translator.metadata()
+        }
+        body = app.json.dumps(metadata).encode('utf-8')
+        _feature_metadata = (metadata, body, compress(body, 'gzip', level=9)[0], hash_bytes(body)[:32])
+    return _feature_metadata
+
+
+def compact_view(payload):
+    """Compact every analysis in a payload: the payload itself, or analyses one level down (batch, jobs)"""
+    metadata, _, _, etag = get_feature_metadata()
+    metadata_url = f'/features/metadata?v={etag}'
+
+    def compact(value):
+        if isinstance(value, list):
+            return [compact_analysis(item, metadata, metadata_url) for item in value]
+        return compact_analysis(value, metadata, metadata_url)
+
+    payload = compact(payload)
+    return {key: compact(value) for key, value in payload.items()} if isinstance(payload, dict) else payload
+
+
+@app.route('/features/metadata')
+def features_metadata():
+    """Static per-feature strings for ?view=compact responses - long-lived, ETag-validated"""
+    _, body, gzipped, etag = get_feature_metadata()
+    if 'gzip' in accepted_encodings(request.headers.get('Accept-Encoding')) and len(gzipped) < len(body):
+        response = Response(gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(f'{etag}-gzip')
+    else:
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+    # Versioned URLs (?v=<etag>, as linked from compact responses) never change
+    versioned = request.args.get('v') == etag
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if versioned else 'public, max-age=86400'
+    response.vary.add('Accept-Encoding')
+    return response.make_conditional(request)
+
+
+@app.route('/fidelity')
+def fidelity_profiles():
+    """The extraction profiles ?fidelity= accepts, and the default one"""
+    return jsonify({
+        'default': FIDELITY,
+        'profiles': {name: profile.settings() for name, profile in PROFILES.items()}
+    })
+
+
+# SHARED ANALYSIS HELPERS - used by both /analyze and /analyze/batch
+
+def features_to_matrix(feature_dicts):
+    """Stack feature dicts into an (n_samples, 34) matrix in training order"""
+    return np.array([[features[name] for name in FEATURE_NAMES] for features in feature_dicts])
+
+
+def predict_matrix(feature_values, explain_mode=EXACT, timings=None):
+    """Scale, predict and explain a whole feature matrix with ONE call per model
+
+    SHAP values come back as (samples, features, classes), or None when the
+    explanation is deferred (explain_mode 'off').
+    """
+    logger.debug("📏 Scaling %d feature rows...", len(feature_values))
+    with timed(timings, 'scale'):
+        feature_values_scaled = artifacts.scaler.transform(feature_values)
+
+    # ONE probability evaluation per row - labels are its argmax
+    inference_backend = get_inference_backend()
+    with timed(timings, 'predict'):
+        prediction_proba, predictions = inference_backend.predict(feature_values)
+
+    shap_values = None
+    if explain_mode != OFF:
+        logger.debug("🧠 Computing SHAP values (%s)...", explain_mode)
+        with timed(timings, 'shap'):
+            shap_values = explanation_service.explain(feature_values_scaled, explain_mode)
+
+    return feature_values_scaled, prediction_proba, predictions, shap_values
+
+
+def select_shap_row(shap_values, row, prediction):
+    """Pick one sample's SHAP values for its predicted class"""
+    shap_vals = shap_values[row]
+    # Single-output explainers only have one column
+    return shap_vals[:, prediction if shap_vals.shape[1] > 1 else 0]
+
+
+def translate_features(features):
+    """Translate features to educational format and group them by category"""
+    logger.debug("🔄 Translating features...")
+
+    # Fast path: the usual 34 features in training order go through the compiled table
+    if list(features) == compiled_translator.feature_names:
+        translated = compiled_translator.translate_vector(features.values())
+        translated_features = dict(zip(compiled_translator.feature_names, translated))
+        return translated_features, [], compiled_translator.group_by_category(translated)
+
+    translated_features = {}
+    failed_translations = []
+
+    for feature_name, value in features.items():
+        try:
+            translated_features[feature_name] = translator.translate_feature(feature_name, value)
         except Exception as e:
-            print(f"❌ Error in analysis: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
+            logger.warning("❌ Failed to translate %s: %s", feature_name, e)
+            failed_translations.append(feature_name)
+            continue
+
+    logger.debug("🔍 Successfully translated %d out of %d features", len(translated_features), len(features))
+
+    # Group by category (only with successfully translated features)
+    categories = {}
+    for feature_name, feature_data in translated_features.items():
+        category = feature_data['category']
+        if category not in categories:
+            categories[category] = []
+        categories[category].append(feature_data)
+
+    return translated_features, failed_translations, categories
+
+
+def shap_analysis(shap_vals, explain_mode, explain_id=None):
+    """The shap_analysis block - inline values, or a link when the explanation is deferred"""
+    if shap_vals is None:
+        return {'mode': OFF, 'status': 'deferred', 'explain_url': f'/explain/{explain_id}'}
+    return {
+        'mode': explain_mode,
+        'feature_importance': {FEATURE_NAMES[i]: float(shap_vals[i]) for i in range(len(FEATURE_NAMES))}
+    }
+
+
+def build_analysis_results(features, prediction_proba, prediction, shap_vals, explain_mode=EXACT, explain_id=None,
+                           timings=None):
+    """Assemble the JSON payload the frontend expects for one analysed clip"""
+    genre_names = artifacts.label_encoder.classes_
+    with timed(timings, 'translate'):
+        translated_features, failed_translations, categories = translate_features(features)
+
+    return {
+        'success': True,
+        'genre_prediction': {
+            'primary_genre': genre_names[prediction],
+            'probabilities': {genre_names[i]: float(prob) for i, prob in enumerate(prediction_proba)}
+        },
+        'features_by_category': categories,
+        'shap_analysis': shap_analysis(shap_vals, explain_mode, explain_id),
+        'debug_info': {
+            'total_features_extracted': len(features),
+            'total_features_translated': len(translated_features),
+            'failed_translations': failed_translations,
+            'categories_found': list(categories.keys())
+        }
+    }
+
+
+def restore_deferred(cached):
+    """Re-register a cached result's deferred explanation so its explain_url keeps working
+
+    Only the request that computed a result deferred its vector, and that entry
+    can be evicted, lost on restart or live in another worker. The id is the
+    hash of the scaled row, so scaling the cached features gives the same one.
+    """
+    results = cached['results']
+    if (results.get('shap_analysis') or {}).get('status') != 'deferred' or not cached.get('features'):
+        return results
+    feature_values_scaled = artifacts.scaler.transform(features_to_matrix([cached['features']]))
+    prediction = artifacts.label_encoder.transform([results['genre_prediction']['primary_genre']])
+    explanation_service.defer(feature_values_scaled, prediction)
+    return results
+
+
+def requested_explain_mode():
+    """SHAP mode asked for via ?explain= (or form field), None if it is not a known mode"""
+    mode = request.values.get('explain', SHAP_MODE)
+    return mode if mode in MODES else None
+
+
+def requested_profile():
+    """Fidelity profile asked for via ?fidelity= (or form field), None if it is not a known profile"""
+    return PROFILES.get(request.values.get('fidelity', FIDELITY))
+
+
+MIN_TIMELINE_SECONDS = 1.0
+MAX_TIMELINE_SECONDS = 15.0
+
+
+def requested_timeline_seconds():
+    """Segment length asked for via ?timeline= (1/true for the default, or seconds); None when off"""
+    value = request.values.get('timeline', '').lower()
+    if value in ('', '0', 'false', 'no'):
+        return None
+    if value in ('1', 'true', 'yes'):
+        return TIMELINE_SECONDS
+    return min(MAX_TIMELINE_SECONDS, max(MIN_TIMELINE_SECONDS, float(value)))
+
+
+def cache_version(explain_mode, profile=EXACT_PROFILE, clip_seconds=None, timeline_seconds=None):
+    """Everything besides the audio that changes an analysis - part of every result cache key"""
+    version = f'{artifacts.version}:{explain_mode}'
+    if profile is not EXACT_PROFILE:
+        version += f':{profile.name}'
+    if clip_seconds:
+        version += f':clip{clip_seconds:g}'
+    if timeline_seconds:
+        version += f':timeline{timeline_seconds:g}'
+    return version
+
+
+def timeline_payload(timeline, prediction_proba):
+    """Columnar timeline - one array per quantity, segments in order, rounded so the JSON stays small"""
+    return {
+        'segment_seconds': round(float(timeline['segment_seconds']), 3),
+        'starts': np.round(timeline['starts'], 3).tolist(),
+        'ends': np.round(timeline['ends'], 3).tolist(),
+        'genres': [str(genre) for genre in artifacts.label_encoder.classes_],
+        # float64 first - rounding float32 (tree engine output) still prints 0.006899999920278788
+        'probabilities': np.round(np.asarray(prediction_proba, dtype=np.float64), 4).tolist(),
+        'primary_genres': np.argmax(prediction_proba, axis=1).tolist(),
+        'feature_names': list(FEATURE_NAMES),
+        'features': np.round(np.asarray(timeline['features'], dtype=np.float64), 4).tolist()
+    }
+
+
+# ADMISSION CONTROL - rate limits, size / duration caps and bounded concurrency before any decoding
+
+def available_cores():
+    """CPU cores this process may actually run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+rate_limiter = RateLimiter(
+    rate=float(os.environ.get('MUSIC_RATE_LIMIT', 0)),        # analyses per second per client, 0 = off
+    burst=float(os.environ.get('MUSIC_RATE_BURST', 5))
+)
+admission = AdmissionController(
+    max_concurrent=int(os.environ.get('MUSIC_MAX_CONCURRENT', available_cores())),
+    max_waiting=int(os.environ.get('MUSIC_MAX_WAITING', 8)),
+    wait_seconds=float(os.environ.get('MUSIC_ADMISSION_WAIT', 10.0)),
+    shed=os.environ.get('MUSIC_LOAD_SHEDDING', '1') != '0'
+)
+MAX_ANALYZE_BYTES = int(float(os.environ.get('MUSIC_MAX_ANALYZE_MB', 50)) * 1024 * 1024)
+MAX_AUDIO_SECONDS = float(os.environ.get('MUSIC_MAX_AUDIO_SECONDS', 600))
+SHED_CLIP_SECONDS = float(os.environ.get('MUSIC_SHED_CLIP_SECONDS', 15.0))
+TRUST_PROXY = os.environ.get('MUSIC_TRUST_PROXY', '0') != '0'
+
+
+def client_id():
+    """Who the rate limit applies to - the first X-Forwarded-For hop only behind a trusted proxy"""
+    if TRUST_PROXY and request.headers.get('X-Forwarded-For'):
+        return request.headers['X-Forwarded-For'].split(',')[0].strip()
+    return request.remote_addr or 'unknown'
+
+
+def retry_later(message, retry_after, status):
+    response = jsonify({'error': message, 'retry_after': round(retry_after, 1)})
+    response.headers['Retry-After'] = str(max(1, int(np.ceil(retry_after))))
+    return response, status
+
+
+def charge_client(cost=1):
+    """Take rate-limit tokens for uploads the result cache missed - raises RateLimited
+
+    Called by the pipeline, so a cached result never costs a token. Outside a
+    request (job workers, demo builds) nothing is charged - POST /jobs charges
+    when the job is submitted.
+    """
+    if has_request_context():
+        rate_limiter.check(client_id(), cost)
+
+
+def upload_limit_error(max_seconds=MAX_AUDIO_SECONDS):
+    """A 413 response when the request breaks the size or duration cap, else None"""
+    if MAX_ANALYZE_BYTES and (request.content_length or 0) > MAX_ANALYZE_BYTES:
+        return jsonify({'error': f'Upload too large to analyze - the limit is '
+                                 f'{MAX_ANALYZE_BYTES / (1024 * 1024):g} MB'}), 413
+    # Header-only probe: a one-hour WAV is refused without decoding a sample of it
+    if max_seconds:
+        for file in request.files.getlist('audio'):
+            seconds = probe_duration(file.stream, file.filename or '')
+            if seconds is not None and seconds > max_seconds:
+                return jsonify({'error': f'{file.filename} is {seconds:.0f} s long - '
+                                         f'the limit is {max_seconds:g} s'}), 413
+    return None
+
+
+def admitted(max_seconds=MAX_AUDIO_SECONDS):
+    """Route decorator: size and duration caps, then hold an analysis slot
+
+    The Admission is left in g.admission for the route to read its degradation
+    from. RateLimited raised by charge_client() inside the route becomes a 429
+    - routes re-raise it past their own error handling.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            refused = upload_limit_error(max_seconds)
+            if refused is not None:
+                return refused
+
+            try:
+                with admission.admit() as g.admission:
+                    return view(*args, **kwargs)
+            except RateLimited as e:
+                record_error('rate_limit', e)
+                return retry_later(str(e), e.retry_after, 429)
+            except Overloaded as e:
+                record_error('overloaded', e)
+                logger.warning("🚦 Shedding %s: %s", request.path, e)
+                return retry_later(str(e), e.retry_after, 503)
+        return wrapper
+    return decorator
+
+
+def degraded_explain_mode(explain_mode):
+    """OFF instead of computing SHAP when the admission said to shed it - /explain still works later"""
+    degradation = g.admission.degradation if 'admission' in g else ()
+    return OFF if SKIP_SHAP in degradation and explain_mode != OFF else explain_mode
+
+
+def degraded_clip_seconds():
+    """Shorter analysis window under heavy load, None for the normal clip"""
+    degradation = g.admission.degradation if 'admission' in g else ()
+    return SHED_CLIP_SECONDS if SHORT_CLIP in degradation and SHED_CLIP_SECONDS < CLIP_DURATION else None
+
+
+def mark_degraded(results, requested_mode, explain_mode, clip_seconds=None):
+    """Copy of results saying what was shed (cached results stay untouched); unchanged if nothing was"""
+    reasons = []
+    if explain_mode != requested_mode:
+        reasons.append(SKIP_SHAP)
+    if clip_seconds:
+        reasons.append(SHORT_CLIP)
+    if not reasons or not isinstance(results, dict):
+        return results
+    results = dict(results)
+    results['degraded'] = {
+        'reasons': reasons,
+        'requested_explain': requested_mode,
+        'explain': explain_mode,
+        'clip_seconds': clip_seconds or CLIP_DURATION
+    }
+    return results
+
+
+def analyze_bytes(audio_bytes, filename='', report=None, extract=None, explain_mode=EXACT, clip_seconds=None,
+                  profile=EXACT_PROFILE, timeline_seconds=None):
+    """Full pipeline for one upload: cache lookup, extraction, prediction, SHAP, translation
+
+    Returns the result payload, or None when no features could be extracted.
+    report(stage, progress) is called between stages when given. extract
+    takes (audio, filename, timings, duration=, profile=). clip_seconds
+    analyses a shorter clip than usual (load shedding); profile trades
+    extraction fidelity for speed. timeline_seconds adds per-segment feature
+    and genre trajectories, pooled from the same frames in this thread.
+    """
+    report = report or (lambda stage, progress: None)
+    extract = partial(extract or partial(extract_music_features, frame_store=frame_store),
+                      duration=clip_seconds, profile=profile)
+    upload_bytes.observe(len(audio_bytes))
+
+    # Same bytes + same models = same answer, so skip librosa entirely on a hit
+    cache_key = result_cache.make_key(audio_bytes, cache_version(explain_mode, profile, clip_seconds,
+                                                                 timeline_seconds))
+    cached = result_cache.get(cache_key)
+    cache_lookups.inc(result='miss' if cached is None else 'hit')
+    if cached is not None:
+        logger.debug("⚡ Cache hit - returning stored analysis")
+        return restore_deferred(cached)
+    charge_client()
+
+    # Decode from memory - no shared temp file, so concurrent requests are safe
+    report('extracting', 0.1)
+    timings = {}
+    timeline = None
+    if timeline_seconds:
+        features, timeline = extract_with_timeline(audio_bytes, filename, timings, frame_store, clip_seconds, profile,
+                                                   timeline_seconds)
+    else:
+        features = extract(audio_bytes, filename, timings)
+
+    if features is None:
+        record_stages(timings)
+        return None
+
+    # Prepare features for model (same order as training)
+    report('predicting', 0.7)
+    feature_values = features_to_matrix([features])
+    feature_values_scaled, prediction_proba, predictions, shap_values = predict_matrix(feature_values, explain_mode,
+                                                                                       timings)
+    prediction = predictions[0]
+
+    # FIXED: Handle SHAP array properly
+    shap_vals, explain_id = None, None
+    if shap_values is None:
+        explain_id = explanation_service.defer(feature_values_scaled, predictions)[0]
+    else:
+        shap_vals = select_shap_row(shap_values, 0, prediction)
+
+    # FIXED: Return results with working SHAP and all translated features
+    report('translating', 0.9)
+    results = build_analysis_results(features, prediction_proba[0], prediction, shap_vals,
+                                     explain_mode, explain_id, timings)
+    results['fidelity'] = profile.name
+    if timeline is not None:
+        # Every segment in ONE vectorized model pass - no SHAP per segment
+        with timed(timings, 'predict'):
+            timeline_proba, _ = get_inference_backend().predict(timeline['features'])
+        results['timeline'] = timeline_payload(timeline, timeline_proba)
+    result_cache.put(cache_key, {'features': features, 'results': results})
+    index_track(hash_bytes(audio_bytes), filename, feature_values_scaled[0], prediction_proba[0], prediction)
+    record_stages(timings)
+    logger.debug("⏱️ Stage timings: %s", timings, extra={'fields': {'timings': timings}})
+    return results
+
+
+# MULTI-WINDOW ENSEMBLE - several short windows, averaged, stopping once confident
+
+ENSEMBLE_WINDOW_SECONDS = float(os.environ.get('MUSIC_ENSEMBLE_WINDOW', 10.0))
+ENSEMBLE_MAX_WINDOWS = int(os.environ.get('MUSIC_ENSEMBLE_MAX_WINDOWS', 6))
+ENSEMBLE_CONFIDENCE = float(os.environ.get('MUSIC_ENSEMBLE_CONFIDENCE', 0.8))
+ENSEMBLE_MIN_WINDOWS = 2
+ENSEMBLE_BATCH = 2
+
+
+def analyze_ensemble(audio_bytes, filename='', explain_mode=EXACT, confidence=ENSEMBLE_CONFIDENCE,
+                     profile=EXACT_PROFILE):
+    """Average window probabilities; stop decoding once the top class reaches confidence
+
+    Windows are extracted ENSEMBLE_BATCH at a time in one batched frontend pass
+    and predicted as one stacked matrix. The features shown (and explained by
+    SHAP) are the means over the windows that were used.
+    """
+    upload_bytes.observe(len(audio_bytes))
+    cache_key = result_cache.make_key(audio_bytes, f'{cache_version(explain_mode, profile)}:ensemble:{confidence}')
+    cached = result_cache.get(cache_key)
+    cache_lookups.inc(result='miss' if cached is None else 'hit')
+    if cached is not None:
+        return restore_deferred(cached)
+    charge_client()
+
+    timings = {}
+    windows, probabilities = [], []
+    early_exit = False
+    for batch in iter_window_batches(audio_bytes, filename, ENSEMBLE_WINDOW_SECONDS, ENSEMBLE_MAX_WINDOWS,
+                                     ENSEMBLE_BATCH, timings, profile):
+        _, prediction_proba, _, _ = predict_matrix(features_to_matrix([features for _, _, features in batch]),
+                                                   OFF, timings)
+        windows.extend(batch)
+        probabilities.extend(prediction_proba)
+        mean_proba = np.mean(probabilities, axis=0)
+        if len(windows) >= ENSEMBLE_MIN_WINDOWS and mean_proba.max() >= confidence:
+            early_exit = len(windows) < ENSEMBLE_MAX_WINDOWS
+            break
+
+    if not windows:
+        record_stages(timings)
+        return None
+
+    mean_proba = np.mean(probabilities, axis=0)
+    prediction = int(np.argmax(mean_proba))
+    features = {name: float(np.mean([window_features[name] for _, _, window_features in windows]))
+                for name in FEATURE_NAMES}
 
+    shap_vals, explain_id = None, None
+    feature_values_scaled = artifacts.scaler.transform(features_to_matrix([features]))
+    if explain_mode == OFF:
+        explain_id = explanation_service.defer(feature_values_scaled, [prediction])[0]
+    else:
+        with timed(timings, 'shap'):
+            shap_values = explanation_service.explain(feature_values_scaled, explain_mode)
+        shap_vals = select_shap_row(shap_values, 0, prediction)
+
+    results = build_analysis_results(features, mean_proba, prediction, shap_vals, explain_mode, explain_id, timings)
+    results['fidelity'] = profile.name
+    genre_names = artifacts.label_encoder.classes_
+    results['ensemble'] = {
+        'window_seconds': ENSEMBLE_WINDOW_SECONDS,
+        'windows_used': len(windows),
+        'max_windows': ENSEMBLE_MAX_WINDOWS,
+        'confidence_threshold': confidence,
+        'early_exit': early_exit,
+        'windows': [{
+            'start': start,
+            'end': end,
+            'primary_genre': genre_names[int(np.argmax(proba))],
+            'probabilities': {genre_names[i]: float(p) for i, p in enumerate(proba)}
+        } for (start, end, _), proba in zip(windows, probabilities)]
+    }
+    result_cache.put(cache_key, {'features': features, 'results': results})
+    record_stages(timings)
+    return results
 
 
 # FIXED ANALYZE FUNCTION - PROPER SHAP HANDLING
 @app.route('/analyze', methods=['POST'])
+@admitted()
 def analyze_audio():
     """Analyze uploaded audio file - FIXED ALL ISSUES"""
     try:
@@ -546,132 +1161,808 @@ def analyze_audio():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
 
-        # Save uploaded file temporarily
-        filename = secure_filename(file.filename)
-        filepath = os.path.join('temp_audio.wav')
-        file.save(filepath)
-        
-        # Extract features
-        print("🔧 Extracting features...")
-        features = extract_music_features(filepath)
-
-        # DEBUG: Print all extracted features
-        print("🔍 DEBUG - All extracted features:")
-        for i, (name, value) in enumerate(features.items()):
-            print(f"  {i+1:2d}. {name}: {value}")
+        explain_mode = requested_explain_mode()
+        if explain_mode is None:
+            return jsonify({'error': f'explain must be one of {", ".join(MODES)}'}), 400
+        profile = requested_profile()
+        if profile is None:
+            return jsonify({'error': f'fidelity must be one of {", ".join(PROFILES)}'}), 400
+        try:
+            timeline_seconds = requested_timeline_seconds()
+        except ValueError:
+            return jsonify({'error': 'timeline must be true or a segment length in seconds'}), 400
+        ensemble = request.values.get('ensemble', '').lower() in ('1', 'true', 'yes')
+        if ensemble and timeline_seconds:
+            return jsonify({'error': 'timeline is not available for ensemble analysis'}), 400
 
-        print(f"🔍 Total features extracted: {len(features)}")
-        
-        if features is None:
+        # Under load: skip SHAP first, then analyse a shorter clip
+        requested_mode, explain_mode = explain_mode, degraded_explain_mode(explain_mode)
+        clip_seconds = None
+        if ensemble:
+            confidence = request.values.get('confidence', ENSEMBLE_CONFIDENCE, type=float)
+            results = analyze_ensemble(file.read(), secure_filename(file.filename), explain_mode,
+                                       min(1.0, max(0.0, confidence)), profile)
+        else:
+            clip_seconds = degraded_clip_seconds()
+            results = analyze_bytes(file.read(), secure_filename(file.filename),
+                                    extract=extract_in_pool if OFFLOAD_EXTRACTION else None,
+                                    explain_mode=explain_mode, clip_seconds=clip_seconds, profile=profile,
+                                    timeline_seconds=timeline_seconds)
+        if results is None:
             return jsonify({'error': 'Could not extract features from audio file'}), 500
-        
-        # Prepare features for model (same order as training)
-        feature_names = list(features.keys())
-        feature_values = np.array([features[name] for name in feature_names]).reshape(1, -1)
-        
-        # Scale features
-        print("📏 Scaling features...")
-        feature_values_scaled = scaler.transform(feature_values)
-        
-        # Get predictions
-        print("🎯 Making predictions...")
-        prediction_proba = model.predict_proba(feature_values_scaled)[0]
-        prediction = model.predict(feature_values_scaled)[0]
-        
-        # Get genre names
-        genre_names = label_encoder.classes_
-        
-        # FIXED: Translate features to educational format - NOW WITH ERROR HANDLING
-        print("🔄 Translating features...")
-        translated_features = {}
-        failed_translations = []
-        
-        for feature_name, value in features.items():
+
+        results = mark_degraded(results, requested_mode, explain_mode, clip_seconds)
+        response = timed_json(results)
+        if 'degraded' in results:
+            response.headers['X-Degraded'] = ','.join(results['degraded']['reasons'])
+        return response
+
+    except RateLimited:
+        # Answered with 429 by admitted()
+        raise
+    except Exception as e:
+        logger.exception("❌ Error in analysis: %s", e)
+        record_error('analyze', e)
+        return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
+
+
+@app.route('/explain/<explain_id>')
+def explain_deferred(explain_id):
+    """SHAP values for an analysis that ran with explain=off - computed on first request"""
+    mode = request.args.get('mode', EXACT)
+    if mode not in (EXACT, FAST):
+        return jsonify({'error': 'mode must be exact or fast'}), 400
+
+    explained = explanation_service.explain_deferred(explain_id, mode)
+    if explained is None:
+        return jsonify({'error': 'Unknown or expired explanation id - analyze the file again'}), 404
+
+    shap_vals, prediction = explained
+    return jsonify({
+        'success': True,
+        'primary_genre': artifacts.label_encoder.classes_[prediction],
+        'shap_analysis': shap_analysis(shap_vals, mode)
+    })
+
+
+# BATCH ANALYSIS - whole playlists in one request
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.au'}
+MAX_BATCH_FILES = 200
+# Caps on what zip archives expand to, checked against each member's header before extracting
+MAX_MEMBER_BYTES = int(float(os.environ.get('MUSIC_MAX_MEMBER_MB', 100)) * 1024 * 1024)
+MAX_EXTRACTED_BYTES = int(float(os.environ.get('MUSIC_MAX_EXTRACTED_MB', 1024)) * 1024 * 1024)
+
+
+class ArchiveTooLarge(ValueError):
+    """A zip archive would expand beyond the member or total size cap"""
+
+_feature_pool = None
+
+
+def get_feature_pool():
+    """Process pool for librosa work, created on first use and reused across requests
+
+    Created lazily, so under a prefork server every worker gets its own pool
+    after the fork. MUSIC_POOL_WORKERS sizes it (default: all cores).
+    """
+    global _feature_pool
+    if _feature_pool is None:
+        workers = int(os.environ.get('MUSIC_POOL_WORKERS', 0)) or available_cores()
+        logger.info("🏊 Starting feature extraction pool with %d workers", workers)
+        _feature_pool = ProcessPoolExecutor(max_workers=workers)
+    return _feature_pool
+
+
+def shutdown():
+    """Finish in-flight extractions and stop the pool (server exit / worker recycle)"""
+    global _feature_pool
+    pool, _feature_pool = _feature_pool, None
+    if pool is not None:
+        logger.info("🛑 Shutting down feature extraction pool")
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def collect_batch_uploads(workdir):
+    """Save every uploaded audio file (plain or inside a zip archive) into workdir
+
+    Returns a list of (display_name, saved_path) in upload order. Raises
+    ArchiveTooLarge before extracting a member that would break a size cap.
+    """
+    uploads = []
+    extracted_bytes = 0
+
+    def add_upload(name, save):
+        suffix = os.path.splitext(name)[1].lower()
+        if suffix not in AUDIO_EXTENSIONS or len(uploads) >= MAX_BATCH_FILES:
+            return
+        # Index prefix keeps same-named files from different folders apart
+        path = os.path.join(workdir, f'{len(uploads):04d}_{secure_filename(os.path.basename(name)) or "audio" + suffix}')
+        save(path)
+        uploads.append((name, path))
+
+    for file in request.files.getlist('audio'):
+        if file.filename:
+            add_upload(file.filename, file.save)
+
+    for archive in request.files.getlist('archive'):
+        with zipfile.ZipFile(archive.stream) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+
+                def save_member(path, info=info, zf=zf):
+                    nonlocal extracted_bytes
+                    # zf.open() never inflates past the declared file_size, so checking it is enough
+                    if info.file_size > MAX_MEMBER_BYTES:
+                        raise ArchiveTooLarge(f'{info.filename} expands to {info.file_size / (1024 * 1024):.0f} MB - '
+                                              f'the limit per file is {MAX_MEMBER_BYTES / (1024 * 1024):g} MB')
+                    extracted_bytes += info.file_size
+                    if extracted_bytes > MAX_EXTRACTED_BYTES:
+                        raise ArchiveTooLarge(f'Archives expand to more than the '
+                                              f'{MAX_EXTRACTED_BYTES / (1024 * 1024):g} MB limit')
+                    with zf.open(info) as src, open(path, 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+
+                add_upload(info.filename, save_member)
+
+    return uploads
+
+
+@app.route('/analyze/batch', methods=['POST'])
+@admitted()
+def analyze_batch():
+    """Analyze many uploads at once - parallel extraction, ONE vectorized model pass"""
+    try:
+        explain_mode = requested_explain_mode()
+        if explain_mode is None:
+            return jsonify({'error': f'explain must be one of {", ".join(MODES)}'}), 400
+        requested_mode, explain_mode = explain_mode, degraded_explain_mode(explain_mode)
+        profile = requested_profile()
+        if profile is None:
+            return jsonify({'error': f'fidelity must be one of {", ".join(PROFILES)}'}), 400
+
+        with tempfile.TemporaryDirectory(prefix='music_batch_') as workdir:
             try:
-                print(f"🔧 Translating: {feature_name}")
-                translated_features[feature_name] = translator.translate_feature(feature_name, value)
-                print(f"✅ Success: {feature_name}")
-            except Exception as e:
-                print(f"❌ Failed to translate {feature_name}: {e}")
-                failed_translations.append(feature_name)
-                continue
+                uploads = collect_batch_uploads(workdir)
+            except zipfile.BadZipFile:
+                return jsonify({'error': 'Archive is not a valid zip file'}), 400
+            except ArchiveTooLarge as e:
+                record_error('analyze_batch', e)
+                return jsonify({'error': str(e)}), 413
 
-        print(f"🔍 Successfully translated {len(translated_features)} out of {len(features)} features")
-        if failed_translations:
-            print(f"❌ Failed translations: {failed_translations}")
-
-        # FIXED: Group by category (only with successfully translated features)
-        categories = {}
-        for feature_name, feature_data in translated_features.items():
-            category = feature_data['category']
-            if category not in categories:
-                categories[category] = []
-            categories[category].append(feature_data)
-
-        print("🔍 DEBUG - Final categories:")
-        for category, features_list in categories.items():
-            print(f"  {category}: {len(features_list)} features")
-
-        # FIXED: Get SHAP values with proper array handling
-        print("🧠 Computing SHAP values...")
-        shap_values = explainer.shap_values(feature_values_scaled)
-        
-        # Create feature names list in correct order (same as extraction)
-        feature_names_list = list(features.keys())
-        
-        # FIXED: Handle SHAP array properly
-        if isinstance(shap_values, list):
-            # Multi-class case: shap_values is list of arrays for each class
-            shap_vals = shap_values[prediction]  # Get values for predicted class
-            if shap_vals.ndim > 1:
-                shap_vals = shap_vals[0]  # Take first sample if 2D
-        else:
-            # Single array case
-            if shap_values.ndim == 3:
-                # Shape (samples, features, classes)
-                shap_vals = shap_values[0, :, prediction]
-            elif shap_values.ndim == 2:
-                # Shape (samples, features)
-                shap_vals = shap_values[0]
+            if not uploads:
+                return jsonify({'error': 'No audio files uploaded'}), 400
+
+            # Cached tracks never reach the process pool
+            batch_results = [None] * len(uploads)
+            cache_keys = []
+            track_ids = []
+            for i, (_, path) in enumerate(uploads):
+                with open(path, 'rb') as f:
+                    track_ids.append(hash_bytes(f.read()))
+                cache_keys.append(f'{track_ids[i]}:{cache_version(explain_mode, profile)}')
+                upload_bytes.observe(os.path.getsize(path))
+                cached = result_cache.get(cache_keys[i])
+                cache_lookups.inc(result='miss' if cached is None else 'hit')
+                if cached is not None:
+                    batch_results[i] = restore_deferred(cached)
+
+            pending = [i for i in range(len(uploads)) if batch_results[i] is None]
+            # One token per file to analyse - archive members included, cached files free
+            if pending:
+                charge_client(len(pending))
+            logger.info("📦 Batch of %d files (%d cached) - extracting features in parallel...",
+                        len(uploads), len(uploads) - len(pending))
+            paths = [uploads[i][1] for i in pending]
+            extracted = {}
+            for i, (features, timings) in zip(pending, get_feature_pool().map(partial(extract_with_timings, frame_store=frame_store, profile=profile), paths)):
+                extracted[i] = features
+                record_stages(timings)
+
+        timings = {}
+        ok_rows = [i for i in pending if extracted[i] is not None]
+
+        if ok_rows:
+            feature_values = features_to_matrix([extracted[i] for i in ok_rows])
+            feature_values_scaled, prediction_proba, predictions, shap_values = predict_matrix(feature_values,
+                                                                                               explain_mode, timings)
+            explain_ids = [None] * len(ok_rows)
+            if shap_values is None:
+                explain_ids = explanation_service.defer(feature_values_scaled, predictions)
+
+            for row, i in enumerate(ok_rows):
+                prediction = predictions[row]
+                shap_vals = None if shap_values is None else select_shap_row(shap_values, row, prediction)
+                batch_results[i] = build_analysis_results(extracted[i], prediction_proba[row], prediction,
+                                                          shap_vals, explain_mode, explain_ids[row], timings)
+                batch_results[i]['fidelity'] = profile.name
+                result_cache.put(cache_keys[i], {'features': extracted[i], 'results': batch_results[i]})
+                index_track(track_ids[i], uploads[i][0], feature_values_scaled[row], prediction_proba[row], prediction)
+
+        analysed = 0
+        for i, (name, _) in enumerate(uploads):
+            if batch_results[i] is None:
+                batch_results[i] = {'success': False, 'error': 'Could not extract features from audio file'}
             else:
-                shap_vals = shap_values
+                analysed += 1
+            batch_results[i]['filename'] = name
+
+        record_stages(timings)
+        logger.info("✅ Batch complete! %d/%d files analysed", analysed, len(uploads))
+        payload = mark_degraded({
+            'success': True,
+            'total_files': len(uploads),
+            'analysed_files': analysed,
+            'results': batch_results
+        }, requested_mode, explain_mode)
+        response = timed_json(payload)
+        if 'degraded' in payload:
+            response.headers['X-Degraded'] = ','.join(payload['degraded']['reasons'])
+        return response
+    except RateLimited:
+        raise
+    except Exception as e:
+        logger.exception("❌ Error in batch analysis: %s", e)
+        record_error('analyze_batch', e)
+        return jsonify({'error': f'Batch analysis failed: {str(e)}'}), 500
+
+# SIMILAR TRACKS - nearest neighbours among everything analysed so far
+
+MAX_SIMILAR = 50
+
+
+@app.route('/similar', methods=['GET', 'POST'])
+@admitted()
+def similar_tracks():
+    """k nearest indexed tracks to an upload (POST audio) or to an indexed track (?track_id=)"""
+    try:
+        if not INDEX_ENABLED:
+            return jsonify({'error': 'Track index is disabled'}), 404
+
+        k = min(MAX_SIMILAR, max(1, request.values.get('k', 5, type=int)))
+        mode = request.values.get('mode', AUTO)
+        if mode not in SEARCH_MODES:
+            return jsonify({'error': f'mode must be one of {", ".join(SEARCH_MODES)}'}), 400
+
+        track_index = get_track_index()
+        file = request.files.get('audio')
+        if file is not None and file.filename:
+            audio_bytes = file.read()
+            track_id = hash_bytes(audio_bytes)
+            if track_id not in track_index:
+                charge_client()
+                filename = secure_filename(file.filename)
+                features = extract_music_features(audio_bytes, filename, frame_store=frame_store)
+                if features is None:
+                    return jsonify({'error': 'Could not extract features from audio file'}), 500
+                # Only the scaled vector is needed - no SHAP for a similarity query
+                feature_values_scaled, prediction_proba, predictions, _ = predict_matrix(
+                    features_to_matrix([features]), OFF)
+                index_track(track_id, filename, feature_values_scaled[0], prediction_proba[0], predictions[0])
+        else:
+            track_id = request.values.get('track_id')
+            if not track_id:
+                return jsonify({'error': 'Upload an audio file or pass track_id'}), 400
+
+        vector = track_index.vector(track_id)
+        if vector is None:
+            return jsonify({'error': 'Unknown track_id - analyze the file first'}), 404
+
+        return timed_json({
+            'success': True,
+            'query': track_index.metadata(track_id),
+            'indexed_tracks': len(track_index),
+            'similar': track_index.search(vector, k, mode, exclude=[track_id])
+        })
+
+    except RateLimited:
+        raise
+    except Exception as e:
+        logger.exception("❌ Error in similarity search: %s", e)
+        record_error('similar', e)
+        return jsonify({'error': f'Similarity search failed: {str(e)}'}), 500
 
-        print(f"🔍 Using SHAP values for class {prediction} ({genre_names[prediction]})")
-        print(f"🔍 SHAP values shape: {shap_vals.shape}")
 
-        # Clean up temp file
-        if os.path.exists(filepath):
-            os.remove(filepath)
+# SEGMENTED ANALYSIS - full-length recordings, streamed window by window
 
-        # FIXED: Return results with working SHAP and all translated features
-        results = {
+@app.route('/analyze/segments', methods=['POST'])
+@admitted(max_seconds=None)
+def analyze_segments():
+    """Per-segment genre predictions plus a track-level aggregate for long recordings"""
+    try:
+        if 'audio' not in request.files:
+            return jsonify({'error': 'No audio file uploaded'}), 400
+
+        file = request.files['audio']
+        if file.filename == '':
+            return jsonify({'error': 'No file selected'}), 400
+
+        segment_seconds = min(60.0, max(5.0, request.form.get('segment_seconds', SEGMENT_SECONDS, type=float)))
+        # Segmented results are not cached - every request is analysed
+        charge_client()
+
+        # Werkzeug already spooled the upload - stream blocks from it instead of decoding it whole
+        timings = {}
+        segments, track_features = extract_segment_features(file.stream, secure_filename(file.filename),
+                                                            segment_seconds=segment_seconds, timings=timings)
+        if not segments:
+            record_stages(timings)
+            return jsonify({'error': 'Could not extract features from audio file'}), 500
+
+        # Segments and the track aggregate go through the models together
+        feature_values = features_to_matrix([segment['features'] for segment in segments] + [track_features])
+        inference_backend = get_inference_backend()
+        with timed(timings, 'predict'):
+            prediction_proba, _ = inference_backend.predict(feature_values)
+        genre_names = artifacts.label_encoder.classes_
+
+        def genre_summary(proba):
+            return {
+                'primary_genre': genre_names[int(np.argmax(proba))],
+                'probabilities': {genre_names[i]: float(prob) for i, prob in enumerate(proba)}
+            }
+
+        segment_results = [{
+            'start': segment['start'],
+            'end': segment['end'],
+            'genre_prediction': genre_summary(proba)
+        } for segment, proba in zip(segments, prediction_proba[:-1])]
+
+        with timed(timings, 'translate'):
+            _, _, categories = translate_features(track_features)
+
+        record_stages(timings)
+        logger.info("✅ Segmented analysis complete! %d segments", len(segments))
+        return timed_json({
             'success': True,
-            'genre_prediction': {
-                'primary_genre': genre_names[prediction],
-                'probabilities': {genre_names[i]: float(prob) for i, prob in enumerate(prediction_proba)}
-            },
-            'features_by_category': categories,
-            'shap_analysis': {
-                'feature_importance': {feature_names_list[i]: float(shap_vals[i]) for i in range(len(feature_names_list))}
-            },
-            'debug_info': {
-                'total_features_extracted': len(features),
-                'total_features_translated': len(translated_features),
-                'failed_translations': failed_translations,
-                'categories_found': list(categories.keys())
+            'segment_seconds': segment_seconds,
+            'duration': segments[-1]['end'],
+            'segments': segment_results,
+            'track': {
+                # Prediction on the frame-weighted means of the whole recording
+                'genre_prediction': genre_summary(prediction_proba[-1]),
+                # Average of the per-segment probabilities, for comparison
+                'mean_segment_probabilities': genre_summary(prediction_proba[:-1].mean(axis=0))['probabilities'],
+                'features_by_category': categories
             }
-        }
-        
-        print("✅ Analysis complete!")
-        return jsonify(results)
-        
+        })
+
+    except RateLimited:
+        raise
     except Exception as e:
-        print(f"❌ Error in analysis: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
+        logger.exception("❌ Error in segmented analysis: %s", e)
+        record_error('analyze_segments', e)
+        return jsonify({'error': f'Segmented analysis failed: {str(e)}'}), 500
+
+
+# ASYNC JOBS - submit now, poll (or stream progress) later
+
+job_queue = JobQueue(
+    workers=int(os.environ.get('MUSIC_JOB_WORKERS', available_cores())),
+    max_queued=int(os.environ.get('MUSIC_JOB_QUEUE', 64)),
+    result_ttl=float(os.environ.get('MUSIC_JOB_TTL', 3600)),
+    max_finished=int(os.environ.get('MUSIC_JOB_MAX_FINISHED', 1024))
+)
+
+
+# With MUSIC_OFFLOAD_EXTRACTION=1, /analyze request threads hand librosa to the process pool
+# and just wait - a threaded worker then keeps several analyses running on different cores
+OFFLOAD_EXTRACTION = os.environ.get('MUSIC_OFFLOAD_EXTRACTION', '0') != '0'
+
+
+def extract_in_pool(audio_bytes, filename='', timings=None, duration=None, profile=EXACT_PROFILE):
+    """Run extract_music_features in the shared process pool so job workers don't fight the GIL"""
+    features, pool_timings = get_feature_pool().submit(extract_with_timings, audio_bytes, filename, frame_store,
+                                                       duration, profile).result()
+    if timings is not None:
+        timings.update(pool_timings)
+    return features
+
+
+def run_analysis_job(audio_bytes, filename, explain_mode, profile, report):
+    """Job body for POST /jobs"""
+    try:
+        results = analyze_bytes(audio_bytes, filename, report=report, extract=extract_in_pool,
+                                explain_mode=explain_mode, profile=profile)
+        if results is None:
+            raise ValueError('Could not extract features from audio file')
+    except Exception as e:
+        record_error('job', e)
+        raise
+    return results
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue an analysis and return its job id immediately"""
+    if 'audio' not in request.files:
+        return jsonify({'error': 'No audio file uploaded'}), 400
+
+    file = request.files['audio']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+
+    explain_mode = requested_explain_mode()
+    if explain_mode is None:
+        return jsonify({'error': f'explain must be one of {", ".join(MODES)}'}), 400
+    profile = requested_profile()
+    if profile is None:
+        return jsonify({'error': f'fidelity must be one of {", ".join(PROFILES)}'}), 400
+
+    # Same caps and token bucket as /analyze - the worker thread has no request to charge later
+    refused = upload_limit_error()
+    if refused is not None:
+        return refused
+    try:
+        charge_client()
+    except RateLimited as e:
+        record_error('rate_limit', e)
+        return retry_later(str(e), e.retry_after, 429)
+
+    try:
+        job = job_queue.submit(run_analysis_job, file.read(), secure_filename(file.filename), explain_mode,
+                               profile)
+    except QueueFull as e:
+        response = jsonify({'error': str(e), 'queue': job_queue.stats()})
+        response.headers['Retry-After'] = '5'
+        return response, 503
+
+    logger.info("📥 Queued job %s", job.id)
+    return jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': f'/jobs/{job.id}',
+        'events_url': f'/jobs/{job.id}/events'
+    }), 202
+
+
+@app.route('/jobs/stats')
+def job_stats():
+    """Queue depth and worker utilisation"""
+    return jsonify(job_queue.stats())
+
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Job status, plus the full analysis once it is done"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+    return timed_json(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """Server-sent progress events until the job finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job id'}), 404
+
+    def stream():
+        seen_version = -1
+        while True:
+            version = job_queue.wait_for_update(job, seen_version)
+            if version == seen_version:
+                yield ': keepalive\n\n'
+                continue
+            seen_version = version
+            finished = job.status in (DONE, FAILED)
+            yield f'event: {job.status if finished else "progress"}\n'
+            yield f'data: {json.dumps(job.to_dict(include_result=finished))}\n\n'
+            if finished:
+                return
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+# LIVE ANALYSIS - streamed PCM chunks in, genre probabilities and feature levels out
+
+live_sessions = LiveSessions(
+    max_sessions=int(os.environ.get('MUSIC_LIVE_SESSIONS', 16)),
+    idle_seconds=float(os.environ.get('MUSIC_LIVE_IDLE', 120))
+)
+LIVE_UPDATE_SECONDS = float(os.environ.get('MUSIC_LIVE_UPDATE_SECONDS', 0.25))
+LIVE_MAX_CHUNK_SECONDS = 5.0
+
+
+def live_update(session):
+    """Predict from the session's running features - None until every feature group has frames"""
+    state = session.state
+    features = state.features()
+    if features is None:
+        return None
+    timings = {}
+    feature_values = features_to_matrix([features])
+    _, prediction_proba, predictions, _ = predict_matrix(feature_values, OFF, timings)
+    record_stages(timings)
+    genre_names = artifacts.label_encoder.classes_
+    levels = compiled_translator.visual_levels(feature_values[0])
+    return {
+        'success': True,
+        'session_id': session.id,
+        'seconds': round(state.seconds, 3),
+        'tempo': state.tempo,
+        'genre_prediction': {
+            'primary_genre': genre_names[predictions[0]],
+            'probabilities': {genre_names[i]: float(prob) for i, prob in enumerate(prediction_proba[0])}
+        },
+        'features': features,
+        'feature_levels': dict(zip(FEATURE_NAMES, levels))
+    }
+
+
+def read_body(limit):
+    """The request body, or None when it is longer than limit bytes"""
+    chunks, size = [], 0
+    while size <= limit:
+        chunk = request.stream.read(limit + 1 - size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+    return None if size > limit else b''.join(chunks)
+
+
+def feed_live_session(session, pcm):
+    """Add a chunk; recompute the update once LIVE_UPDATE_SECONDS of new audio have arrived"""
+    with session.lock:
+        session.state.feed(pcm)
+        if session.state.seconds - session.updated_at_seconds >= LIVE_UPDATE_SECONDS:
+            update = live_update(session)
+            if update is not None:
+                session.updated_at_seconds = session.state.seconds
+                session.publish(update)
+        return session.update or {'success': True, 'session_id': session.id, 'status': 'warming_up',
+                                  'seconds': round(session.state.seconds, 3)}
+
+
+def live_options(values):
+    """LiveFeatureState options from request values / a WebSocket hello message - ValueError when out of range"""
+    input_sr = int(values.get('sample_rate', SAMPLE_RATE))
+    channels = int(values.get('channels', 1))
+    half_life = values.get('half_life')
+    half_life = None if half_life in (None, '') else float(half_life)
+    if input_sr <= 0:
+        raise ValueError('sample_rate must be positive')
+    if channels < 1:
+        raise ValueError('channels must be at least 1')
+    # A non-positive half-life would make the running averages grow instead of decay
+    if half_life is not None and not half_life > 0:
+        raise ValueError('half_life must be positive')
+    return {
+        'input_sr': input_sr,
+        'channels': channels,
+        'sample_format': values.get('format', FLOAT32),
+        'half_life': half_life
+    }
+
+
+@app.route('/live', methods=['POST'])
+def open_live_session():
+    """Start a live session: sample_rate, channels, format (f32|s16), optional half_life seconds"""
+    try:
+        values = request.get_json(silent=True) or request.values
+        session = live_sessions.open(**live_options(values))
+    except SessionLimit as e:
+        response = jsonify({'error': str(e), 'live': live_sessions.stats()})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid live session options: {e}'}), 400
+
+    state = session.state
+    return jsonify({
+        'success': True,
+        'session_id': session.id,
+        'sample_rate': state.input_sr,
+        'channels': state.channels,
+        'format': state.sample_format,
+        'update_seconds': LIVE_UPDATE_SECONDS,
+        'frames_url': f'/live/{session.id}',
+        'events_url': f'/live/{session.id}/events'
+    }), 201
+
+
+@app.route('/live/<session_id>', methods=['POST'])
+def live_frames(session_id):
+    """Raw PCM chunk in the request body (a few hundred ms); returns the latest update"""
+    session = live_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Unknown or expired live session'}), 404
+
+    state = session.state
+    limit = int(LIVE_MAX_CHUNK_SECONDS * state.input_sr * state.channels * SAMPLE_FORMATS[state.sample_format].itemsize)
+    # Chunked uploads have no Content-Length, so the body itself is read at most one byte past the limit
+    pcm = None if (request.content_length or 0) > limit else read_body(limit)
+    if pcm is None:
+        return jsonify({'error': f'Send at most {LIVE_MAX_CHUNK_SECONDS:g} s of audio per chunk'}), 413
+
+    try:
+        return timed_json(feed_live_session(session, pcm))
+    except Exception as e:
+        logger.exception("❌ Error in live analysis: %s", e)
+        record_error('live', e)
+        return jsonify({'error': f'Live analysis failed: {str(e)}'}), 500
+
+
+@app.route('/live/<session_id>', methods=['DELETE'])
+def close_live_session(session_id):
+    session = live_sessions.get(session_id)
+    if session is None or not live_sessions.close(session_id):
+        return jsonify({'error': 'Unknown or expired live session'}), 404
+    return jsonify({'success': True, 'session_id': session_id, 'seconds': round(session.state.seconds, 3),
+                    'final': session.update})
+
+
+@app.route('/live/<session_id>/events')
+def live_events(session_id):
+    """Server-sent updates as chunks arrive (from any connection) until the session closes"""
+    session = live_sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Unknown or expired live session'}), 404
+
+    def stream():
+        seen_version = -1
+        while True:
+            version = session.wait_for_update(seen_version)
+            if version == seen_version:
+                yield ': keepalive\n\n'
+                continue
+            seen_version = version
+            if session.closed:
+                yield 'event: closed\ndata: {}\n\n'
+                return
+            if session.update is not None:
+                yield f'event: update\ndata: {json.dumps(session.update)}\n\n'
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/live/ws')
+    def live_websocket(ws):
+        """WebSocket live mode: a JSON options message first, then binary PCM chunks; JSON updates back"""
+        try:
+            session = live_sessions.open(**live_options(json.loads(ws.receive() or '{}')))
+        except (SessionLimit, TypeError, ValueError) as e:
+            ws.send(json.dumps({'error': str(e)}))
+            return
+        ws.send(json.dumps({'success': True, 'session_id': session.id, 'update_seconds': LIVE_UPDATE_SECONDS}))
+        try:
+            while True:
+                chunk = ws.receive()
+                if chunk is None:
+                    break
+                if isinstance(chunk, str):
+                    # Any text frame ends the stream
+                    break
+                ws.send(json.dumps(feed_live_session(session, chunk)))
+        finally:
+            live_sessions.close(session.id)
+
+# DEMOS - one precomputed analysis per genre, served straight from memory
+
+demo_store = DemoStore(os.environ.get('MUSIC_DEMO_STORE', STORE_NAME), os.environ.get('MUSIC_DEMO_DIR', DEMO_DIR))
+try:
+    demo_store.load()
+except (OSError, ValueError) as e:
+    logger.warning("⚠️ Could not read demo store %s: %s", demo_store.path, e)
+
+
+def build_demo_store():
+    """Analyse the demo tracks with the full pipeline and save the store"""
+    genres = [str(genre) for genre in artifacts.label_encoder.classes_]
+    return demo_store.build(lambda audio_bytes, filename: analyze_bytes(audio_bytes, filename, explain_mode=EXACT),
+                            artifacts.version, genres)
+
+
+def refresh_demo_store():
+    """Rebuild at startup when the store is missing, incomplete or from another model"""
+    genres = [str(genre) for genre in artifacts.label_encoder.classes_]
+    if os.environ.get('MUSIC_DEMO_AUTOBUILD', '1') != '0' and demo_store.is_stale(artifacts.version, genres):
+        build_demo_store()
+
+
+@app.route('/demo/<genre>')
+def demo(genre):
+    """Precomputed analysis of the demo track for a genre - supports If-None-Match"""
+    entry = demo_store.get(genre)
+    if entry is None:
+        return jsonify({'error': f'No demo available for {genre}', 'available': demo_store.genres()}), 404
+
+    response = Response(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag)
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response.make_conditional(request)
+
+
+# READINESS - models load in the background, /ready says when traffic can be sent
+
+def warm_up(refresh_demos=True):
+    """Run librosa (numba JIT) and the models once so the first real request is fast"""
+    noise = (0.1 * np.random.default_rng(0).standard_normal(SAMPLE_RATE * 2)).astype(np.float32)
+    features = features_from_signal(noise, SAMPLE_RATE)
+    predict_matrix(features_to_matrix([features]), SHAP_MODE)
+    logger.info("🔥 Warm-up complete")
+    if refresh_demos:
+        refresh_demo_store()
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    record_error('upload', e)
+    limit_mb = app.config['MAX_CONTENT_LENGTH'] / (1024 * 1024)
+    return jsonify({'error': f'Upload too large - the limit is {limit_mb:g} MB'}), 413
+
+
+@app.before_request
+def enforce_upload_limit():
+    # Refuse on the declared length, before a route's try/except turns the 413 into a 500
+    limit = app.config['MAX_CONTENT_LENGTH']
+    if limit and (request.content_length or 0) > limit:
+        return upload_too_large(RequestEntityTooLarge())
+
+
+@app.route('/ready')
+def readiness():
+    """200 once every artifact is loaded and warmed up, 503 before that"""
+    status = artifacts.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+
+# METRICS ENDPOINT - request counters plus live queue / cache / explanation gauges
+
+@app.before_request
+def start_request_timer():
+    request.environ['music.started'] = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    # Label by route rule, not raw path, so ids don't explode the series count
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    started = request.environ.get('music.started')
+    if started is not None:
+        request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+    requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
+
+def stats_gauge(name, documentation, stats):
+    """One gauge per numeric field of a stats() dict, read at scrape time"""
+    metrics.gauge(name, documentation, ['field'],
+                  callback=lambda: {(field,): value for field, value in stats().items()
+                                    if isinstance(value, (int, float)) and not isinstance(value, bool)})
+
+
+stats_gauge('music_job_queue', 'Job queue depth, workers and counters', job_queue.stats)
+stats_gauge('music_result_cache', 'Result cache occupancy and counters', result_cache.stats)
+stats_gauge('music_explanations', 'Cached and deferred explanations', explanation_service.stats)
+stats_gauge('music_live_sessions', 'Open live sessions and counters', live_sessions.stats)
+stats_gauge('music_admission', 'Running / waiting analyses and admission counters', admission.stats)
+stats_gauge('music_rate_limiter', 'Tracked clients and rate-limited requests', rate_limiter.stats)
+if INDEX_ENABLED:
+    stats_gauge('music_track_index', 'Indexed tracks and IVF clusters', lambda: get_track_index().stats())
+metrics.gauge('music_model_ready', '1 once artifacts are loaded and warmed up', callback=lambda: int(artifacts.ready))
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of everything recorded in this process"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+if os.environ.get('MUSIC_WARMUP', '1') != '0':
+    artifacts.start_warmup(after=warm_up)
 
 if __name__ == '__main__':
-    print("🎵 Music Feature Explorer Backend Starting...")
-    print("Make sure your index.html is in the same folder!")
-    app.run(debug=True, port=5000, use_reloader=False)
\ No newline at end of file
+    # Development server - for production use gunicorn (see wsgi.py)
+    logger.info("🎵 Music Feature Explorer Backend Starting...")
+    logger.info("Make sure your index.html is in the same folder!")
+    try:
+        app.run(host=os.environ.get('MUSIC_HOST', '127.0.0.1'), port=int(os.environ.get('MUSIC_PORT', 5000)),
+                debug=os.environ.get('MUSIC_DEBUG', '0') != '0', use_reloader=False, threaded=True)
+    finally:
+        shutdown()
\ No newline at end of file
@@ -0,0 +1,318 @@
+"""Benchmark suite for the analyze pipeline
+
+Generates synthetic audio locally (tones, noise, click tracks at several
+lengths and sample rates), times every pipeline stage separately, load-tests
+/analyze through the Flask test client at several concurrency levels and
+writes everything to JSON so runs can be compared.
+
+    python benchmark.py                              # full run -> bench_results.json
+    python benchmark.py --quick                      # one short clip per kind
+    python benchmark.py --output new.json --compare bench_results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+SIGNAL_KINDS = ('tone', 'noise', 'clicks')
+
+
+def synth_signal(kind, duration, sr, seed=0):
+    """Deterministic test signal: a chord, pink-ish noise or a 120 BPM click track"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sr)) / sr
+    if kind == 'tone':
+        # A minor triad with a slow tremolo so the chroma and contrast frames vary
+        y = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 261.63, 329.63)) / 3
+        y *= 0.6 + 0.4 * np.sin(2 * np.pi * 0.5 * t)
+    elif kind == 'noise':
+        y = np.cumsum(rng.standard_normal(len(t)))
+        y -= np.convolve(y, np.ones(64) / 64, mode='same')
+        y /= np.max(np.abs(y)) or 1.0
+    elif kind == 'clicks':
+        y = np.zeros(len(t))
+        click = np.exp(-np.arange(int(0.01 * sr)) / (0.002 * sr))
+        for start in np.arange(0, duration, 0.5):  # 120 BPM
+            i = int(start * sr)
+            y[i:i + len(click)] += click[:len(y) - i]
+        y += 0.01 * rng.standard_normal(len(t))
+    else:
+        raise ValueError(f'Unknown signal kind: {kind}')
+    return (0.5 * y).astype(np.float32)
+
+
+def write_clips(directory, kinds, durations, sample_rates):
+    """Write every kind x duration x sample rate combination as WAV; return {name: path}"""
+    clips = {}
+    for kind in kinds:
+        for duration in durations:
+            for sr in sample_rates:
+                name = f'{kind}_{duration:g}s_{sr}hz'
+                path = os.path.join(directory, f'{name}.wav')
+                sf.write(path, synth_signal(kind, duration, sr), sr)
+                clips[name] = path
+    return clips
+
+
+def summarize(samples):
+    """mean / p50 / p95 / min / max of a list of seconds"""
+    ordered = sorted(samples)
+    return {
+        'runs': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': ordered[len(ordered) // 2],
+        'p95': ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        'min': ordered[0],
+        'max': ordered[-1]
+    }
+
+
+def environment_info():
+    """Where and on what the run happened"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    from model_registry import library_versions
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'libraries': library_versions()
+    }
+
+
+def bench_stages(backend, clips, repeats):
+    """Time each pipeline stage for every clip; returns {clip: {stage: summary}}"""
+    from explanations import FAST, ExplanationService
+
+    # A cache-free explanation service, so SHAP is measured, not looked up
+    uncached = ExplanationService(backend.artifacts, cache_entries=0)
+    results = {}
+
+    for name, path in clips.items():
+        runs = {}
+
+        def record(stage, seconds):
+            runs.setdefault(stage, []).append(seconds)
+
+        for _ in range(repeats):
+            timings = {}
+            features = backend.extract_music_features(path, timings=timings)
+            for stage, seconds in timings.items():
+                record(stage, seconds)
+            record('extract_total', sum(timings.values()))
+
+            feature_values = backend.features_to_matrix([features])
+
+            started = time.perf_counter()
+            feature_values_scaled = backend.artifacts.scaler.transform(feature_values)
+            record('scale', time.perf_counter() - started)
+
+            started = time.perf_counter()
+            prediction_proba = backend.artifacts.model.predict_proba(feature_values_scaled)
+            record('predict_proba', time.perf_counter() - started)
+            prediction = int(np.argmax(prediction_proba[0]))
+
+            started = time.perf_counter()
+            shap_values = uncached.explain(feature_values_scaled)
+            record('shap_exact', time.perf_counter() - started)
+
+            if uncached.fast_available:
+                started = time.perf_counter()
+                uncached.explain(feature_values_scaled, FAST)
+                record('shap_fast', time.perf_counter() - started)
+
+            started = time.perf_counter()
+            results_payload = backend.build_analysis_results(features, prediction_proba[0], prediction,
+                                                             backend.select_shap_row(shap_values, 0, prediction))
+            record('translate', time.perf_counter() - started)
+
+            started = time.perf_counter()
+            json.dumps(results_payload)
+            record('serialize', time.perf_counter() - started)
+
+        results[name] = {stage: summarize(samples) for stage, samples in runs.items()}
+
+    return results
+
+
+def stage_summary(per_clip):
+    """Mean seconds per stage across all clips - the numbers compared between runs"""
+    stages = {}
+    for clip_stages in per_clip.values():
+        for stage, summary in clip_stages.items():
+            stages.setdefault(stage, []).append(summary['mean'])
+    return {stage: statistics.fmean(means) for stage, means in stages.items()}
+
+
+def load_test(backend, clip_path, concurrency_levels, requests_per_level):
+    """Hammer /analyze from N threads; every request uploads distinct bytes so caches can't help"""
+    with open(clip_path, 'rb') as f:
+        audio_bytes = f.read()
+
+    levels = []
+    for concurrency in concurrency_levels:
+        latencies = []
+        errors = [0]
+        lock = threading.Lock()
+        counter = iter(range(requests_per_level))
+
+        def worker():
+            client = backend.app.test_client()
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                # Unique trailing bytes change the content hash but not the decoded audio
+                body = audio_bytes + f'{concurrency}-{i}-{time.time_ns()}'.encode()
+                started = time.perf_counter()
+                response = client.post('/analyze', data={'audio': (io.BytesIO(body), 'bench.wav')},
+                                       content_type='multipart/form-data')
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    if response.status_code != 200:
+                        errors[0] += 1
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        summary = summarize(latencies)
+        levels.append({
+            'concurrency': concurrency,
+            'requests': len(latencies),
+            'errors': errors[0],
+            'throughput_rps': len(latencies) / wall if wall else 0.0,
+            'latency_p50': summary['p50'],
+            'latency_p95': summary['p95'],
+            'latency_max': summary['max']
+        })
+    return levels
+
+
+def compare(current, baseline, threshold):
+    """Stage means and load-test p95 that got slower by more than threshold (fraction)"""
+    regressions = []
+    for stage, seconds in current['stage_summary'].items():
+        before = baseline.get('stage_summary', {}).get(stage)
+        if before and seconds > before * (1 + threshold):
+            regressions.append({'metric': f'stage:{stage}', 'before': before, 'after': seconds,
+                                'change': seconds / before - 1})
+
+    before_levels = {level['concurrency']: level for level in baseline.get('load_test', [])}
+    for level in current.get('load_test', []):
+        before = before_levels.get(level['concurrency'])
+        if before and level['latency_p95'] > before['latency_p95'] * (1 + threshold):
+            regressions.append({'metric': f"load_p95@{level['concurrency']}", 'before': before['latency_p95'],
+                                'after': level['latency_p95'], 'change': level['latency_p95'] / before['latency_p95'] - 1})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the music analysis pipeline')
+    parser.add_argument('--output', default='bench_results.json', help='relative to the repository root')
+    parser.add_argument('--compare', metavar='BASELINE_JSON', help='fail if slower than this earlier run')
+    parser.add_argument('--threshold', type=float, default=0.15, help='allowed slowdown before flagging (0.15 = 15%%)')
+    parser.add_argument('--kinds', nargs='+', default=list(SIGNAL_KINDS), choices=SIGNAL_KINDS)
+    parser.add_argument('--durations', nargs='+', type=float, default=[10.0, 30.0, 60.0])
+    parser.add_argument('--sample-rates', nargs='+', type=int, default=[22050, 44100])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 2, 4, 8])
+    parser.add_argument('--requests', type=int, default=16, help='requests per concurrency level')
+    parser.add_argument('--quick', action='store_true', help='10 s clips at 22050 Hz, 1 repeat, light load test')
+    parser.add_argument('--verbose', action='store_true', help='keep the pipeline\'s own progress output')
+    args = parser.parse_args()
+
+    if args.quick:
+        args.durations, args.sample_rates, args.repeats = [10.0], [22050], 1
+        args.concurrency, args.requests = [1, 4], 8
+
+    # The backend finds its pickles and index.html relative to the working directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    # Caches would turn repeat runs into lookups - measure the real work
+    os.environ['MUSIC_CACHE_ENTRIES'] = '0'
+    os.environ['MUSIC_WARMUP'] = '0'  # warmed up explicitly below
+    if not args.verbose:
+        os.environ['MUSIC_LOG_LEVEL'] = 'WARNING'
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with quiet:
+        import backend
+        from explanations import ExplanationService
+
+        backend.explanation_service = ExplanationService(backend.artifacts, cache_entries=0)
+        backend.artifacts.load_all()
+        backend.warm_up()
+
+    with tempfile.TemporaryDirectory(prefix='music_bench_') as directory:
+        clips = write_clips(directory, args.kinds, args.durations, args.sample_rates)
+        print(f"🎧 Generated {len(clips)} synthetic clips")
+
+        with quiet:
+            per_clip = bench_stages(backend, clips, args.repeats)
+        for name, stages in per_clip.items():
+            print(f"⏱️ {name}: extract {stages['extract_total']['mean'] * 1000:.0f} ms")
+
+        load_clip = min(clips.values(), key=lambda path: abs(sf.info(path).duration - 30.0))
+        with quiet:
+            load = load_test(backend, load_clip, args.concurrency, args.requests)
+        for level in load:
+            print(f"🚦 concurrency {level['concurrency']}: {level['throughput_rps']:.2f} req/s, "
+                  f"p95 {level['latency_p95'] * 1000:.0f} ms, {level['errors']} errors")
+
+    results = {
+        'meta': environment_info(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'verbose')},
+        'stage_summary': stage_summary(per_clip),
+        'stages': per_clip,
+        'load_test': load
+    }
+
+    print("\n📊 Mean seconds per stage:")
+    for stage, seconds in sorted(results['stage_summary'].items(), key=lambda item: -item[1]):
+        print(f"  {stage:15s} {seconds * 1000:9.2f} ms")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) vs {args.compare}:")
+            for regression in regressions:
+                print(f"  {regression['metric']}: {regression['before'] * 1000:.2f} ms -> "
+                      f"{regression['after'] * 1000:.2f} ms (+{regression['change'] * 100:.0f}%)")
+            return 1
+        print(f"✅ No regressions beyond {args.threshold * 100:.0f}% vs {args.compare}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""Offline bulk analysis of a whole audio library - no web server involved
+
+Walks a directory tree, extracts features in a process pool and writes
+features, predictions and SHAP values in parts as it goes:
+
+    OUTPUT/part-00000.npz   paths, features, probabilities, predictions, shap
+    OUTPUT/results.csv      one row per track: path, genre, probabilities, features
+    OUTPUT/failures.jsonl   files that could not be decoded
+    OUTPUT/run.json         classes, feature names, model version
+
+With --frame-store, each track's spectral frames are kept by content hash, so
+rerunning into a fresh OUTPUT after a model or feature change recomputes
+everything from the stored frames without decoding a single file.
+
+Every part is written atomically, so the parts already on disk are the
+checkpoint: rerunning the same command skips every file recorded in them (and
+in failures.jsonl) and carries on where an interrupted run stopped.
+
+    python bulk_analyze.py ~/music/library --output library_features
+    python bulk_analyze.py ~/music/library --output library_features --shap fast --workers 8
+    python bulk_analyze.py ~/music/library --output features_v2 --frame-store frame_store
+    python bulk_analyze.py ~/music/library --output quick_scan --fidelity fast
+"""
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from audio_features import EXACT_PROFILE, FEATURE_NAMES, PROFILES, extract_with_timings
+from explanations import EXACT, FAST, OFF, ExplanationService
+from frame_store import FrameStore
+from inference import TREES_NAME, build_backend
+from instrumentation import configure_logging
+from model_registry import ArtifactRegistry
+
+logger = logging.getLogger(__name__)
+
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.au'}
+PART_PATTERN = 'part-*.npz'
+
+
+def find_audio_files(root):
+    """Every audio file under root, as sorted paths relative to root"""
+    found = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in filenames:
+            if os.path.splitext(filename)[1].lower() in AUDIO_EXTENSIONS:
+                found.append(os.path.relpath(os.path.join(directory, filename), root))
+    return sorted(found)
+
+
+def processed_paths(output):
+    """Relative paths already recorded in finished parts or in failures.jsonl"""
+    done = set()
+    for part in glob.glob(os.path.join(output, PART_PATTERN)):
+        with np.load(part) as data:
+            done.update(data['paths'].tolist())
+    failures = os.path.join(output, 'failures.jsonl')
+    if os.path.exists(failures):
+        with open(failures, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)['path'])
+                except ValueError:
+                    continue
+    return done
+
+
+def load_results(output):
+    """Concatenate every part into one dict of arrays (for notebooks and training)"""
+    parts = sorted(glob.glob(os.path.join(output, PART_PATTERN)))
+    if not parts:
+        return {}
+    loaded = [dict(np.load(part)) for part in parts]
+    return {key: np.concatenate([data[key] for data in loaded]) for key in loaded[0]}
+
+
+class PartWriter:
+    """Writes finished rows as numbered NPZ parts plus CSV rows, atomically per part"""
+
+    def __init__(self, output, genre_names):
+        self.output = output
+        self.genre_names = list(genre_names)
+        existing = glob.glob(os.path.join(output, PART_PATTERN))
+        self.next_part = 1 + max((int(os.path.basename(p)[5:10]) for p in existing), default=-1)
+        self.csv_path = os.path.join(output, 'results.csv')
+
+    def write(self, paths, feature_values, prediction_proba, predictions, shap_values):
+        name = f'part-{self.next_part:05d}.npz'
+        arrays = {
+            'paths': np.array(paths),
+            'features': feature_values.astype(np.float32),
+            'probabilities': prediction_proba.astype(np.float32),
+            'predictions': np.asarray(predictions, dtype=np.int16)
+        }
+        if shap_values is not None:
+            arrays['shap'] = shap_values.astype(np.float32)
+
+        # CSV first, NPZ last: the NPZ parts are the checkpoint, so a crash in between
+        # only means this part is redone on resume (and its CSV rows repeat)
+        new_csv = not os.path.exists(self.csv_path)
+        with open(self.csv_path, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            if new_csv:
+                writer.writerow(['path', 'primary_genre'] + [f'prob_{genre}' for genre in self.genre_names]
+                                + FEATURE_NAMES)
+            for i, path in enumerate(paths):
+                writer.writerow([path, self.genre_names[predictions[i]]]
+                                + [f'{p:.6f}' for p in prediction_proba[i]]
+                                + [f'{v:.6g}' for v in feature_values[i]])
+
+        temp_path = os.path.join(self.output, f'.{name}.tmp.npz')
+        np.savez_compressed(temp_path, **arrays)
+        os.replace(temp_path, os.path.join(self.output, name))
+        self.next_part += 1
+        return name
+
+
+class BulkAnalyzer:
+    """Batches extracted tracks through the models and hands them to a PartWriter"""
+
+    def __init__(self, artifacts, output, shap_mode=EXACT, part_size=256):
+        self.artifacts = artifacts
+        self.output = output
+        self.shap_mode = shap_mode
+        self.part_size = part_size
+        self.explanations = ExplanationService(artifacts, cache_entries=0)
+        self.inference = build_backend(artifacts, trees_path=os.path.join(artifacts.directory, TREES_NAME))
+        self.writer = PartWriter(output, artifacts.label_encoder.classes_)
+        self.pending = []  # (path, features)
+        self.stage_seconds = {}
+        self.analysed = 0
+        self.failed = 0
+
+    def add(self, path, features, timings):
+        for stage, seconds in timings.items():
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+        if features is None:
+            self.failed += 1
+            with open(os.path.join(self.output, 'failures.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'path': path, 'error': 'Could not extract features'}) + '\n')
+            return
+        self.pending.append((path, features))
+        if len(self.pending) >= self.part_size:
+            self.flush()
+
+    def flush(self):
+        """Predict and explain every pending track in ONE model pass and write a part"""
+        if not self.pending:
+            return
+        paths = [path for path, _ in self.pending]
+        feature_values = np.array([[features[name] for name in FEATURE_NAMES] for _, features in self.pending])
+
+        feature_values_scaled = self.artifacts.scaler.transform(feature_values)
+        prediction_proba, predictions = self.inference.predict(feature_values)
+
+        shap_values = None
+        if self.shap_mode != OFF:
+            # Keep the predicted class only: (tracks, features)
+            values = self.explanations.explain(feature_values_scaled, self.shap_mode)
+            columns = predictions if values.shape[2] > 1 else np.zeros(len(predictions), dtype=int)
+            shap_values = values[np.arange(len(predictions)), :, columns]
+
+        name = self.writer.write(paths, feature_values, prediction_proba, predictions, shap_values)
+        self.analysed += len(paths)
+        self.pending = []
+        logger.debug("💾 Wrote %s (%d tracks)", name, len(paths))
+
+
+def run(root, output, workers, shap_mode, part_size, limit=None, frame_store=None, profile=EXACT_PROFILE):
+    """Analyse everything under root not yet recorded in output; returns a summary dict"""
+    os.makedirs(output, exist_ok=True)
+    artifacts = ArtifactRegistry(directory=os.path.dirname(os.path.abspath(__file__)))
+    artifacts.load_all()
+
+    with open(os.path.join(output, 'run.json'), 'w', encoding='utf-8') as f:
+        json.dump({'root': os.path.abspath(root), 'model_version': artifacts.version,
+                   'classes': [str(c) for c in artifacts.label_encoder.classes_],
+                   'feature_names': FEATURE_NAMES, 'shap_mode': shap_mode, 'fidelity': profile.name}, f, indent=2)
+
+    all_files = find_audio_files(root)
+    done = processed_paths(output)
+    todo = [path for path in all_files if path not in done]
+    if limit is not None:
+        todo = todo[:limit]
+    logger.info("🎧 %d audio files found, %d already processed, %d to do", len(all_files), len(done), len(todo))
+
+    analyzer = BulkAnalyzer(artifacts, output, shap_mode, part_size)
+    started = time.perf_counter()
+    last_report = started
+    completed = 0
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        remaining = iter(todo)
+        in_flight = {}
+        # A bounded window of submissions keeps memory flat and Ctrl-C responsive
+        while True:
+            while len(in_flight) < 2 * workers:
+                path = next(remaining, None)
+                if path is None:
+                    break
+                in_flight[executor.submit(extract_with_timings, os.path.join(root, path), path, frame_store,
+                                          profile=profile)] = path
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path = in_flight.pop(future)
+                try:
+                    features, timings = future.result()
+                except Exception as e:
+                    logger.warning("⚠️ %s failed: %s", path, e)
+                    features, timings = None, {}
+                analyzer.add(path, features, timings)
+                completed += 1
+
+            now = time.perf_counter()
+            if now - last_report >= 10:
+                rate = completed / (now - started)
+                logger.info("⏱️ %d/%d files, %.2f files/s, ETA %.0f s", completed, len(todo), rate,
+                            (len(todo) - completed) / rate if rate else 0)
+                last_report = now
+    except KeyboardInterrupt:
+        logger.warning("⏹️ Interrupted - saving finished tracks, rerun to resume")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        analyzer.flush()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'files': len(todo),
+        'analysed': analyzer.analysed,
+        'failed': analyzer.failed,
+        'seconds': elapsed,
+        'files_per_second': completed / elapsed if elapsed else 0.0,
+        # Summed over workers, so this is CPU-seconds per stage rather than wall time
+        'stage_seconds': analyzer.stage_seconds
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Analyse a directory tree of audio files offline')
+    parser.add_argument('root', help='directory to scan recursively')
+    parser.add_argument('--output', default='bulk_results', help='directory for parts, CSV and checkpoints')
+    parser.add_argument('--workers', type=int, default=None, help='extraction processes (default: all cores)')
+    parser.add_argument('--shap', choices=[EXACT, FAST, OFF], default=EXACT, help='SHAP values to store')
+    parser.add_argument('--part-size', type=int, default=256, help='tracks per output part / model batch')
+    parser.add_argument('--limit', type=int, default=None, help='process at most this many new files')
+    parser.add_argument('--frame-store', default=None, help='directory of stored spectral frames (reused and filled)')
+    parser.add_argument('--compress-frames', action='store_true', help='deflate newly stored frames')
+    parser.add_argument('--fidelity', choices=list(PROFILES), default=EXACT_PROFILE.name,
+                        help='extraction profile (see evaluate_fidelity.py for the trade-offs)')
+    args = parser.parse_args()
+
+    configure_logging()
+    workers = args.workers or (len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1)
+    try:
+        frame_store = FrameStore(args.frame_store, compress=args.compress_frames) if args.frame_store else None
+        summary = run(args.root, args.output, workers, args.shap, args.part_size, args.limit, frame_store,
+                      PROFILES[args.fidelity])
+    except KeyboardInterrupt:
+        return 130
+
+    print(f"✅ {summary['analysed']} analysed, {summary['failed']} failed in {summary['seconds']:.1f} s "
+          f"({summary['files_per_second']:.2f} files/s)")
+    for stage, seconds in sorted(summary['stage_seconds'].items(), key=lambda item: -item[1]):
+        print(f"  {stage:12s} {seconds:9.2f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Precomputed demo analyses, one per genre, served without touching librosa or SHAP
+
+Demo tracks live in demo_tracks/ named after the genre they illustrate
+(demo_tracks/jazz.mp3, demo_tracks/rock.wav, ...). Building the store runs each
+one through the normal analysis pipeline ONCE and saves the complete payloads,
+together with the model version, to demo_results.json. At serve time every
+payload is held pre-serialised with its ETag, so a demo request is a dict lookup.
+
+    python demo_store.py build        # after adding tracks or retraining
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STORE_NAME = 'demo_results.json'
+DEMO_DIR = 'demo_tracks'
+AUDIO_EXTENSIONS = {'.mp3', '.wav', '.m4a', '.flac', '.ogg', '.au'}
+
+
+class DemoEntry:
+    """One ready-to-send demo response"""
+    __slots__ = ('genre', 'track', 'body', 'etag')
+
+    def __init__(self, genre, track, results):
+        self.genre = genre
+        self.track = track
+        self.body = json.dumps(results).encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+
+
+class DemoStore:
+    """Loads, builds and looks up the precomputed demo payloads"""
+
+    def __init__(self, path=STORE_NAME, demo_dir=DEMO_DIR):
+        self.path = path
+        self.demo_dir = demo_dir
+        self.model_version = None
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Read the store from disk; returns the number of demos loaded"""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, encoding='utf-8') as f:
+            stored = json.load(f)
+        entries = {genre: DemoEntry(genre, demo['track'], demo['results'])
+                   for genre, demo in stored.get('demos', {}).items()}
+        with self._lock:
+            self._entries = entries
+            self.model_version = stored.get('model_version')
+        logger.info("🎬 Loaded %d demo analyses (model %s)", len(entries), self.model_version)
+        return len(entries)
+
+    def get(self, genre):
+        """The DemoEntry for a genre (case-insensitive), or None"""
+        entries = self._entries
+        return entries.get(genre) or entries.get(genre.lower())
+
+    def genres(self):
+        return sorted(self._entries)
+
+    def demo_tracks(self, genres):
+        """{genre: path} for every genre with a track in demo_dir"""
+        tracks = {}
+        for genre in genres:
+            candidates = sorted(path for path in glob.glob(os.path.join(self.demo_dir, f'{genre}.*'))
+                                if os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS)
+            if candidates:
+                tracks[genre] = candidates[0]
+        return tracks
+
+    def is_stale(self, model_version, genres):
+        """True when the store was built for another model or misses an available demo track"""
+        if self.model_version != model_version:
+            return bool(self.demo_tracks(genres))
+        return any(genre not in self._entries for genre in self.demo_tracks(genres))
+
+    def build(self, analyze, model_version, genres):
+        """Analyse every demo track with analyze(audio_bytes, filename) and save the store
+
+        analyze returns the /analyze payload (or None on failure).
+        """
+        demos = {}
+        for genre, path in self.demo_tracks(genres).items():
+            with open(path, 'rb') as f:
+                results = analyze(f.read(), os.path.basename(path))
+            if results is None:
+                logger.warning("⚠️ Could not analyse demo track %s", path)
+                continue
+            # The frontend hides the "predicted genre" summary for demos
+            demos[genre] = {'track': os.path.basename(path), 'results': {**results, 'demo': True, 'demo_genre': genre}}
+            logger.info("🎬 Built demo for %s from %s", genre, path)
+
+        missing = sorted(set(genres) - set(demos))
+        if missing:
+            logger.warning("⚠️ No demo track for: %s (add %s/<genre>.wav)", ', '.join(missing), self.demo_dir)
+
+        stored = {'model_version': model_version, 'built': time.time(), 'demos': demos}
+        # Per process - several workers may rebuild a stale store at once
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(stored, f)
+        os.replace(temp_path, self.path)
+        self.load()
+        return sorted(demos)
+
+
+def main():
+    if len(sys.argv) != 2 or sys.argv[1] != 'build':
+        print("usage: python demo_store.py build")
+        return 2
+
+    # The backend finds its pickles and the demo tracks relative to the repository root
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.environ['MUSIC_WARMUP'] = '0'
+    import backend
+
+    built = backend.build_demo_store()
+    print(f"✅ Built {len(built)} demo(s): {', '.join(built) or 'none'} -> {STORE_NAME}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""Evaluate the extraction fidelity profiles against exact - speed and agreement
+
+Every file is extracted with every profile (after one untimed warm-up pass),
+and each profile is compared with exact on the same files:
+
+    speedup             median exact seconds / median profile seconds per file
+    feature agreement   |difference| in training standard deviations (scaler
+                        units), averaged per feature; the worst features listed
+    genre agreement     share of files with the same predicted genre, and the
+                        mean total variation distance between the probabilities
+
+    python evaluate_fidelity.py ~/music/sample --limit 50
+    python evaluate_fidelity.py a.wav b.mp3 --profiles balanced fast --output fidelity.json
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from audio_features import EXACT_PROFILE, FEATURE_NAMES, PROFILES, extract_music_features
+from bulk_analyze import find_audio_files
+from inference import TREES_NAME, build_backend
+from instrumentation import configure_logging
+from model_registry import ArtifactRegistry
+
+logger = logging.getLogger(__name__)
+
+
+def collect_paths(sources, limit=None):
+    """Audio files named directly or found under the given directories"""
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths.extend(os.path.join(source, path) for path in find_audio_files(source))
+        else:
+            paths.append(source)
+    return paths[:limit] if limit else paths
+
+
+def time_extraction(paths, profile, repeats=1):
+    """({path: features}, {path: best seconds}) - files that fail to extract are left out"""
+    features, seconds = {}, {}
+    for path in paths:
+        best = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            extracted = extract_music_features(path, profile=profile)
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        if extracted is not None:
+            features[path] = extracted
+            seconds[path] = best
+    return features, seconds
+
+
+def compare(reference, candidate, scaler, inference, genre_names):
+    """Agreement of candidate features (and predictions) with the reference ones, over shared files"""
+    paths = [path for path in reference if path in candidate]
+    reference_values = np.array([[reference[path][name] for name in FEATURE_NAMES] for path in paths])
+    candidate_values = np.array([[candidate[path][name] for name in FEATURE_NAMES] for path in paths])
+
+    # In scaler units a difference of 1.0 is one training standard deviation
+    deviations = np.abs(scaler.transform(candidate_values) - scaler.transform(reference_values))
+    per_feature = deviations.mean(axis=0)
+    worst = np.argsort(per_feature)[::-1][:5]
+
+    reference_proba, reference_genres = inference.predict(reference_values)
+    candidate_proba, candidate_genres = inference.predict(candidate_values)
+    changed = [{'path': path, 'exact': str(genre_names[a]), 'profile': str(genre_names[b])}
+               for path, a, b in zip(paths, reference_genres, candidate_genres) if a != b]
+    return {
+        'files': len(paths),
+        'feature_mean_deviation': float(deviations.mean()),
+        'feature_max_deviation': float(deviations.max()),
+        'worst_features': {FEATURE_NAMES[i]: float(per_feature[i]) for i in worst},
+        'genre_agreement': float(np.mean(reference_genres == candidate_genres)),
+        'probability_distance': float(0.5 * np.abs(candidate_proba - reference_proba).sum(axis=1).mean()),
+        'changed_genres': changed
+    }
+
+
+def evaluate(paths, profile_names, repeats=1):
+    """Per-profile timing and agreement with exact, as one JSON-ready dict"""
+    artifacts = ArtifactRegistry(directory=os.path.dirname(os.path.abspath(__file__)))
+    artifacts.load_all()
+    inference = build_backend(artifacts, trees_path=os.path.join(artifacts.directory, TREES_NAME))
+    genre_names = artifacts.label_encoder.classes_
+
+    # Warm librosa's caches and numba JIT so the first profile timed is not penalised
+    for profile in PROFILES.values():
+        extract_music_features(paths[0], profile=profile)
+
+    extracted = {}
+    results = {'files': len(paths), 'model_version': artifacts.version, 'profiles': {}}
+    for name in [EXACT_PROFILE.name] + [name for name in profile_names if name != EXACT_PROFILE.name]:
+        logger.info("⏱️ Extracting %d files with the %s profile...", len(paths), name)
+        features, seconds = time_extraction(paths, PROFILES[name], repeats)
+        extracted[name] = (features, seconds)
+        results['profiles'][name] = {
+            'settings': PROFILES[name].settings(),
+            'median_seconds': statistics.median(seconds.values()) if seconds else None,
+            'failed': len(paths) - len(features)
+        }
+
+    exact_features, exact_seconds = extracted[EXACT_PROFILE.name]
+    for name, (features, seconds) in extracted.items():
+        shared = [path for path in seconds if path in exact_seconds]
+        entry = results['profiles'][name]
+        if not shared:
+            continue
+        # Per-file ratio, so slow and fast files weigh the same
+        entry['speedup'] = statistics.median(exact_seconds[path] / seconds[path] for path in shared)
+        entry.update(compare(exact_features, features, artifacts.scaler, inference, genre_names))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Speed and agreement of each fidelity profile with exact')
+    parser.add_argument('sources', nargs='+', help='audio files and/or directories to scan recursively')
+    parser.add_argument('--profiles', nargs='+', choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument('--limit', type=int, default=None, help='evaluate at most this many files')
+    parser.add_argument('--repeats', type=int, default=1, help='time each extraction this many times, keep the best')
+    parser.add_argument('--output', default=None, help='also write the full report as JSON')
+    args = parser.parse_args()
+
+    configure_logging()
+    paths = collect_paths(args.sources, args.limit)
+    if not paths:
+        print("❌ No audio files found")
+        return 1
+
+    results = evaluate(paths, args.profiles, args.repeats)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    print(f"{'profile':10s} {'median s':>9s} {'speedup':>8s} {'genre':>7s} {'prob TV':>8s} {'feat dev':>9s}  worst feature")
+    for name, entry in results['profiles'].items():
+        if 'speedup' not in entry:
+            print(f"{name:10s} no files extracted")
+            continue
+        worst_name, worst_value = next(iter(entry['worst_features'].items()))
+        print(f"{name:10s} {entry['median_seconds']:9.3f} {entry['speedup']:7.2f}x {entry['genre_agreement']:7.1%} "
+              f"{entry['probability_distance']:8.3f} {entry['feature_mean_deviation']:9.3f}  "
+              f"{worst_name} ({worst_value:.2f} sd)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
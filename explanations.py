@@ -0,0 +1,134 @@
+"""SHAP explanations with exact, fast and deferred modes
+
+exact    - the pickled shap.TreeExplainer, same numbers as before
+fast     - the model's own tree contribution path (XGBoost pred_contribs), which
+           runs TreeSHAP natively and skips the Python explainer entirely
+off      - nothing is computed during analysis; the scaled vector is remembered
+           and explained later on request (deferred)
+
+Every explanation is cached per (feature vector, mode), so repeat uploads and
+repeat clicks on the explanation panel cost nothing.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+EXACT = 'exact'
+FAST = 'fast'
+OFF = 'off'
+MODES = (EXACT, FAST, OFF)
+
+
+def as_class_matrix(shap_values):
+    """Normalise any SHAP layout to shape (samples, features, classes)"""
+    if isinstance(shap_values, list):
+        # Multi-class case: list of (samples, features) arrays, one per class
+        return np.stack([np.asarray(values) for values in shap_values], axis=-1)
+    shap_values = np.asarray(shap_values)
+    if shap_values.ndim == 2:
+        # Single output: one "class" column
+        return shap_values[:, :, np.newaxis]
+    return shap_values
+
+
+def vector_id(row):
+    """Stable id for one scaled feature vector"""
+    return hashlib.sha1(np.ascontiguousarray(row, dtype=np.float64).tobytes()).hexdigest()[:20]
+
+
+class ExplanationService:
+    """Computes, caches and defers SHAP values for scaled feature vectors
+
+    artifacts is any object with .model and .explainer attributes (e.g. the
+    lazy ArtifactRegistry) - they are only touched when SHAP is computed.
+    """
+
+    def __init__(self, artifacts, cache_entries=2048, pending_entries=4096):
+        self.artifacts = artifacts
+        self.cache_entries = cache_entries
+        self.pending_entries = pending_entries
+        self._cache = OrderedDict()    # (vector id, mode) -> (features, classes) array
+        self._pending = OrderedDict()  # vector id -> (scaled row, predicted class)
+        self._lock = threading.Lock()
+
+    @property
+    def fast_available(self):
+        """True when the model exposes native tree contributions"""
+        return hasattr(self.artifacts.model, 'get_booster')
+
+    def explain(self, feature_values_scaled, mode=EXACT):
+        """SHAP values for a scaled matrix as (samples, features, classes)
+
+        Cached rows are reused; the remaining rows go through ONE explainer call.
+        """
+        if mode == FAST and not self.fast_available:
+            mode = EXACT
+
+        ids = [vector_id(row) for row in feature_values_scaled]
+        rows = [None] * len(ids)
+        with self._lock:
+            for i, key in enumerate(ids):
+                cached = self._cache.get((key, mode))
+                if cached is not None:
+                    self._cache.move_to_end((key, mode))
+                    rows[i] = cached
+
+        missing = [i for i, row in enumerate(rows) if row is None]
+        if missing:
+            computed = self._compute(feature_values_scaled[missing], mode)
+            with self._lock:
+                for i, values in zip(missing, computed):
+                    rows[i] = values
+                    self._cache[(ids[i], mode)] = values
+                while len(self._cache) > self.cache_entries:
+                    self._cache.popitem(last=False)
+
+        return np.stack(rows)
+
+    def _compute(self, feature_values_scaled, mode):
+        if mode == FAST:
+            return self._native_contributions(feature_values_scaled)
+        return as_class_matrix(self.artifacts.explainer.shap_values(feature_values_scaled))
+
+    def _native_contributions(self, feature_values_scaled):
+        # Local import: xgboost is only needed for this path
+        import xgboost as xgb
+
+        booster = self.artifacts.model.get_booster()
+        matrix = xgb.DMatrix(feature_values_scaled, feature_names=booster.feature_names)
+        contribs = booster.predict(matrix, pred_contribs=True)
+        # Last column is the bias term, not a feature
+        if contribs.ndim == 3:
+            # Shape (samples, classes, features + 1)
+            return np.transpose(contribs[:, :, :-1], (0, 2, 1))
+        return contribs[:, :-1, np.newaxis]
+
+    def defer(self, feature_values_scaled, predictions):
+        """Remember vectors for a later explain_deferred() call and return their ids"""
+        ids = []
+        with self._lock:
+            for row, prediction in zip(feature_values_scaled, predictions):
+                key = vector_id(row)
+                self._pending[key] = (np.array(row), int(prediction))
+                self._pending.move_to_end(key)
+                ids.append(key)
+            while len(self._pending) > self.pending_entries:
+                self._pending.popitem(last=False)
+        return ids
+
+    def explain_deferred(self, key, mode=EXACT):
+        """(shap values for the predicted class, predicted class) for a deferred vector, or None"""
+        with self._lock:
+            pending = self._pending.get(key)
+        if pending is None:
+            return None
+        row, prediction = pending
+        values = self.explain(row[np.newaxis, :], mode)[0]
+        return values[:, prediction if values.shape[1] > 1 else 0], prediction
+
+    def stats(self):
+        """Cache occupancy for monitoring"""
+        with self._lock:
+            return {'cached_explanations': len(self._cache), 'deferred_vectors': len(self._pending)}
@@ -0,0 +1,148 @@
+"""Intermediate spectral representations of analysed tracks, keyed by content hash
+
+Decoding and resampling are the most expensive part of extraction, and they
+don't change when a feature, the translator or the model does. The store
+keeps each track's frame-level representations (mel spectrogram, CQT chroma,
+onset envelope, spectral contrast) so the 34 features can be recomputed from
+them without touching the audio again.
+
+One .npz per track under a two-character fan-out (ab/abcdef....npz). Entries
+are written uncompressed by default and their arrays are then memory-mapped
+straight out of the file; compress=True deflates them instead (~15% smaller,
+read into memory). Every entry records the frontend signature it was computed
+with (sample rate, FFT, hop, resampler, librosa version) and entries with a
+different signature count as misses.
+
+    python frame_store.py stats frame_store
+    python frame_store.py prune frame_store      # drop entries from other frontend settings
+
+Fidelity profiles other than exact store their frames under '<hash>-<profile>'.
+"""
+import argparse
+import glob
+import logging
+import os
+import sys
+import tempfile
+import zipfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_KEY = '__signature__'
+
+
+def _memmap_member(path, info):
+    """Memory-map one STORED .npy member of a zip archive in place"""
+    with open(path, 'rb') as f:
+        # Local file header: 30 fixed bytes + name + extra field, then the member data
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    if dtype.hasobject or not shape or 0 in shape:
+        return None
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+class FrameStore:
+    """Content-addressed store of per-track frame arrays"""
+
+    def __init__(self, directory, compress=False):
+        self.directory = directory
+        self.compress = compress
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.npz')
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def get(self, key, signature=None):
+        """{name: array} for key, or None when missing, unreadable or from another signature"""
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with zipfile.ZipFile(path) as archive:
+                members = {info.filename[:-4]: info for info in archive.infolist()}
+            with np.load(path) as data:
+                if signature is not None and (SIGNATURE_KEY not in members
+                                              or str(data[SIGNATURE_KEY]) != signature):
+                    return None
+                arrays = {}
+                for name, info in members.items():
+                    if name == SIGNATURE_KEY:
+                        continue
+                    # Uncompressed members are mapped in place, deflated ones read into memory
+                    mapped = _memmap_member(path, info) if info.compress_type == zipfile.ZIP_STORED else None
+                    arrays[name] = mapped if mapped is not None else data[name]
+                return arrays
+        except Exception as e:
+            logger.warning("⚠️ Ignoring unreadable frame store entry %s: %s", path, e)
+            return None
+
+    def put(self, key, arrays, signature=''):
+        """Write an entry atomically - concurrent writers of the same key are harmless"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                save = np.savez_compressed if self.compress else np.savez
+                save(f, **{SIGNATURE_KEY: np.array(signature)}, **arrays)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def keys(self):
+        for path in glob.glob(os.path.join(self.directory, '??', '*.npz')):
+            yield os.path.basename(path)[:-4]
+
+    def signature(self, key):
+        with np.load(self.path(key)) as data:
+            return str(data[SIGNATURE_KEY])
+
+    def stats(self):
+        paths = glob.glob(os.path.join(self.directory, '??', '*.npz'))
+        return {'entries': len(paths), 'bytes': sum(os.path.getsize(path) for path in paths)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Frame store maintenance')
+    parser.add_argument('command', choices=['stats', 'prune'])
+    parser.add_argument('directory')
+    args = parser.parse_args()
+
+    from audio_features import PROFILES, frontend_signature
+
+    store = FrameStore(args.directory)
+    if args.command == 'stats':
+        stats = store.stats()
+        print(f"{stats['entries']} entries, {stats['bytes'] / 1e6:.1f} MB (current frontend: {frontend_signature()})")
+        return 0
+
+    current = {frontend_signature(profile) for profile in PROFILES.values()}
+    removed = 0
+    for key in list(store.keys()):
+        try:
+            stale = store.signature(key) not in current
+        except Exception:
+            stale = True
+        if stale:
+            os.remove(store.path(key))
+            removed += 1
+    print(f"🧹 Removed {removed} entries computed with other frontend settings")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
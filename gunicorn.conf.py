@@ -0,0 +1,46 @@
+"""gunicorn settings for the music backend - every value can be overridden from the environment
+
+    gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+
+One threaded (gthread) worker by default: librosa and numpy release the GIL
+for most of their work, and with MUSIC_OFFLOAD_EXTRACTION=1 request threads
+only wait on the worker's process pool, so one worker keeps the cores busy.
+
+Jobs (/jobs), deferred explanations (/explain) and live sessions (/live) are
+held in the worker's memory, and the admission and rate-limit budgets are per
+worker. With MUSIC_WORKERS > 1 put a proxy with sticky routing (e.g. by client
+address) in front, and divide MUSIC_MAX_CONCURRENT / MUSIC_RATE_LIMIT by the
+worker count.
+"""
+import os
+
+import wsgi
+
+bind = os.environ.get('MUSIC_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('MUSIC_WORKERS', 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('MUSIC_THREADS', 4))
+
+# Load the models in the master so workers share them copy-on-write
+preload_app = True
+
+# Long uploads are analysed synchronously - allow for them, then recycle stuck workers
+timeout = int(os.environ.get('MUSIC_TIMEOUT', 180))
+# SIGTERM: stop accepting, let running analyses finish for up to this long
+graceful_timeout = int(os.environ.get('MUSIC_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+# Recycle workers now and then so slow leaks (librosa / numba caches) stay bounded
+max_requests = int(os.environ.get('MUSIC_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('MUSIC_ACCESS_LOG') or None
+loglevel = os.environ.get('MUSIC_LOG_LEVEL', 'info').lower()
+
+
+def post_fork(server, worker):
+    wsgi.start_worker()
+
+
+def worker_exit(server, worker):
+    wsgi.stop_worker()
@@ -0,0 +1,202 @@
+"""Metrics and logging for the analysis service
+
+A small, dependency-free metrics registry rendered in the Prometheus text
+format (served on /metrics), plus leveled logging that can emit one JSON
+object per line for log shippers.
+
+Metrics are per process: under a multi-worker server, scrape every worker
+or aggregate them downstream.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+# Seconds - from sub-millisecond translation up to minute-long analyses
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Bytes - 64 KB up to 256 MB uploads
+SIZE_BUCKETS = tuple(float(64 * 1024 * 4 ** i) for i in range(8))
+
+
+def _label_text(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class: a named family of series keyed by label values"""
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        return [f'{self.name}{_label_text(self.labelnames, key)} {_number(value)}'
+                for key, value in sorted(self._series.items())]
+
+
+class Gauge(Metric):
+    """Point-in-time value, set directly or read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        # callback() returns a number, or {label value tuple: number} for labelled gauges
+        self.callback = callback
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = float(value)
+
+    def _samples(self):
+        series = dict(self._series)
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception:
+                logging.getLogger(__name__).exception("Gauge callback for %s failed", self.name)
+                values = {}
+            if not isinstance(values, dict):
+                values = {(): values}
+            series.update({tuple(str(v) for v in key): float(value) for key, value in values.items()})
+        return [f'{self.name}{_label_text(self.labelnames, key)} {_number(value)}'
+                for key, value in sorted(series.items())]
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram with sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def _samples(self):
+        lines = []
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                labels = _label_text(self.labelnames, key, [('le', _number(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _label_text(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_number(series["sum"])}')
+            lines.append(f'{self.name}_count{labels} {series["count"]}')
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric and renders the /metrics page"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._add(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self._add(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# LOGGING
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; extra={'fields': {...}} adds structured fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, fmt=None):
+    """Root logging setup from MUSIC_LOG_LEVEL (default INFO) and MUSIC_LOG_FORMAT (text|json)"""
+    level = (level or os.environ.get('MUSIC_LOG_LEVEL', 'INFO')).upper()
+    fmt = fmt or os.environ.get('MUSIC_LOG_FORMAT', 'text')
+
+    handler = logging.StreamHandler()
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-7s %(name)s: %(message)s'))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
@@ -0,0 +1,181 @@
+"""In-process job queue for long analyses - no external broker needed
+
+POST handlers submit a job and return its id straight away; a bounded pool of
+worker threads drains a bounded queue. When the queue is full, submit() raises
+QueueFull so the caller can answer 503 instead of piling up work (backpressure).
+"""
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at capacity"""
+
+
+class Job:
+    """State of one submitted job"""
+
+    def __init__(self, fn, args):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0  # bumped on every change, used by progress streams
+
+    def to_dict(self, include_result=True):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'progress': round(self.progress, 3),
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+        if self.error is not None:
+            data['error'] = self.error
+        if include_result and self.status == DONE:
+            data['result'] = self.result
+        return data
+
+
+class JobQueue:
+    """Bounded queue + fixed worker pool with per-job status and progress
+
+    The job function is called as fn(*args, report=callback) where
+    callback(stage, progress) publishes progress between 0 and 1. Finished
+    jobs are kept for result_ttl seconds, and at most max_finished of them
+    (oldest dropped first).
+    """
+
+    def __init__(self, workers=2, max_queued=64, result_ttl=3600, max_finished=1024):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.max_finished = max_finished
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._finished = OrderedDict()  # job id -> finish time, oldest first
+        self._changed = threading.Condition()
+        self._threads = []
+        self._running = 0
+        self._counters = {'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0}
+        self._total_run_seconds = 0.0
+        self._total_wait_seconds = 0.0
+
+    def start(self):
+        """Start worker threads (idempotent)"""
+        with self._changed:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'analysis-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, fn, *args):
+        """Queue a job and return it, or raise QueueFull"""
+        self.start()
+        self._purge_finished()
+        job = Job(fn, args)
+        with self._changed:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._counters['rejected'] += 1
+                raise QueueFull(f'Job queue is full ({self.max_queued} waiting)')
+            self._jobs[job.id] = job
+            self._counters['submitted'] += 1
+        return job
+
+    def get(self, job_id):
+        """Look up a job by id"""
+        with self._changed:
+            return self._jobs.get(job_id)
+
+    def wait_for_update(self, job, seen_version, timeout=15.0):
+        """Block until job.version moves past seen_version or timeout expires"""
+        with self._changed:
+            self._changed.wait_for(lambda: job.version != seen_version, timeout=timeout)
+            return job.version
+
+    def _update(self, job, **changes):
+        with self._changed:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.version += 1
+            self._changed.notify_all()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._changed:
+                self._running += 1
+                self._total_wait_seconds += time.time() - job.created
+            self._update(job, status=RUNNING, stage='starting', started=time.time())
+
+            def report(stage, progress, job=job):
+                self._update(job, stage=stage, progress=progress)
+
+            try:
+                result = job.fn(*job.args, report=report)
+                self._update(job, status=DONE, stage=DONE, progress=1.0, result=result, finished=time.time())
+                outcome = 'completed'
+            except Exception as e:
+                logger.exception("❌ Job %s failed: %s", job.id, e)
+                self._update(job, status=FAILED, stage=FAILED, error=str(e), finished=time.time())
+                outcome = 'failed'
+            finally:
+                self._queue.task_done()
+
+            with self._changed:
+                self._running -= 1
+                self._counters[outcome] += 1
+                self._total_run_seconds += job.finished - job.started
+                # Drop references to the (possibly large) inputs once done
+                job.args = ()
+                self._finished[job.id] = job.finished
+                while len(self._finished) > self.max_finished:
+                    job_id, _ = self._finished.popitem(last=False)
+                    self._jobs.pop(job_id, None)
+
+    def _purge_finished(self):
+        cutoff = time.time() - self.result_ttl
+        with self._changed:
+            while self._finished and next(iter(self._finished.values())) < cutoff:
+                job_id, _ = self._finished.popitem(last=False)
+                self._jobs.pop(job_id, None)
+
+    def stats(self):
+        """Queue depth and throughput counters for sizing workers"""
+        with self._changed:
+            finished = self._counters['completed'] + self._counters['failed']
+            return {
+                'workers': self.workers,
+                'max_queued': self.max_queued,
+                'queue_depth': self._queue.qsize(),
+                'running': self._running,
+                'tracked_jobs': len(self._jobs),
+                **self._counters,
+                'avg_run_seconds': self._total_run_seconds / finished if finished else 0.0,
+                'avg_wait_seconds': self._total_wait_seconds / max(1, finished + self._running)
+            }
@@ -0,0 +1,295 @@
+"""Live analysis of streamed PCM - incremental features with bounded memory per session
+
+The browser sends raw PCM chunks (mono or interleaved, float32 or int16) as
+they are recorded. Each chunk only pays for its own frames:
+
+    resample     soxr stream, state carried between chunks
+    STFT frames  new hops only; mel -> log-mel (floor relative to the loudest
+                 frame so far) -> MFCC, spectral contrast and onset strength
+    chroma       CQT over a short rolling context about once a second (CQT
+                 filter setup dominates its cost), keeping only frames far
+                 enough from both edges; tonnetz from those frames
+    tempo        estimated from a rolling window of onset strengths
+
+Running sums (or exponentially weighted ones, with half_life) replace the
+frame matrices, so memory does not grow with the length of the session.
+Features approximate the offline extractor - log-mel flooring and the CQT
+context differ at the edges - but use the same pooling and feature order.
+"""
+import logging
+import threading
+import time
+import uuid
+
+import librosa
+import numpy as np
+
+from audio_features import HOP_LENGTH, N_FFT, SAMPLE_RATE, pool_features
+
+logger = logging.getLogger(__name__)
+
+try:
+    import soxr
+except ImportError:
+    soxr = None
+
+FLOAT32 = 'f32'
+INT16 = 's16'
+SAMPLE_FORMATS = {FLOAT32: np.dtype('<f4'), INT16: np.dtype('<i2')}
+
+TOP_DB = 80.0
+CHROMA_CONTEXT_SECONDS = 4.0
+CHROMA_MARGIN_SECONDS = 0.75
+CHROMA_STEP_SECONDS = 1.0
+TEMPO_WINDOW_SECONDS = 12.0
+MIN_TEMPO_SECONDS = 3.0
+
+
+class SessionLimit(Exception):
+    """Raised when every live session slot is taken"""
+
+
+class LiveFeatureState:
+    """Incremental 34-feature state for one live stream"""
+
+    def __init__(self, input_sr=SAMPLE_RATE, channels=1, sample_format=FLOAT32, half_life=None):
+        if sample_format not in SAMPLE_FORMATS:
+            raise ValueError(f'sample_format must be one of {", ".join(SAMPLE_FORMATS)}')
+        self.input_sr = int(input_sr)
+        self.channels = int(channels)
+        self.sample_format = sample_format
+        self.half_life = half_life
+
+        self._resampler = None
+        if self.input_sr != SAMPLE_RATE:
+            if soxr is None:
+                raise ValueError(f'Resampling from {self.input_sr} Hz needs the soxr package - send {SAMPLE_RATE} Hz')
+            self._resampler = soxr.ResampleStream(self.input_sr, SAMPLE_RATE, 1, dtype='float32', quality='HQ')
+
+        self._mel_basis = librosa.filters.mel(sr=SAMPLE_RATE, n_fft=N_FFT)
+        self.samples = 0                                # resampled samples received
+        self._pending = np.zeros(0, dtype=np.float32)   # from the start of the next STFT frame
+        self._previous_log_mel = None
+        self._max_db = -np.inf
+
+        # Rolling audio for the CQT chroma; frame f starts at sample f * HOP_LENGTH
+        self._context = np.zeros(0, dtype=np.float32)
+        self._context_start = 0
+        self._chroma_next = 0
+        self._tuning = None
+
+        tempo_frames = int(TEMPO_WINDOW_SECONDS * SAMPLE_RATE / HOP_LENGTH)
+        self._onsets = np.zeros(tempo_frames, dtype=np.float32)
+        self._onset_count = 0
+        self.tempo = 0.0
+
+        self._sums = {}
+        self._weights = {}
+
+    @property
+    def seconds(self):
+        return self.samples / SAMPLE_RATE
+
+    def _decode(self, pcm):
+        dtype = SAMPLE_FORMATS[self.sample_format]
+        usable = len(pcm) - len(pcm) % (dtype.itemsize * self.channels)
+        y = np.frombuffer(pcm[:usable], dtype=dtype).astype(np.float32)
+        if self.sample_format == INT16:
+            y /= 32768.0
+        if self.channels > 1:
+            y = y.reshape(-1, self.channels).mean(axis=1)
+        if self._resampler is not None:
+            y = self._resampler.resample_chunk(y)
+        return y
+
+    def feed(self, pcm):
+        """Fold a chunk of raw PCM bytes into the state; returns the seconds of audio added"""
+        y = self._decode(pcm)
+        # Long chunks go in pieces so the chroma context never skips frames
+        step = int((CHROMA_CONTEXT_SECONDS - 2 * CHROMA_MARGIN_SECONDS - CHROMA_STEP_SECONDS) * SAMPLE_RATE)
+        for start in range(0, len(y), step):
+            self._add_samples(y[start:start + step])
+        return len(y) / SAMPLE_RATE
+
+    def _add_samples(self, y):
+        self.samples += len(y)
+        self._pending = np.concatenate([self._pending, y])
+        self._stft_frames()
+
+        self._context = np.concatenate([self._context, y])
+        self._chroma_frames()
+        # Keep CHROMA_CONTEXT_SECONDS, trimmed on a hop boundary so frame alignment holds
+        excess = len(self._context) - int(CHROMA_CONTEXT_SECONDS * SAMPLE_RATE)
+        if excess > 0:
+            excess -= excess % HOP_LENGTH
+            self._context = self._context[excess:]
+            self._context_start += excess
+
+    def _stft_frames(self):
+        if len(self._pending) < N_FFT:
+            return
+        n_frames = 1 + (len(self._pending) - N_FFT) // HOP_LENGTH
+        span = self._pending[:(n_frames - 1) * HOP_LENGTH + N_FFT]
+        magnitude = np.abs(librosa.stft(span, n_fft=N_FFT, hop_length=HOP_LENGTH, center=False))
+        self._pending = self._pending[n_frames * HOP_LENGTH:]
+
+        # power_to_db(ref=1.0, top_db=80), with the floor relative to the loudest frame SO FAR
+        log_mel = 10.0 * np.log10(np.maximum(1e-10, self._mel_basis @ magnitude ** 2))
+        self._max_db = max(self._max_db, float(log_mel.max()))
+        log_mel = np.maximum(log_mel, self._max_db - TOP_DB)
+
+        self._accumulate('mfcc', librosa.feature.mfcc(S=log_mel, n_mfcc=13))
+        self._accumulate('spectral_contrast', librosa.feature.spectral_contrast(
+            S=magnitude, sr=SAMPLE_RATE, n_fft=N_FFT, hop_length=HOP_LENGTH))
+
+        # Median-aggregated positive log-mel flux, as onset_strength() computes it
+        previous = self._previous_log_mel if self._previous_log_mel is not None else log_mel[:, :1]
+        flux = np.maximum(0.0, np.diff(np.hstack([previous, log_mel]), axis=1))
+        self._add_onsets(np.median(flux, axis=0))
+        self._previous_log_mel = log_mel[:, -1:]
+
+    def _add_onsets(self, onsets):
+        onsets = onsets[-len(self._onsets):]
+        self._onsets = np.roll(self._onsets, -len(onsets))
+        self._onsets[-len(onsets):] = onsets
+        self._onset_count += len(onsets)
+
+        available = min(self._onset_count, len(self._onsets))
+        if available * HOP_LENGTH >= MIN_TEMPO_SECONDS * SAMPLE_RATE:
+            envelope = self._onsets[-available:]
+            if envelope.any():
+                self.tempo = float(librosa.feature.tempo(onset_envelope=envelope, sr=SAMPLE_RATE,
+                                                         hop_length=HOP_LENGTH)[0])
+
+    def _chroma_frames(self):
+        margin = int(CHROMA_MARGIN_SECONDS * SAMPLE_RATE)
+        if len(self._context) < 2 * margin:
+            return
+        first_frame = self._context_start // HOP_LENGTH
+        # Frames need margin audio on both sides - except at the very start, where training padded too
+        lowest = first_frame if self._context_start == 0 else first_frame + -(-margin // HOP_LENGTH)
+        highest = (self.samples - margin) // HOP_LENGTH
+        start = max(self._chroma_next, lowest)
+        if highest - start + 1 < CHROMA_STEP_SECONDS * SAMPLE_RATE / HOP_LENGTH:
+            return
+
+        if self._tuning is None:
+            # Estimated once, from the first context, instead of on every CQT
+            self._tuning = librosa.estimate_tuning(y=self._context, sr=SAMPLE_RATE)
+        # Only the new frames plus margin on each side go through the CQT
+        span_frame = max(first_frame, start - -(-margin // HOP_LENGTH))
+        span = self._context[(span_frame - first_frame) * HOP_LENGTH:]
+        chroma = librosa.feature.chroma_cqt(y=span, sr=SAMPLE_RATE, hop_length=HOP_LENGTH, tuning=self._tuning)
+        chroma = chroma[:, start - span_frame:highest - span_frame + 1]
+        if chroma.shape[1]:
+            self._accumulate('chroma', chroma)
+            self._accumulate('tonnetz', librosa.feature.tonnetz(sr=SAMPLE_RATE, chroma=chroma))
+        self._chroma_next = highest + 1
+
+    def _accumulate(self, name, matrix):
+        n = matrix.shape[1]
+        if name not in self._sums:
+            self._sums[name] = np.zeros(matrix.shape[0])
+            self._weights[name] = 0.0
+        if self.half_life:
+            # Exponentially weighted: a frame half_life seconds old counts half
+            decay = 0.5 ** (HOP_LENGTH / (self.half_life * SAMPLE_RATE))
+            weights = decay ** np.arange(n - 1, -1, -1)
+            self._sums[name] = self._sums[name] * decay ** n + matrix @ weights
+            self._weights[name] = self._weights[name] * decay ** n + float(weights.sum())
+        else:
+            self._sums[name] += matrix.sum(axis=1)
+            self._weights[name] += n
+
+    def features(self):
+        """The 34 features so far, or None until every group has frames"""
+        if len(self._sums) < 4:
+            return None
+        means = {name: (total / self._weights[name])[:, np.newaxis] for name, total in self._sums.items()}
+        return pool_features(self.tempo, means)
+
+
+class LiveSession:
+    """One client's stream: feature state plus the latest update for subscribers"""
+
+    def __init__(self, state):
+        self.id = uuid.uuid4().hex
+        self.state = state
+        self.created = time.time()
+        self.last_seen = self.created
+        self.update = None
+        self.updated_at_seconds = -np.inf
+        self.version = 0
+        self.closed = False
+        self.lock = threading.Lock()          # one chunk at a time per session
+        self._changed = threading.Condition()
+
+    def publish(self, update):
+        with self._changed:
+            self.update = update
+            self.version += 1
+            self._changed.notify_all()
+
+    def close(self):
+        with self._changed:
+            self.closed = True
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait_for_update(self, seen_version, timeout=15.0):
+        """Block until version moves past seen_version or timeout expires"""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != seen_version, timeout=timeout)
+            return self.version
+
+
+class LiveSessions:
+    """Bounded registry of live sessions; idle ones expire"""
+
+    def __init__(self, max_sessions=32, idle_seconds=120.0):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._counters = {'opened': 0, 'expired': 0, 'rejected': 0}
+
+    def _expire(self):
+        cutoff = time.time() - self.idle_seconds
+        for session_id in [sid for sid, session in self._sessions.items() if session.last_seen < cutoff]:
+            self._sessions.pop(session_id).close()
+            self._counters['expired'] += 1
+
+    def open(self, **options):
+        """Start a session (options go to LiveFeatureState), or raise SessionLimit"""
+        state = LiveFeatureState(**options)
+        with self._lock:
+            self._expire()
+            if len(self._sessions) >= self.max_sessions:
+                self._counters['rejected'] += 1
+                raise SessionLimit(f'All {self.max_sessions} live sessions are in use')
+            session = LiveSession(state)
+            self._sessions[session.id] = session
+            self._counters['opened'] += 1
+        logger.info("🎙️ Live session %s opened (%d Hz, %d ch, %s)", session.id, state.input_sr, state.channels,
+                    state.sample_format)
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_seen = time.time()
+            return session
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+            logger.info("🎙️ Live session %s closed after %.1f s of audio", session_id, session.state.seconds)
+        return session is not None
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            return {'active': len(self._sessions), 'max_sessions': self.max_sessions, **self._counters}
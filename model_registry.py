@@ -0,0 +1,256 @@
+"""Lazy, verified loading of the pickled model artifacts
+
+Artifacts are loaded on first use (or by a background warm-up thread), never at
+import time, so starting a worker no longer pays for unpickling the models and
+importing shap/xgboost up front. joblib.load(mmap_mode='r') maps large numpy
+arrays read-only, so forked workers share those pages instead of copying them.
+
+When model_manifest.json is present, every pickle is checked against its
+SHA-256 before it is unpickled, and the manifest version becomes the model
+version used in cache keys.
+
+    python model_registry.py write-manifest --version 1.0
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import joblib
+
+logger = logging.getLogger(__name__)
+
+ARTIFACTS = {
+    'model': 'music_classifier.pkl',
+    'scaler': 'feature_scaler.pkl',
+    'explainer': 'shap_explainer.pkl',
+    'label_encoder': 'label_encoder.pkl'
+}
+MANIFEST_NAME = 'model_manifest.json'
+TRACKED_LIBRARIES = ['numpy', 'scikit-learn', 'xgboost', 'shap', 'librosa']
+
+
+class ArtifactError(Exception):
+    """An artifact is missing, corrupt or does not match the manifest"""
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file, read in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def library_versions():
+    """Installed versions of the libraries the pickles depend on"""
+    from importlib import metadata
+
+    versions = {}
+    for name in TRACKED_LIBRARIES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            pass
+    return versions
+
+
+def write_manifest(directory='.', version=None, artifacts=ARTIFACTS, record_libraries=True):
+    """Write model_manifest.json describing the artifacts in directory"""
+    manifest = {
+        'version': version or datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d%H%M%S'),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'artifacts': {}
+    }
+    for name, filename in artifacts.items():
+        path = os.path.join(directory, filename)
+        manifest['artifacts'][name] = {
+            'path': filename,
+            'sha256': file_sha256(path),
+            'bytes': os.path.getsize(path)
+        }
+    if record_libraries:
+        manifest['libraries'] = library_versions()
+
+    with open(os.path.join(directory, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.write('\n')
+    return manifest
+
+
+class ArtifactRegistry:
+    """Loads each artifact once, on first access, and reports readiness
+
+    Artifacts are available as attributes: registry.model, registry.scaler, ...
+    """
+
+    def __init__(self, directory='.', artifacts=ARTIFACTS, mmap_mode='r', expected_version=None):
+        self.directory = directory
+        self.artifacts = dict(artifacts)
+        self.mmap_mode = mmap_mode
+        self.expected_version = expected_version
+
+        self._loaded = {}
+        self._errors = {}
+        self._load_seconds = {}
+        self._lock = threading.RLock()
+        self._manifest = None
+        self._version = None
+        self._warmup_thread = None
+        self._warmup_done = False
+        self._warmup_error = None
+
+    def __getattr__(self, name):
+        # Only called when normal lookup fails, i.e. for artifact names
+        artifacts = self.__dict__.get('artifacts', {})
+        if name in artifacts:
+            return self.get(name)
+        raise AttributeError(name)
+
+    @property
+    def manifest(self):
+        """Parsed manifest, or {} when there is none"""
+        if self._manifest is None:
+            path = os.path.join(self.directory, MANIFEST_NAME)
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    self._manifest = json.load(f)
+            else:
+                logger.warning("⚠️ No %s found - artifacts will be loaded unverified", MANIFEST_NAME)
+                self._manifest = {}
+        return self._manifest
+
+    @property
+    def version(self):
+        """Model version: from the manifest, else a hash of the artifact files"""
+        if self._version is None:
+            version = self.manifest.get('version')
+            if version is None:
+                digest = hashlib.sha256()
+                for filename in self.artifacts.values():
+                    path = os.path.join(self.directory, filename)
+                    digest.update(filename.encode('utf-8'))
+                    digest.update(file_sha256(path).encode('ascii') if os.path.exists(path) else b'missing')
+                version = digest.hexdigest()[:16]
+            self._version = str(version)
+        return self._version
+
+    def _verify(self, name, path):
+        manifest = self.manifest
+        if not manifest:
+            return
+
+        if self.expected_version and str(manifest.get('version')) != str(self.expected_version):
+            raise ArtifactError(f"Manifest version {manifest.get('version')} != expected {self.expected_version}")
+
+        entry = manifest.get('artifacts', {}).get(name)
+        if entry is None:
+            raise ArtifactError(f'{name} is not listed in {MANIFEST_NAME}')
+        actual = file_sha256(path)
+        if actual != entry['sha256']:
+            raise ArtifactError(f'Checksum mismatch for {path}: expected {entry["sha256"][:12]}..., got {actual[:12]}...')
+
+        # Library drift doesn't stop loading, but unpickling across versions is worth a warning
+        installed = library_versions()
+        for library, built_with in manifest.get('libraries', {}).items():
+            if library in installed and installed[library] != built_with:
+                logger.warning("⚠️ %s was built with %s %s, running %s", name, library, built_with, installed[library])
+
+    def get(self, name):
+        """Load (once) and return an artifact"""
+        loaded = self._loaded.get(name)
+        if loaded is not None:
+            return loaded
+
+        with self._lock:
+            if name in self._loaded:
+                return self._loaded[name]
+
+            path = os.path.join(self.directory, self.artifacts[name])
+            started = time.perf_counter()
+            try:
+                self._verify(name, path)
+                artifact = joblib.load(path, mmap_mode=self.mmap_mode)
+            except Exception as e:
+                self._errors[name] = str(e)
+                logger.error("❌ Error loading %s from %s: %s", name, path, e)
+                raise
+            self._load_seconds[name] = time.perf_counter() - started
+            self._errors.pop(name, None)
+            self._loaded[name] = artifact
+            logger.info("✅ Loaded %s in %.2fs", name, self._load_seconds[name])
+            return artifact
+
+    def load_all(self):
+        """Load every artifact now (e.g. before forking workers)"""
+        for name in self.artifacts:
+            self.get(name)
+
+    def start_warmup(self, after=None):
+        """Load everything in a background thread, then run after() if given"""
+        def warm():
+            try:
+                self.load_all()
+                if after is not None:
+                    after()
+            except Exception as e:
+                logger.exception("❌ Warm-up failed: %s", e)
+                self._warmup_error = str(e)
+            finally:
+                self._warmup_done = True
+
+        with self._lock:
+            if self._warmup_thread is None:
+                self._warmup_thread = threading.Thread(target=warm, name='artifact-warmup', daemon=True)
+                self._warmup_thread.start()
+        return self._warmup_thread
+
+    @property
+    def ready(self):
+        """True once every artifact is loaded (and a started warm-up has finished)"""
+        if len(self._loaded) != len(self.artifacts):
+            return False
+        return self._warmup_thread is None or self._warmup_done
+
+    def status(self):
+        """Per-artifact state for the readiness endpoint"""
+        artifacts = {}
+        for name, filename in self.artifacts.items():
+            if name in self._loaded:
+                state = {'state': 'loaded', 'load_seconds': round(self._load_seconds[name], 3)}
+            elif name in self._errors:
+                state = {'state': 'error', 'error': self._errors[name]}
+            else:
+                state = {'state': 'pending'}
+            artifacts[name] = {'path': filename, **state}
+        return {
+            'ready': self.ready,
+            'model_version': self.version,
+            'verified': bool(self.manifest),
+            'warmup_error': self._warmup_error,
+            'artifacts': artifacts
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Model artifact manifest tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    write = subparsers.add_parser('write-manifest', help=f'(re)write {MANIFEST_NAME} for the current pickles')
+    write.add_argument('--directory', default='.')
+    write.add_argument('--version', default=None, help='model version string (default: timestamp)')
+    write.add_argument('--no-libraries', action='store_true',
+                       help='omit library versions (when this environment did not build the pickles)')
+    args = parser.parse_args()
+
+    if args.command == 'write-manifest':
+        manifest = write_manifest(args.directory, args.version, record_libraries=not args.no_libraries)
+        print(f"✅ Wrote {MANIFEST_NAME} (version {manifest['version']}, {len(manifest['artifacts'])} artifacts)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Lean response formats - field selection, an index-only view, MessagePack and compression
+
+    ?fields=genre_prediction,shap_analysis.mode   keep only these paths ('success' always stays)
+    ?view=compact                                 features as arrays + indexes into /features/metadata
+    ?format=msgpack  (or Accept: application/msgpack)
+    Accept-Encoding: br / gzip                    bodies over MIN_COMPRESS_BYTES are compressed
+
+The compact view drops every per-feature static string (display name,
+explanation, analogy, listen tip, confidence, category, unit), the
+debug_info block and the timeline's feature and genre names. Clients fetch
+those ONCE from the metadata document, which is versioned by its ETag and
+cached for a long time.
+"""
+import gzip
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+FORMATS = (JSON, MSGPACK)
+MIMETYPES = {JSON: 'application/json', MSGPACK: 'application/msgpack'}
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+
+FULL = 'full'
+COMPACT = 'compact'
+VIEWS = (FULL, COMPACT)
+
+MIN_COMPRESS_BYTES = 1024
+MSGPACK_AVAILABLE = msgpack is not None
+
+
+def parse_fields(value):
+    """'a,b.c' -> [['a'], ['b', 'c']]; empty -> None (everything)"""
+    paths = [field.strip().split('.') for field in (value or '').split(',') if field.strip()]
+    return paths or None
+
+
+def select_fields(payload, paths):
+    """Keep only the given key paths; lists are walked element by element"""
+    if isinstance(payload, list):
+        return [select_fields(item, paths) for item in payload]
+    if not isinstance(payload, dict):
+        return payload
+
+    wanted = {}
+    for path in paths:
+        wanted.setdefault(path[0], []).append(path[1:])
+    selected = {'success': payload['success']} if 'success' in payload else {}
+    for key, rests in wanted.items():
+        if key not in payload:
+            continue
+        # 'a' and 'a.b' together means all of 'a'
+        selected[key] = payload[key] if any(not rest for rest in rests) else select_fields(payload[key], rests)
+    return selected
+
+
+def compact_analysis(results, metadata, metadata_url):
+    """Index-only version of one analysis payload (anything else passes through unchanged)"""
+    if not isinstance(results, dict) or 'features_by_category' not in results:
+        return results
+
+    translated = {feature['name']: feature
+                  for members in results['features_by_category'].values() for feature in members}
+    values, levels, interpretations, explanations = [], [], [], {}
+    for i, meta in enumerate(metadata['features']):
+        feature = translated.get(meta['name'])
+        if feature is None:
+            values.append(None)
+            levels.append(None)
+            interpretations.append(None)
+            continue
+        values.append(feature['value'])
+        levels.append(feature['visual_level'])
+        # Bucket labels become an index into metadata; raw-value strings are sent as-is
+        interpretation = feature['interpretation']
+        labels = meta['interpretations']
+        interpretations.append(labels.index(interpretation) if interpretation in labels else interpretation)
+        if feature['explanation'] != meta['explanation']:
+            explanations[str(i)] = feature['explanation']
+
+    compact = {key: value for key, value in results.items()
+               if key not in ('features_by_category', 'debug_info', 'shap_analysis')}
+    compact['view'] = COMPACT
+    compact['metadata_url'] = metadata_url
+    compact['features'] = {
+        'values': values,
+        'visual_levels': levels,
+        'interpretations': interpretations,
+        'explanations': explanations
+    }
+
+    shap = results.get('shap_analysis')
+    if shap is not None and 'feature_importance' in shap:
+        importance = shap['feature_importance']
+        shap = {key: value for key, value in shap.items() if key != 'feature_importance'}
+        shap['values'] = [importance.get(meta['name']) for meta in metadata['features']]
+    if shap is not None:
+        compact['shap_analysis'] = shap
+
+    # Timeline columns follow the metadata's feature and genre order
+    timeline = results.get('timeline')
+    if timeline is not None:
+        compact['timeline'] = {key: value for key, value in timeline.items() if key not in ('feature_names', 'genres')}
+    return compact
+
+
+def wants_msgpack(fmt, accept):
+    """True for ?format=msgpack, or an Accept header listing MessagePack (when msgpack is installed)"""
+    if not MSGPACK_AVAILABLE:
+        return False
+    if fmt:
+        return fmt == MSGPACK
+    return any(mimetype in (accept or '') for mimetype in MSGPACK_MIMETYPES)
+
+
+def encode(payload, fmt, dumps):
+    """Serialise payload as JSON (with the app's dumps) or MessagePack; returns bytes"""
+    if fmt == MSGPACK:
+        if msgpack is None:
+            raise ValueError('MessagePack is not available - pip install msgpack')
+        return msgpack.packb(payload, use_bin_type=True)
+    return dumps(payload).encode('utf-8')
+
+
+def accepted_encodings(accept_encoding):
+    """Content codings the client accepts, ignoring q=0"""
+    codings = set()
+    for part in (accept_encoding or '').lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            codings.add(coding.strip())
+    return codings
+
+
+def compress(body, accept_encoding, level=6):
+    """(body, content coding or None) - br when available, else gzip; small bodies stay as they are"""
+    if len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    codings = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in codings:
+        return brotli.compress(body, quality=min(level, 11)), 'br'
+    if 'gzip' in codings:
+        return gzip.compress(body, compresslevel=level, mtime=0), 'gzip'
+    return body, None
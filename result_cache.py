@@ -0,0 +1,134 @@
+"""Content-addressed cache for analysis results
+
+Entries are keyed by a hash of the uploaded audio bytes plus the version of the
+model artifacts, so a retrained model never serves stale predictions. An
+in-process LRU tier answers repeat uploads instantly; an optional SQLite tier
+keeps results across restarts and shares them between worker processes.
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def hash_bytes(data):
+    """SHA-256 hex digest of raw bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + optional SQLite) cache of analysis payloads
+
+    Values are JSON-serialisable dicts such as {'features': {...}, 'results': {...}}.
+    They are stored encoded, so callers always get a private copy back and the
+    memory tier can be bounded by bytes as well as by entry count.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, ttl_seconds=24 * 3600, db_path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+
+        self._entries = OrderedDict()  # key -> (created, encoded payload)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if db_path:
+            with self._connect() as db:
+                db.execute('CREATE TABLE IF NOT EXISTS results '
+                           '(key TEXT PRIMARY KEY, created REAL NOT NULL, payload TEXT NOT NULL)')
+
+    def _connect(self):
+        # One short-lived connection per call keeps the tier safe across threads
+        return sqlite3.connect(self.db_path, timeout=5.0)
+
+    def _expired(self, created, now):
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def make_key(self, audio_bytes, version):
+        """Cache key for an upload analysed with a given model version"""
+        return f'{hash_bytes(audio_bytes)}:{version}'
+
+    def get(self, key):
+        """Return the cached payload for key, or None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, encoded = entry
+                if self._expired(created, now):
+                    self._drop(key)
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(encoded)
+
+        if self.db_path:
+            try:
+                with self._connect() as db:
+                    row = db.execute('SELECT created, payload FROM results WHERE key = ?', (key,)).fetchone()
+                    if row is not None and self._expired(row[0], now):
+                        db.execute('DELETE FROM results WHERE key = ?', (key,))
+                        row = None
+            except sqlite3.Error as e:
+                logger.warning("⚠️ Result cache disk read failed: %s", e)
+                row = None
+
+            if row is not None:
+                with self._lock:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                return json.loads(row[1])
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, payload):
+        """Store a payload in every configured tier"""
+        created = time.time()
+        encoded = json.dumps(payload)
+        with self._lock:
+            self._store(key, created, encoded)
+
+        if self.db_path:
+            try:
+                with self._connect() as db:
+                    db.execute('INSERT OR REPLACE INTO results (key, created, payload) VALUES (?, ?, ?)',
+                               (key, created, encoded))
+            except sqlite3.Error as e:
+                logger.warning("⚠️ Result cache disk write failed: %s", e)
+
+    def _store(self, key, created, encoded):
+        if key in self._entries:
+            self._drop(key)
+        if len(encoded) > self.max_bytes:
+            return
+        self._entries[key] = (created, encoded)
+        self._bytes += len(encoded)
+        # Evict least recently used entries until both limits hold
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+
+    def _drop(self, key):
+        _, encoded = self._entries.pop(key)
+        self._bytes -= len(encoded)
+
+    def stats(self):
+        """Counters for monitoring"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,304 @@
+"""Persistent index of analysed tracks for "songs that sound like this" search
+
+Scaled feature vectors live in one growable float32 file that is memory-mapped
+(vectors.f32), with one JSON line of metadata per row beside it (tracks.jsonl).
+A row only counts once its metadata line is written, so a crash mid-append
+leaves a readable index. Several processes (e.g. gunicorn workers) can share
+one directory: appends take an exclusive lock file and first pick up any rows
+the other processes added. Tracks are identified by the SHA-256 of their audio
+bytes, so re-analysing the same file never adds a duplicate.
+
+Search is an exact, vectorized Euclidean scan by default. For large libraries
+an IVF (inverted file) mode clusters the vectors with k-means and only scans
+the clusters closest to the query.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): appends are only serialised within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+VECTORS_NAME = 'vectors.f32'
+METADATA_NAME = 'tracks.jsonl'
+LOCK_NAME = 'write.lock'
+
+EXACT = 'exact'
+APPROX = 'approx'
+AUTO = 'auto'
+SEARCH_MODES = (AUTO, EXACT, APPROX)
+
+
+def kmeans(vectors, n_clusters, iterations=20, seed=0):
+    """Plain Lloyd's k-means - returns (centroids, assignments)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    assignments = np.zeros(len(vectors), dtype=np.int64)
+    for _ in range(iterations):
+        assignments = nearest_rows(centroids, vectors)
+        for cluster in range(n_clusters):
+            members = vectors[assignments == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+            else:
+                # Re-seed empty clusters on a random vector
+                centroids[cluster] = vectors[rng.integers(len(vectors))]
+    return centroids, assignments
+
+
+def squared_distances(matrix, queries, matrix_norms=None):
+    """(queries, rows) squared Euclidean distances via ||a||^2 - 2ab + ||b||^2"""
+    if matrix_norms is None:
+        matrix_norms = np.einsum('ij,ij->i', matrix, matrix)
+    query_norms = np.einsum('ij,ij->i', queries, queries)
+    distances = query_norms[:, np.newaxis] - 2.0 * queries @ matrix.T + matrix_norms[np.newaxis, :]
+    return np.maximum(distances, 0.0)
+
+
+def nearest_rows(matrix, vectors, chunk=65536):
+    """Index of the closest matrix row for every vector, in bounded-memory chunks"""
+    norms = np.einsum('ij,ij->i', matrix, matrix)
+    return np.concatenate([squared_distances(matrix, vectors[i:i + chunk], norms).argmin(axis=1)
+                           for i in range(0, len(vectors), chunk)]) if len(vectors) else np.zeros(0, np.int64)
+
+
+class TrackIndex:
+    """Append-only, memory-mapped vector index with a JSON-lines metadata sidecar
+
+    IVF clusters are trained lazily on first approximate search and retrained
+    once the index has doubled since the last training.
+    Writes are serialised within a process by a lock and across processes by
+    flock on a lock file; every read first picks up rows other processes
+    appended.
+    """
+
+    def __init__(self, directory, dim, approx_min_tracks=20000, n_probe=8):
+        self.directory = directory
+        self.dim = dim
+        self.approx_min_tracks = approx_min_tracks
+        self.n_probe = n_probe
+
+        self._lock = threading.RLock()
+        self._vectors = None     # memmap (capacity, dim) float32
+        self._norms = np.zeros(0, dtype=np.float32)
+        self._metadata = []
+        self._metadata_bytes = 0  # how much of tracks.jsonl _metadata covers
+        self._positions = {}     # track id -> row
+        self._centroids = None
+        self._lists = None       # cluster -> array of rows
+        self._trained_rows = 0
+        self._opened = False
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.directory, VECTORS_NAME)
+
+    @property
+    def metadata_path(self):
+        return os.path.join(self.directory, METADATA_NAME)
+
+    def _open(self):
+        if self._opened:
+            self._refresh()
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._map(max(self._capacity_on_disk(), 1024))
+        self._refresh()
+        self._opened = True
+        logger.info("🗂️ Track index opened with %d tracks", len(self._metadata))
+
+    def _capacity_on_disk(self):
+        if not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (4 * self.dim)
+
+    def _refresh(self):
+        # Read the metadata lines appended since the last read - by this or another process
+        if not os.path.exists(self.metadata_path) or os.path.getsize(self.metadata_path) <= self._metadata_bytes:
+            return
+        with open(self.metadata_path, 'rb') as f:
+            f.seek(self._metadata_bytes)
+            data = f.read()
+
+        entries, consumed = [], 0
+        for line in data.splitlines(keepends=True):
+            try:
+                # A line without its newline is still being written (or was torn by a crash)
+                entry = json.loads(line) if line.endswith(b'\n') else None
+            except ValueError:
+                entry = None
+            if entry is None:
+                break
+            entries.append(entry)
+            consumed += len(line)
+        if not entries:
+            return
+
+        start, end = len(self._metadata), len(self._metadata) + len(entries)
+        capacity = self._capacity_on_disk()
+        if capacity < end:
+            raise ValueError(f'{self.vectors_path} holds {capacity} rows but {METADATA_NAME} lists {end} tracks')
+        if capacity > self._vectors.shape[0]:
+            # Another process grew the file
+            self._map(capacity)
+
+        for row, entry in enumerate(entries, start):
+            self._positions[entry['track_id']] = row
+        self._metadata.extend(entries)
+        self._metadata_bytes += consumed
+        rows = self._vectors[start:end]
+        self._norms[start:end] = np.einsum('ij,ij->i', rows, rows)
+        if self._lists is not None:
+            clusters = nearest_rows(self._centroids, np.asarray(rows))
+            for cluster in np.unique(clusters):
+                self._lists[cluster] = np.append(self._lists[cluster], start + np.flatnonzero(clusters == cluster))
+
+    @contextmanager
+    def _write_lock(self):
+        # Exclusive across processes for the duration of one append
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_NAME), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def _map(self, capacity):
+        # Grow the backing file, then (re)map it; existing rows keep their offsets
+        with open(self.vectors_path, 'ab') as f:
+            if f.tell() < capacity * 4 * self.dim:
+                f.truncate(capacity * 4 * self.dim)
+        if self._vectors is not None:
+            self._vectors.flush()
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        norms = np.zeros(capacity, dtype=np.float32)
+        norms[:len(self._norms)] = self._norms[:capacity]
+        self._norms = norms
+
+    def _rows(self):
+        return self._vectors[:len(self._metadata)]
+
+    def __len__(self):
+        with self._lock:
+            self._open()
+            return len(self._metadata)
+
+    def __contains__(self, track_id):
+        with self._lock:
+            self._open()
+            return track_id in self._positions
+
+    def add(self, track_id, vector, **metadata):
+        """Append a track; returns False when it is already indexed"""
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f'Expected a {self.dim}-dimensional vector, got {vector.shape[0]}')
+
+        with self._lock, self._write_lock():
+            # Under the file lock _refresh sees every row, so row below is really the next free one
+            self._open()
+            if track_id in self._positions:
+                return False
+            if os.path.exists(self.metadata_path) and os.path.getsize(self.metadata_path) > self._metadata_bytes:
+                # Only a crashed append leaves an unreadable tail while the lock is free
+                logger.warning("⚠️ Dropping a torn line from %s", self.metadata_path)
+                with open(self.metadata_path, 'r+b') as f:
+                    f.truncate(self._metadata_bytes)
+
+            row = len(self._metadata)
+            if row >= self._vectors.shape[0]:
+                self._map(2 * self._vectors.shape[0])
+            self._vectors[row] = vector
+            self._vectors.flush()
+
+            entry = {'track_id': track_id, 'added': time.time(), **metadata}
+            with open(self.metadata_path, 'ab') as f:
+                f.write((json.dumps(entry) + '\n').encode('utf-8'))
+            # _refresh picks up the line just written, like one from any other process
+            self._refresh()
+            return True
+
+    def vector(self, track_id):
+        """Stored vector for a track, or None"""
+        with self._lock:
+            self._open()
+            row = self._positions.get(track_id)
+            return None if row is None else np.array(self._vectors[row])
+
+    def metadata(self, track_id):
+        with self._lock:
+            self._open()
+            row = self._positions.get(track_id)
+            return None if row is None else dict(self._metadata[row])
+
+    def _train(self):
+        rows = np.asarray(self._rows(), dtype=np.float32)
+        n_clusters = max(1, int(np.sqrt(len(rows))))
+        # A sample is plenty to place the centroids; every row is then assigned
+        sample = rows[np.random.default_rng(0).choice(len(rows), min(len(rows), 256 * n_clusters), replace=False)]
+        self._centroids, _ = kmeans(sample, n_clusters)
+        assignments = nearest_rows(self._centroids, rows)
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(n_clusters + 1))
+        self._lists = [order[bounds[i]:bounds[i + 1]] for i in range(n_clusters)]
+        self._trained_rows = len(rows)
+        logger.info("🧭 Trained IVF index: %d clusters over %d tracks", n_clusters, len(rows))
+
+    def _candidates(self, query):
+        if self._lists is None or len(self._metadata) >= 2 * self._trained_rows:
+            self._train()
+        centroid_distances = squared_distances(self._centroids, query[np.newaxis, :])[0]
+        probe = np.argsort(centroid_distances)[:self.n_probe]
+        return np.concatenate([self._lists[cluster] for cluster in probe])
+
+    def search(self, vector, k=5, mode=AUTO, exclude=()):
+        """k nearest tracks as a list of metadata dicts with a 'distance' field
+
+        mode 'auto' scans exactly below approx_min_tracks and uses IVF above.
+        """
+        query = np.asarray(vector, dtype=np.float32).reshape(-1)
+        with self._lock:
+            self._open()
+            total = len(self._metadata)
+            if total == 0:
+                return []
+            if mode == AUTO:
+                mode = APPROX if total >= self.approx_min_tracks else EXACT
+
+            if mode == APPROX:
+                rows = self._candidates(query)
+                matrix, norms = self._vectors[rows], self._norms[rows]
+            else:
+                # Exact scan straight off the memmap - no copy of the matrix
+                rows = np.arange(total)
+                matrix, norms = self._rows(), self._norms[:total]
+
+            distances = squared_distances(matrix, query[np.newaxis, :], norms)[0]
+            excluded = [self._positions[track_id] for track_id in exclude if track_id in self._positions]
+            if excluded:
+                distances[np.isin(rows, excluded)] = np.inf
+
+            k = min(k, int(np.isfinite(distances).sum()))
+            if k <= 0:
+                return []
+            top = np.argpartition(distances, k - 1)[:k]
+            top = top[np.argsort(distances[top])]
+            return [{**self._metadata[rows[i]], 'distance': float(np.sqrt(distances[i]))} for i in top]
+
+    def stats(self):
+        with self._lock:
+            self._open()
+            return {
+                'tracks': len(self._metadata),
+                'ivf_clusters': 0 if self._lists is None else len(self._lists),
+                'ivf_trained_tracks': self._trained_rows
+            }
@@ -0,0 +1,355 @@
+"""Rebuild the model artifacts from a labelled audio dataset - the notebook's training, scripted
+
+Features come from the SAME extract_music_features the backend serves with
+(exact profile), so training and serving can't drift apart. Each file's 34
+features are cached by content hash in a memory-mapped matrix:
+
+    FEATURE_CACHE/features.npy   (rows, 34) float64, read with mmap_mode='r'
+    FEATURE_CACHE/index.json     row -> content hash, failed hashes, extractor signature
+
+so retraining on a grown dataset only extracts the new files, in parallel
+across cores. A cache built with other frontend settings is ignored. With
+--frame-store, stored spectral frames are reused (and filled) as well.
+
+The scaler, class-weighted XGBoost classifier, label encoder and SHAP
+TreeExplainer are fitted with fixed seeds and written with a manifest (and
+the compiled tree arrays) into OUTPUT/VERSION, ready for MUSIC_MODEL_DIR:
+
+    DATASET/<genre>/<track>.wav     (or genre.00042.wav files directly under DATASET)
+
+    python train_model.py ~/datasets/genres_original --genres classical disco jazz rock --version 2.0
+    python train_model.py ~/datasets/genres_original --workers 8 --frame-store frame_store
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import joblib
+import numpy as np
+
+from audio_features import FEATURE_NAMES, content_hash, extract_with_timings, frontend_signature
+from bulk_analyze import find_audio_files
+from frame_store import FrameStore
+from instrumentation import configure_logging
+from model_registry import ARTIFACTS, write_manifest
+
+logger = logging.getLogger(__name__)
+
+REPORT_NAME = 'training_report.json'
+SEED = 42
+# The settings music_classifier.pkl was trained with in genre_classifier.ipynb
+MODEL_PARAMS = {
+    'n_estimators': 200,
+    'max_depth': 6,
+    'learning_rate': 0.1,
+    'subsample': 0.8,
+    'colsample_bytree': 0.8,
+    'eval_metric': 'mlogloss'
+}
+
+
+def cache_signature():
+    """Extractor settings plus feature layout - cached rows from anything else are recomputed"""
+    return f'{frontend_signature()};features={",".join(FEATURE_NAMES)}'
+
+
+class FeatureCache:
+    """Per-file feature rows keyed by content hash, in one memory-mapped matrix"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.keys = []
+        self.failed = set()
+        self.matrix = np.zeros((0, len(FEATURE_NAMES)))
+        self._rows = {}
+
+        index_path = os.path.join(directory, 'index.json')
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('signature') != cache_signature():
+            logger.warning("⚠️ Feature cache in %s was built with other extractor settings - ignoring it", directory)
+            return
+        matrix = np.load(os.path.join(directory, 'features.npy'), mmap_mode='r')
+        # features.npy is replaced before index.json, so it never has fewer rows than the index
+        self.keys = index['keys']
+        self.failed = set(index['failed'])
+        self.matrix = matrix[:len(self.keys)]
+        self._rows = {key: row for row, key in enumerate(self.keys)}
+
+    def __contains__(self, key):
+        return key in self._rows or key in self.failed
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rows(self, keys):
+        """Feature matrix for the given keys, in order (one fancy-indexed read of the map)"""
+        return np.asarray(self.matrix[[self._rows[key] for key in keys]])
+
+    def add(self, extracted):
+        """Append {key: features dict or None} and write both files atomically"""
+        new = {key: features for key, features in extracted.items() if key not in self}
+        if not new:
+            return
+        self.failed.update(key for key, features in new.items() if features is None)
+        added = [(key, features) for key, features in new.items() if features is not None]
+        os.makedirs(self.directory, exist_ok=True)
+
+        matrix_path = os.path.join(self.directory, 'features.npy')
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.npy')
+        os.close(fd)
+        try:
+            matrix = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float64,
+                                               shape=(len(self.keys) + len(added), len(FEATURE_NAMES)))
+            matrix[:len(self.keys)] = self.matrix
+            for row, (_, features) in enumerate(added, start=len(self.keys)):
+                matrix[row] = [features[name] for name in FEATURE_NAMES]
+            matrix.flush()
+            del matrix
+            os.replace(temp_path, matrix_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        keys = self.keys + [key for key, _ in added]
+        index = {'signature': cache_signature(), 'keys': keys, 'failed': sorted(self.failed)}
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.json')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(temp_path, os.path.join(self.directory, 'index.json'))
+
+        self.keys = keys
+        self.matrix = np.load(matrix_path, mmap_mode='r')
+        self._rows = {key: row for row, key in enumerate(keys)}
+
+
+def label_for(path):
+    """Genre of a dataset file: its top-level directory, else the filename prefix (blues.00042.wav)"""
+    parts = path.replace('\\', '/').split('/')
+    return parts[0] if len(parts) > 1 else parts[0].split('.')[0]
+
+
+def scan_dataset(root, genres=None):
+    """(relative paths, labels) of every audio file under root, optionally only some genres"""
+    paths, labels = [], []
+    for path in find_audio_files(root):
+        label = label_for(path)
+        if genres is None or label in genres:
+            paths.append(path)
+            labels.append(label)
+    return paths, labels
+
+
+def extract_dataset(root, paths, cache, workers, frame_store=None, checkpoint=256):
+    """Content hash per path, with every file not yet in the cache extracted in a process pool"""
+    started = time.perf_counter()
+    keys = [content_hash(os.path.join(root, path)) for path in paths]
+    todo = {}
+    for path, key in zip(paths, keys):
+        if key not in cache and key not in todo:
+            todo[key] = path
+    logger.info("🎧 %d files, %d cached, %d to extract (hashed in %.1f s)", len(paths), len(paths) - len(todo),
+                len(todo), time.perf_counter() - started)
+    if not todo:
+        return keys
+
+    pending = {}
+    completed = 0
+    started = time.perf_counter()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        remaining = iter(todo.items())
+        in_flight = {}
+        while True:
+            # A bounded window of submissions keeps memory flat and Ctrl-C responsive
+            while len(in_flight) < 2 * workers:
+                key, path = next(remaining, (None, None))
+                if key is None:
+                    break
+                in_flight[executor.submit(extract_with_timings, os.path.join(root, path), path, frame_store)] = key
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key = in_flight.pop(future)
+                try:
+                    pending[key], _ = future.result()
+                except Exception as e:
+                    logger.warning("⚠️ %s failed: %s", todo[key], e)
+                    pending[key] = None
+                completed += 1
+
+            # Checkpoint now and then - an interrupted run keeps what it extracted
+            if len(pending) >= checkpoint:
+                cache.add(pending)
+                pending = {}
+                rate = completed / (time.perf_counter() - started)
+                logger.info("⏱️ %d/%d files, %.2f files/s", completed, len(todo), rate)
+    except KeyboardInterrupt:
+        logger.warning("⏹️ Interrupted - caching finished files, rerun to resume")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        cache.add(pending)
+        executor.shutdown(wait=True)
+    logger.info("✅ Extracted %d files in %.1f s", completed, time.perf_counter() - started)
+    return keys
+
+
+def fit_artifacts(feature_values, labels, test_size=0.2, seed=SEED, n_jobs=None):
+    """(artifacts dict, metrics) - the notebook's pipeline: stratified split, scaler, weighted XGBoost, SHAP"""
+    import shap
+    import xgboost as xgb
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+    from sklearn.utils.class_weight import compute_class_weight
+
+    label_encoder = LabelEncoder()
+    y = label_encoder.fit_transform(labels)
+    if test_size:
+        X_train, X_test, y_train, y_test = train_test_split(feature_values, y, test_size=test_size,
+                                                            random_state=seed, stratify=y)
+    else:
+        X_train, X_test, y_train, y_test = feature_values, None, y, None
+
+    scaler = StandardScaler()
+    X_train_scaled = scaler.fit_transform(X_train)
+
+    # Balanced class weights, as the deployed model was trained
+    class_weights = compute_class_weight('balanced', classes=np.unique(y_train), y=y_train)
+    sample_weights = class_weights[np.searchsorted(np.unique(y_train), y_train)]
+
+    logger.info("🔥 Training XGBoost on %d rows x %d features, %d classes...", *X_train.shape,
+                len(label_encoder.classes_))
+    started = time.perf_counter()
+    model = xgb.XGBClassifier(**MODEL_PARAMS, random_state=seed, n_jobs=n_jobs)
+    model.fit(X_train_scaled, y_train, sample_weight=sample_weights)
+    metrics = {'train_rows': len(y_train), 'fit_seconds': round(time.perf_counter() - started, 2)}
+
+    if X_test is not None:
+        predictions = model.predict(scaler.transform(X_test))
+        names = [str(name) for name in label_encoder.classes_]
+        metrics.update({
+            'test_rows': len(y_test),
+            'accuracy': float(accuracy_score(y_test, predictions)),
+            'per_class': classification_report(y_test, predictions, labels=range(len(names)), target_names=names,
+                                               output_dict=True, zero_division=0),
+            'confusion_matrix': confusion_matrix(y_test, predictions, labels=range(len(names))).tolist()
+        })
+
+    explainer = shap.TreeExplainer(model)
+    return {'model': model, 'scaler': scaler, 'explainer': explainer, 'label_encoder': label_encoder}, metrics
+
+
+def save_artifacts(artifacts, directory, version, report):
+    """Pickles, compiled tree arrays, training report and manifest into directory"""
+    from inference import TREES_NAME, SklearnBackend, TreeArrayBackend, boundary_rows, probe_rows, verify
+
+    os.makedirs(directory, exist_ok=True)
+    for name, filename in ARTIFACTS.items():
+        joblib.dump(artifacts[name], os.path.join(directory, filename))
+    with open(os.path.join(directory, REPORT_NAME), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+        f.write('\n')
+    manifest = write_manifest(directory, version)
+
+    # Compile now so the first request after a deploy doesn't have to
+    try:
+        engine = TreeArrayBackend.from_xgboost(artifacts['model'], artifacts['scaler'], manifest['version'])
+        probe = probe_rows(artifacts['scaler'])
+        verify(engine, SklearnBackend(artifacts['scaler'], artifacts['model']),
+               np.vstack([probe, boundary_rows(engine, probe)]))
+        engine.save(os.path.join(directory, TREES_NAME))
+    except Exception as e:
+        logger.warning("⚠️ Could not compile tree arrays (the backend will fall back to the pickled model): %s", e)
+    return manifest
+
+
+def train(root, output, version=None, genres=None, workers=1, cache_dir='feature_cache', frame_store=None,
+          test_size=0.2, seed=SEED):
+    """Extract (or reuse) features for the dataset, fit every artifact and write them; returns the report"""
+    paths, labels = scan_dataset(root, genres)
+    if not paths:
+        raise ValueError(f'No audio files found under {root}')
+
+    cache = FeatureCache(cache_dir)
+    keys = extract_dataset(root, paths, cache, workers, frame_store)
+    usable = [i for i, key in enumerate(keys) if key not in cache.failed]
+    if len(usable) < len(keys):
+        logger.warning("⚠️ %d files could not be extracted and are left out", len(keys) - len(usable))
+
+    keys = [keys[i] for i in usable]
+    labels = [labels[i] for i in usable]
+    artifacts, metrics = fit_artifacts(cache.rows(keys), labels, test_size, seed, workers)
+
+    version = version or datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%d%H%M%S')
+    # Same files + same labels + same seed + same libraries = the same model
+    dataset_digest = hashlib.sha256()
+    for key, label in zip(keys, labels):
+        dataset_digest.update(f'{key}:{label}\n'.encode('utf-8'))
+    report = {
+        'version': version,
+        'dataset': {
+            'root': os.path.abspath(root),
+            'files': len(paths),
+            'used': len(usable),
+            'sha256': dataset_digest.hexdigest(),
+            'class_counts': {str(genre): labels.count(genre) for genre in sorted(set(labels))}
+        },
+        'extractor': cache_signature(),
+        'seed': seed,
+        'test_size': test_size,
+        'model_params': MODEL_PARAMS,
+        'metrics': metrics
+    }
+    directory = os.path.join(output, version)
+    save_artifacts(artifacts, directory, version, report)
+    report['directory'] = directory
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the genre model artifacts from a labelled audio dataset')
+    parser.add_argument('root', help='dataset directory: one sub-directory per genre')
+    parser.add_argument('--output', default='models', help='artifacts go to OUTPUT/VERSION')
+    parser.add_argument('--version', default=None, help='model version string (default: timestamp)')
+    parser.add_argument('--genres', nargs='+', default=None, help='only train on these genres')
+    parser.add_argument('--workers', type=int, default=None, help='extraction processes (default: all cores)')
+    parser.add_argument('--feature-cache', default='feature_cache', help='directory of cached per-file features')
+    parser.add_argument('--frame-store', default=None, help='directory of stored spectral frames (reused and filled)')
+    parser.add_argument('--test-size', type=float, default=0.2, help='held-out share for the report (0 = train on all)')
+    parser.add_argument('--seed', type=int, default=SEED)
+    args = parser.parse_args()
+
+    configure_logging()
+    workers = args.workers or (len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1)
+    try:
+        report = train(args.root, args.output, args.version, set(args.genres) if args.genres else None, workers,
+                       args.feature_cache, FrameStore(args.frame_store) if args.frame_store else None,
+                       args.test_size, args.seed)
+    except KeyboardInterrupt:
+        return 130
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    metrics = report['metrics']
+    accuracy = f", held-out accuracy {metrics['accuracy']:.1%}" if 'accuracy' in metrics else ''
+    print(f"✅ Model {report['version']} trained on {metrics['train_rows']} files{accuracy} -> {report['directory']}")
+    print(f"   Serve it with MUSIC_MODEL_DIR={report['directory']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Production entry point - an app factory for prefork servers such as gunicorn
+
+    gunicorn -c gunicorn.conf.py "wsgi:create_app()"
+
+create_app() runs in the gunicorn master when preload_app is on (it is in
+gunicorn.conf.py): the pickled models are unpickled ONCE and every forked
+worker shares those pages copy-on-write instead of loading its own copy.
+Nothing that starts a thread or a process pool - or runs xgboost, OpenMP or
+numba, whose thread pools do not survive a fork - runs before the fork: the
+warm-up (which also builds the demo store), the feature extraction pool and
+the job workers all start inside each worker (start_worker / lazily on first
+use).
+
+Settings come from the same MUSIC_* environment variables as backend.py,
+plus MUSIC_WORKERS, MUSIC_THREADS, MUSIC_TIMEOUT and MUSIC_GRACEFUL_TIMEOUT
+read by gunicorn.conf.py.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Whether workers warm up after the fork - read before backend's own import-time warm-up is disabled
+WARMUP = os.environ.get('MUSIC_WARMUP', '1') != '0'
+
+
+def create_app(preload=True):
+    """The Flask app with debug off and (by default) every artifact loaded"""
+    # A warm-up thread started before the fork would not exist in the workers
+    os.environ['MUSIC_WARMUP'] = '0'
+    import backend
+
+    backend.app.debug = False
+    if preload:
+        backend.artifacts.load_all()
+        logger.info("📦 Preloaded model %s before forking workers", backend.artifacts.version)
+    return backend.app
+
+
+def start_worker():
+    """Per-worker start-up after the fork: JIT, model warm-up and demo store in the background"""
+    import backend
+
+    if WARMUP:
+        backend.artifacts.start_warmup(after=backend.warm_up)
+
+
+def stop_worker():
+    """Graceful worker exit: let in-flight extractions finish, then stop the pool"""
+    import backend
+
+    backend.shutdown()